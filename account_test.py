@@ -0,0 +1,88 @@
+import pytest
+
+from starkware.starknet.public.abi import get_selector_from_name
+from starkware.starkware_utils.error_handling import StarkException
+from lib.utils import hash_message, hash_multicall, multicall_args
+from zigzag_test import flatten, uint
+
+
+@pytest.mark.asyncio
+async def test_multicall_approve_and_fill(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    quote_asset = exchange.quote_asset
+
+    buy = make_message(buyer, 0, 10, (2, 1), 2 ** 40)
+    sell = make_message(seller, 1, 10, (1, 1), 2 ** 40)
+    fill_calldata = flatten(
+        (buy.to_starknet_args(buyer_signer), sell.to_starknet_args(seller_signer), (1, 1), 4)
+    )
+    calls = [
+        (quote_asset.contract_address, "approve", [contract.contract_address, *uint(7)]),
+        (contract.contract_address, "fill_order", fill_calldata),
+        (
+            quote_asset.contract_address,
+            "allowance",
+            [buyer.contract_address, contract.contract_address],
+        ),
+    ]
+    (nonce,) = (await buyer.get_nonce().call()).result
+
+    execution_info = await buyer_signer.send_transactions(buyer, calls)
+    # Only allowance returns anything: fill_order spent 4 of the allowance set by approve
+    assert execution_info.result.response == list(uint(3))
+    assert (await buyer.get_nonce().call()).result == (nonce + 1,)
+    statuses = await contract.get_order_statuses([buy.hash(), sell.hash()]).call()
+    assert statuses.result.filled == [4, 4]
+
+    # A single-call signature over the same first call is not valid for a multicall
+    selector = get_selector_from_name("approve")
+    call_array, calldata = multicall_args([(calls[0][0], selector, calls[0][2])])
+    signature = buyer_signer.sign(
+        hash_message(buyer.contract_address, calls[0][0], selector, calls[0][2], nonce + 1)
+    )
+    with pytest.raises(StarkException):
+        await buyer.execute_multicall(call_array, calldata, nonce + 1).invoke(
+            signature=list(signature)
+        )
+
+    # Every call must lie within the calldata, before it is hashed or executed. The calldata of
+    # execute_multicall is preceded by its length and followed by the nonce, so each of these
+    # calls reads valid arguments and is signed over the felts it reads: only the bounds check
+    # can reject it
+    approve_calldata = [1234, 7, 0]
+    outside = [len(approve_calldata), *approve_calldata, nonce + 1]
+    for name, data_offset, data_len in (
+        ("approve", 1, 3),
+        ("approve", -1, 3),
+        ("allowance", 2, 2),
+        ("allowance", -1, 2),
+    ):
+        selector = get_selector_from_name(name)
+        read = outside[data_offset + 1 : data_offset + 1 + data_len]
+        signature = buyer_signer.sign(
+            hash_multicall(
+                buyer.contract_address, [(quote_asset.contract_address, selector, read)], nonce + 1
+            )
+        )
+        with pytest.raises(StarkException) as e_info:
+            await buyer.execute_multicall(
+                [(quote_asset.contract_address, selector, data_offset, data_len)],
+                approve_calldata,
+                nonce + 1,
+            ).invoke(signature=list(signature))
+        assert "assert_nn_le(call_array.data_" in str(e_info.value)
+    assert (await buyer.get_nonce().call()).result == (nonce + 1,)
+
+    # A failing call reverts the whole transaction, including the nonce bump
+    with pytest.raises(StarkException):
+        await buyer_signer.send_transactions(
+            buyer,
+            [
+                (quote_asset.contract_address, "approve", [1234, *uint(1)]),
+                (quote_asset.contract_address, "transfer", [1234, *uint(10 ** 30)]),
+            ],
+        )
+    assert (await buyer.get_nonce().call()).result == (nonce + 1,)
+    allowance = await quote_asset.allowance(buyer.contract_address, 1234).call()
+    assert allowance.result.res == uint(0)
@@ -0,0 +1,165 @@
+import random
+import time
+from fractions import Fraction
+
+import pytest
+
+from lib.auction import BatchAuction
+from lib.indexer import EventIndexer
+from lib.zz_message import DOMAIN_PREFIX, MESSAGE_PREFIX, Order, ZZ_Message
+from zigzag_test import get_balances
+
+BASE_ASSET = 0x111
+QUOTE_ASSET = 0x222
+SIGNATURE = (1, 2)
+
+
+def message(side, base_quantity, price, expiration=1000, sender=0x333):
+    order = Order(BASE_ASSET, QUOTE_ASSET, side, base_quantity, price, expiration)
+    return ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, sender, order)
+
+
+def test_solve_maximizes_volume():
+    rng = random.Random(15)
+    for _ in range(200):
+        auction = BatchAuction()
+        orders = [
+            message(
+                rng.randrange(2), rng.randrange(1, 20), (rng.randrange(1, 10), rng.randrange(1, 4))
+            )
+            for _ in range(rng.randrange(1, 12))
+        ]
+        for msg in orders:
+            auction.add_order(msg, SIGNATURE)
+
+        # Every limit price, tried one by one
+        def volume(price):
+            demand = sum(
+                m.order.base_quantity
+                for m in orders
+                if m.order.side == 0 and Fraction(*m.order.price.to_starknet_args()) >= price
+            )
+            supply = sum(
+                m.order.base_quantity
+                for m in orders
+                if m.order.side == 1 and Fraction(*m.order.price.to_starknet_args()) <= price
+            )
+            return min(demand, supply)
+
+        best = max(volume(Fraction(*m.order.price.to_starknet_args())) for m in orders)
+        result = auction.solve()
+        if best == 0:
+            assert result is None
+            continue
+        price = Fraction(*result.clearing_price)
+        assert result.volume == best == volume(price)
+        for fills, side in ((result.buy_fills, 0), (result.sell_fills, 1)):
+            assert sum(fill for _, fill in fills) == best
+            for order, fill in fills:
+                assert order.message.order.side == side
+                assert 0 < fill <= order.remaining
+                limit = Fraction(*order.message.order.price.to_starknet_args())
+                assert limit >= price if side == 0 else limit <= price
+
+
+def test_solve_rejects_mixed_markets():
+    auction = BatchAuction()
+    auction.add_order(message(0, 10, (2, 1)), SIGNATURE)
+    auction.add_order(message(1, 10, (4, 2)), SIGNATURE)
+    # Equal limits written differently are one price level
+    result = auction.solve()
+    assert result.volume == 10
+    assert Fraction(*result.clearing_price) == 2
+
+    order = Order(BASE_ASSET, 0x999, 1, 10, (1, 1), 1000)
+    auction.add_order(ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, 0x333, order), SIGNATURE)
+    with pytest.raises(ValueError):
+        auction.solve()
+
+
+@pytest.mark.timing
+def test_solve_throughput():
+    rng = random.Random(0)
+    n = 100000
+    auction = BatchAuction()
+    for i in range(n):
+        side = i % 2
+        ticks = rng.randrange(1, 1000)
+        # Overlapping limits, so that most candidate prices trade something
+        price = (99500 + ticks, 1000) if side == 0 else (100500 - ticks, 1000)
+        auction.add_order(message(side, rng.randrange(1, 10 ** 18), price), SIGNATURE)
+
+    start = time.perf_counter()
+    result = auction.solve()
+    elapsed = time.perf_counter() - start
+    assert result.volume > 0
+    assert elapsed < 10, f"{n / elapsed:.0f} orders/s"
+
+
+@pytest.mark.asyncio
+async def test_settle_batch_auction(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    base_asset, quote_asset = exchange.base_asset, exchange.quote_asset
+
+    def signed(account, signer, side, base_quantity, price, expiration=2 ** 40):
+        msg = make_message(account, side, base_quantity, price, expiration)
+        return msg, msg.sign(signer)
+
+    auction = BatchAuction()
+    orders = [
+        signed(buyer, buyer_signer, 0, 10, (3, 1)),
+        signed(buyer, buyer_signer, 0, 10, (2, 1)),
+        signed(buyer, buyer_signer, 0, 10, (1, 2)),
+        signed(seller, seller_signer, 1, 12, (1, 1)),
+        signed(seller, seller_signer, 1, 30, (2, 1)),
+    ]
+    for msg, signature in orders:
+        auction.add_order(msg, signature)
+    # At 2/1 the first two buys meet 42 on sale, at 1/1 only 12 is for sale
+    result = auction.solve()
+    assert (result.clearing_price, result.volume) == ((2, 1), 20)
+    assert [fill for _, fill in result.sell_fills] == [12, 8]
+
+    tokens = [base_asset, quote_asset]
+    accounts = [buyer, seller]
+    before = await get_balances(tokens, accounts)
+    indexer = EventIndexer(exchange.starknet.state, contract.contract_address)
+    indexer.ledger.checkpoint = len(exchange.starknet.state.events)
+    await contract.settle_batch_auction(**result.to_starknet_args()).invoke()
+    after = await get_balances(tokens, accounts)
+    # buyer base, seller base, buyer quote, seller quote
+    assert [a[0] - b[0] for a, b in zip(after, before)] == [20, -20, -40, 40]
+    # The 2 buys and 2 sells pay out in 3 trades
+    assert [fill.base_fill_quantity for fill in indexer.poll()] == [10, 2, 8]
+
+    hashes = [msg.hash() for msg, _ in orders]
+    statuses = await contract.get_order_statuses(hashes).call()
+    assert statuses.result.filled == [10, 10, 0, 12, 8]
+
+    args = result.to_starknet_args()
+    # The same orders again overfill them
+    with pytest.raises(Exception) as e_info:
+        await contract.settle_batch_auction(**args).invoke()
+    assert "Invalid order" in str(e_info.value)
+
+    # The fills of both sides must balance
+    buy, buy_signature = signed(buyer, buyer_signer, 0, 10, (2, 1), 2 ** 40 + 1)
+    sell, sell_signature = signed(seller, seller_signer, 1, 10, (2, 1), 2 ** 40 + 1)
+    unbalanced = dict(
+        buy_orders=[buy.to_signed_starknet_args(*buy_signature)],
+        buy_fills=[5],
+        sell_orders=[sell.to_signed_starknet_args(*sell_signature)],
+        sell_fills=[4],
+        clearing_price=(2, 1),
+    )
+    with pytest.raises(Exception) as e_info:
+        await contract.settle_batch_auction(**unbalanced).invoke()
+    assert "Unbalanced auction" in str(e_info.value)
+
+    # A clearing price above a buy limit is rejected
+    with pytest.raises(Exception) as e_info:
+        await contract.settle_batch_auction(
+            **dict(unbalanced, sell_fills=[5], clearing_price=(5, 2))
+        ).invoke()
+    assert "Invalid order" in str(e_info.value)
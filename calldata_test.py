@@ -0,0 +1,167 @@
+import random
+import time
+
+import pytest
+
+from lib.calldata import CalldataSerializer
+from lib.zz_message import PriceRatio
+from zigzag_test import assert_same_message, flatten, random_message
+
+
+def random_fills(rng, n):
+    return [
+        (
+            (random_message(rng, 0), (rng.randrange(2 ** 251), rng.randrange(2 ** 251))),
+            (random_message(rng, 1), (rng.randrange(2 ** 251), rng.randrange(2 ** 251))),
+            (rng.randrange(1, 10 ** 6), rng.randrange(1, 10 ** 6)),
+            rng.randrange(1, 10 ** 20),
+        )
+        for _ in range(n)
+    ]
+
+
+def batch_args(fills):
+    return dict(
+        buy_orders=[buy for buy, _, _, _ in fills],
+        sell_orders=[sell for _, sell, _, _ in fills],
+        fill_prices=[fill_price for _, _, fill_price, _ in fills],
+        base_fill_quantities=[quantity for _, _, _, quantity in fills],
+    )
+
+
+def nested_batch_args(fills):
+    return dict(
+        buy_orders=[buy.to_signed_starknet_args(*sig) for (buy, sig), _, _, _ in fills],
+        sell_orders=[sell.to_signed_starknet_args(*sig) for _, (sell, sig), _, _ in fills],
+        fill_prices=[fill_price for _, _, fill_price, _ in fills],
+        base_fill_quantities=[quantity for _, _, _, quantity in fills],
+    )
+
+
+def test_encode_and_decode():
+    rng = random.Random(19)
+    serializer = CalldataSerializer()
+    (buy, sell, fill_price, quantity), *_ = fills = random_fills(rng, 3)
+
+    args = dict(buy_order=buy, sell_order=sell, fill_price=fill_price, base_fill_quantity=quantity)
+    calldata = serializer.encode("fill_order", args)
+    assert calldata == flatten(
+        [buy[0].to_signed_starknet_args(*buy[1]), sell[0].to_signed_starknet_args(*sell[1])]
+        + [fill_price, quantity]
+    )
+    decoded = serializer.decode("fill_order", calldata)
+    assert_same_message(decoded["buy_order"], buy)
+    assert_same_message(decoded["sell_order"], sell)
+    assert tuple(decoded["fill_price"]) == fill_price
+    assert decoded["base_fill_quantity"] == quantity
+
+    # Struct objects are read by member name
+    args["fill_price"] = PriceRatio(*fill_price)
+    assert serializer.encode("fill_order", args) == calldata
+
+    nested = nested_batch_args(fills)
+    expected = flatten(
+        [len(fills), nested["buy_orders"], len(fills), nested["sell_orders"]]
+        + [len(fills), nested["fill_prices"], len(fills), nested["base_fill_quantities"]]
+    )
+    calldata = serializer.encode("fill_orders_batch", batch_args(fills))
+    assert calldata == expected
+    decoded = serializer.decode("fill_orders_batch", calldata)
+    for decoded_buy, (buy, _, _, _) in zip(decoded["buy_orders"], fills):
+        assert_same_message(decoded_buy, buy)
+    assert decoded["base_fill_quantities"] == [quantity for _, _, _, quantity in fills]
+
+    # Into a larger buffer, after other calldata
+    buffer = [None] * (len(calldata) + 10)
+    end = serializer.encode_into(buffer, 5, "fill_orders_batch", batch_args(fills))
+    assert (end, buffer[5:end]) == (5 + len(calldata), calldata)
+
+    packed = dict(
+        buy_order=buy[0].to_signed_packed_starknet_args(*buy[1]),
+        sell_order=sell[0].to_signed_packed_starknet_args(*sell[1]),
+        fill_price=fill_price,
+        base_fill_quantity=quantity,
+    )
+    calldata = serializer.encode("fill_order_packed", packed)
+    assert calldata == flatten(list(packed.values()))
+    assert tuple(serializer.decode("fill_order_packed", calldata)["buy_order"]) == packed[
+        "buy_order"
+    ]
+
+
+def test_large_batch():
+    rng = random.Random(19)
+    # 10k messages
+    fills = random_fills(rng, 5000)
+    serializer = CalldataSerializer()
+    nested = nested_batch_args(fills)
+    expected = flatten(
+        [len(fills), nested["buy_orders"], len(fills), nested["sell_orders"]]
+        + [len(fills), nested["fill_prices"], len(fills), nested["base_fill_quantities"]]
+    )
+
+    args = batch_args(fills)
+    buffer = [0] * serializer.calldata_size("fill_orders_batch", args)
+    assert serializer.encode_into(buffer, 0, "fill_orders_batch", args) == len(expected)
+    assert buffer == expected
+
+    decoded = serializer.decode("fill_orders_batch", buffer)
+    for side in ("buy_orders", "sell_orders"):
+        assert len(decoded[side]) == len(fills)
+        for decoded_message, message in zip(decoded[side], args[side]):
+            assert_same_message(decoded_message, message)
+    assert [tuple(price) for price in decoded["fill_prices"]] == args["fill_prices"]
+    assert decoded["base_fill_quantities"] == args["base_fill_quantities"]
+
+
+@pytest.mark.timing
+def test_serializer_throughput():
+    rng = random.Random(19)
+    # 10k messages
+    fills = random_fills(rng, 5000)
+    serializer = CalldataSerializer()
+    n = 2 * len(fills)
+
+    start = time.perf_counter()
+    nested = nested_batch_args(fills)
+    expected = flatten(
+        [len(fills), nested["buy_orders"], len(fills), nested["sell_orders"]]
+        + [len(fills), nested["fill_prices"], len(fills), nested["base_fill_quantities"]]
+    )
+    nested_rate = n / (time.perf_counter() - start)
+
+    args = batch_args(fills)
+    start = time.perf_counter()
+    buffer = [0] * serializer.calldata_size("fill_orders_batch", args)
+    serializer.encode_into(buffer, 0, "fill_orders_batch", args)
+    encode_rate = n / (time.perf_counter() - start)
+    assert buffer == expected
+
+    rates = f"nested tuples {nested_rate:.0f}, encode_into {encode_rate:.0f} messages/s"
+    assert encode_rate > nested_rate, rates
+
+
+@pytest.mark.asyncio
+async def test_invoke_with_encoded_calldata(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    serializer = CalldataSerializer()
+
+    def message(account, signer, side):
+        message = make_message(account, side, 5, (1, 1), 2 ** 40)
+        return message, message.sign(signer)
+
+    fills = [(message(buyer, buyer_signer, 0), message(seller, seller_signer, 1), (1, 1), 5)]
+    calldata = serializer.encode("fill_orders_batch", batch_args(fills))
+    # The same calldata the testing framework builds from nested tuples
+    assert contract.fill_orders_batch(**nested_batch_args(fills)).calldata == calldata
+
+    await exchange.starknet.state.invoke_raw(
+        contract_address=contract.contract_address,
+        selector="fill_orders_batch",
+        calldata=calldata,
+        caller_address=0,
+    )
+    (buy, _), (sell, _), _, _ = fills[0]
+    statuses = await contract.get_order_statuses([buy.hash(), sell.hash()]).call()
+    assert statuses.result.filled == [5, 5]
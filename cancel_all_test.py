@@ -0,0 +1,49 @@
+import pytest
+
+from lib.validation import FillValidator
+
+
+@pytest.mark.asyncio
+async def test_cancel_all_orders(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+
+    def fill(buy, sell):
+        return contract.fill_order(
+            buy_order=buy.to_starknet_args(buyer_signer),
+            sell_order=sell.to_starknet_args(seller_signer),
+            fill_price=(1, 1),
+            base_fill_quantity=1,
+        )
+
+    buy = make_message(buyer, 0, 10, (1, 1), 2 ** 40)
+    sells = [make_message(seller, 1, 10, (1, 1), 2 ** 40 + i) for i in range(1000)]
+    await fill(buy, sells[0]).call()
+
+    execution_info = await contract.cancel_all_orders().invoke(
+        caller_address=seller.contract_address
+    )
+    assert execution_info.result.epoch == 1
+    (epoch,) = (await contract.get_order_epoch(seller.contract_address).call()).result
+    assert epoch == 1
+
+    # One call cancelled all thousand sells, and nothing of the buyer
+    validator = FillValidator()
+    errors = validator.validate(
+        [buy] * len(sells),
+        sells,
+        [(1, 1)] * len(sells),
+        [1] * len(sells),
+        sell_epochs=[epoch] * len(sells),
+    )
+    assert errors == ["assert_nn_le(sell_epoch, sell_order.epoch)"] * len(sells)
+    for sell in (sells[0], sells[999]):
+        with pytest.raises(Exception) as e_info:
+            await fill(buy, sell).call()
+        assert "Invalid order" in str(e_info.value)
+    await fill(buy, make_message(seller, 1, 10, (1, 1), 2 ** 40, epoch=1)).invoke()
+
+    # Cancelling again costs the same, however many orders it cancels
+    second = await contract.cancel_all_orders().invoke(caller_address=seller.contract_address)
+    assert second.result.epoch == 2
+    assert second.call_info.cairo_usage.n_steps == execution_info.call_info.cairo_usage.n_steps
@@ -0,0 +1,90 @@
+import asyncio
+import os
+from collections import namedtuple
+
+import pytest
+import pytest_asyncio
+
+from starkware.starknet.testing.starknet import Starknet
+from lib.contract_cache import (
+    compile_contract,
+    copy_state,
+    fork_contract,
+    use_contract_hash_cache,
+)
+from lib.utils import Signer
+from lib.zz_message import DOMAIN_PREFIX, MESSAGE_PREFIX, Order, ZZ_Message
+from zigzag_test import ACCOUNT_FILE, CONTRACT_FILE, ERC20_FILE, deploy_exchange
+
+Exchange = namedtuple(
+    "Exchange",
+    "starknet seller_signer buyer_signer seller buyer base_asset quote_asset contract",
+)
+
+SELLER_SIGNER = Signer(1234322181823212312)
+BUYER_SIGNER = Signer(1039489391002310220)
+
+
+def pytest_configure(config):
+    # Shared by every test, so each contract hash is read from disk at most once per session
+    use_contract_hash_cache()
+    config.addinivalue_line(
+        "markers", "timing: a wall-clock benchmark, only run with BENCHMARK_TIMINGS=1"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    # Wall-clock rates depend on the machine and its load, so they do not gate a normal run
+    if os.environ.get("BENCHMARK_TIMINGS"):
+        return
+    skip = pytest.mark.skip(reason="set BENCHMARK_TIMINGS=1 to run wall-clock benchmarks")
+    for item in items:
+        if "timing" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def exchange_snapshot():
+    """The state left by deploy_exchange, built once per session."""
+    starknet = await Starknet.empty()
+    contracts = await deploy_exchange(starknet, SELLER_SIGNER, BUYER_SIGNER)
+    return starknet.state, contracts
+
+
+@pytest.fixture
+def exchange(exchange_snapshot):
+    """A private copy of exchange_snapshot, with its contracts bound to the copy."""
+    state, contracts = exchange_snapshot
+    starknet = Starknet(copy_state(state))
+    abis = [
+        compile_contract(path).abi
+        for path in (ACCOUNT_FILE, ACCOUNT_FILE, ERC20_FILE, ERC20_FILE, CONTRACT_FILE)
+    ]
+    forked = [fork_contract(c, starknet.state, abi) for c, abi in zip(contracts, abis)]
+    return Exchange(starknet, SELLER_SIGNER, BUYER_SIGNER, *forked)
+
+
+@pytest.fixture
+def make_message(exchange):
+    """Builds the ZZ_Message of an account in the market of the exchange fixture."""
+
+    def make_message(account, side, base_quantity, price, expiration, epoch=0):
+        order = Order(
+            exchange.base_asset.contract_address,
+            exchange.quote_asset.contract_address,
+            side,
+            base_quantity,
+            price,
+            expiration,
+            epoch,
+        )
+        return ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, account.contract_address, order)
+
+    return make_message
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from starkware.cairo.lang.vm.crypto import pedersen_hash
+from lib.contract_cache import (
+    ContractHashCache,
+    compile_contract,
+    copy_state,
+    fork_contract,
+    source_hash,
+)
+from zigzag_test import ERC20_FILE, uint
+
+CONTRACT = """%lang starknet
+from starkware.cairo.common.cairo_builtins import HashBuiltin
+from helpers.values import VALUE
+
+@view
+func value() -> (res : felt):
+    return (VALUE)
+end
+"""
+
+
+def write_tree(root, value):
+    os.makedirs(root / "helpers", exist_ok=True)
+    (root / "contract.cairo").write_text(CONTRACT)
+    (root / "helpers" / "values.cairo").write_text(f"const VALUE = {value}\n")
+    return str(root / "contract.cairo")
+
+
+def test_compile_contract_cache(tmp_path):
+    root = tmp_path / "src"
+    cache_dir = str(tmp_path / "cache")
+    path = write_tree(root, 1)
+    cairo_path = (str(root),)
+
+    contract_def = compile_contract(path, cache_dir, cairo_path)
+    (cache_file,) = os.listdir(cache_dir)
+    assert cache_file == f"contract-{source_hash(path, cairo_path)}.json"
+    mtime = os.path.getmtime(os.path.join(cache_dir, cache_file))
+    assert compile_contract(path, cache_dir, cairo_path) is contract_def
+    assert os.path.getmtime(os.path.join(cache_dir, cache_file)) == mtime
+
+    # Editing an imported file changes the key, and the old definition stays cached
+    old_key = source_hash(path, cairo_path)
+    write_tree(root, 2)
+    assert source_hash(path, cairo_path) != old_key
+    new_def = compile_contract(path, cache_dir, cairo_path)
+    assert new_def.program.data != contract_def.program.data
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_contract_hash_cache(tmp_path):
+    cache = ContractHashCache(str(tmp_path))
+    key = (0xABC, pedersen_hash)
+    assert key not in cache
+    cache[key] = 0x123
+    assert ContractHashCache(str(tmp_path))[key] == 0x123
+
+    # Other hash functions are only cached in memory
+    other_key = (0xABC, lambda x, y: 0)
+    cache[other_key] = 0x456
+    assert cache[other_key] == 0x456
+    assert other_key not in ContractHashCache(str(tmp_path))
+    assert os.listdir(tmp_path) == ["contract_hash-abc"]
+
+
+@pytest.mark.asyncio
+async def test_copy_state(exchange):
+    state = exchange.starknet.state
+    state_copy = copy_state(state)
+    definitions = state.state.contract_definitions
+    assert state_copy.state.contract_definitions.maps[0] is not definitions.maps[0]
+    for key, contract_def in definitions.items():
+        assert state_copy.state.contract_definitions[key] is contract_def
+
+    # Transactions on the copy leave the original untouched
+    base_asset = exchange.base_asset
+    abi = compile_contract(ERC20_FILE).abi
+    forked = fork_contract(base_asset, state_copy, abi)
+    await forked.approve(123, uint(5)).invoke(caller_address=exchange.seller.contract_address)
+    seller = exchange.seller.contract_address
+    assert (await forked.allowance(seller, 123).call()).result.res == uint(5)
+    assert (await base_asset.allowance(seller, 123).call()).result.res == uint(0)
@@ -0,0 +1,99 @@
+import pytest
+
+from lib.validation import FillValidator
+from zigzag_test import FEE_OWNER, fill_orders_batch_args, get_balances, uint
+
+
+@pytest.mark.asyncio
+async def test_protocol_fee(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    base_asset, quote_asset = exchange.base_asset, exchange.quote_asset
+    expirations = iter(range(2 ** 40, 2 ** 41))
+
+    def fill(base_quantity):
+        expiration = next(expirations)
+        buy = make_message(buyer, 0, base_quantity, (1, 1), expiration)
+        sell = make_message(seller, 1, base_quantity, (1, 1), expiration)
+        return buy, buyer_signer, sell, seller_signer, (1, 1), base_quantity
+
+    tokens = [base_asset, quote_asset]
+    accounts = [buyer, seller, contract]
+
+    async def deltas(invocation):
+        before = await get_balances(tokens, accounts)
+        execution_info = await invocation.invoke()
+        after = await get_balances(tokens, accounts)
+        return [a[0] - b[0] for a, b in zip(after, before)], execution_info
+
+    async def accrued():
+        return (await contract.get_accrued_fees(base_asset.contract_address).call()).result.amount
+
+    (bips,) = (await contract.get_protocol_fee_bips().call()).result
+    assert bips == 0
+    await contract.set_protocol_fee_bips(30).invoke(caller_address=FEE_OWNER)
+    (bips,) = (await contract.get_protocol_fee_bips().call()).result
+    assert bips == 30
+
+    # fill_order collects the 30 bips fee on the base asset from the seller, with a third
+    # transfer_from into the exchange
+    buy, buy_signer, sell, sell_signer, fill_price, quantity = fill(1000)
+    single = contract.fill_order(
+        buy_order=buy.to_starknet_args(buy_signer),
+        sell_order=sell.to_starknet_args(sell_signer),
+        fill_price=fill_price,
+        base_fill_quantity=quantity,
+    )
+    # buyer, seller and exchange base, then buyer, seller and exchange quote. The other calls
+    # check the signatures
+    balance_deltas, execution_info = await deltas(single)
+    assert balance_deltas == [997, -1000, 3, -1000, 1000, 0]
+    token_addresses = {token.contract_address for token in tokens}
+    assert [
+        (call.to_address, call.calldata)
+        for call in execution_info.internal_calls
+        if call.to_address in token_addresses
+    ] == [
+        (base_asset.contract_address, [seller.contract_address, buyer.contract_address, 997, 0]),
+        (quote_asset.contract_address, [buyer.contract_address, seller.contract_address, 1000, 0]),
+        (base_asset.contract_address, [seller.contract_address, contract.contract_address, 3, 0]),
+    ]
+    assert await accrued() == 3
+
+    # A netted batch keeps the fee of every fill in the exchange without a transfer of its own
+    netted = contract.fill_orders_batch_netted(
+        **fill_orders_batch_args([fill(1000), fill(2000), fill(100)])
+    )
+    balance_deltas, _ = await deltas(netted)
+    assert balance_deltas == [3091, -3100, 9, -3100, 3100, 0]
+    assert await accrued() == 12
+
+    # The client checks take the fee set on chain
+    validator = FillValidator()
+    buy, buy_signer, sell, sell_signer, fill_price, quantity = fill(1000)
+    assert validator.validate([buy], [sell], [fill_price], [quantity], protocol_fee_bips=30) == [
+        None
+    ]
+
+    # Only the owner sets the fee and sweeps, and the fee is at most 100%
+    for invocation in (
+        contract.set_protocol_fee_bips(0),
+        contract.sweep_fees(base_asset.contract_address),
+    ):
+        with pytest.raises(Exception) as e_info:
+            await invocation.invoke(caller_address=seller.contract_address)
+        assert "Caller is not the owner" in str(e_info.value)
+    with pytest.raises(Exception) as e_info:
+        await contract.set_protocol_fee_bips(10001).invoke(caller_address=FEE_OWNER)
+    assert "Invalid fee" in str(e_info.value)
+
+    # The exchange holds every fee it accrued, and one sweep pays them all out
+    assert await get_balances([base_asset], [contract]) == [uint(await accrued())]
+    execution_info = await contract.sweep_fees(base_asset.contract_address).invoke(
+        caller_address=FEE_OWNER
+    )
+    assert execution_info.result.amount == 12
+    assert await accrued() == 0
+    (owner_balance,) = (await base_asset.balance_of(FEE_OWNER).call()).result
+    assert owner_balance == uint(12)
+    assert await get_balances([base_asset], [contract]) == [uint(0)]
@@ -0,0 +1,101 @@
+import pytest
+
+from lib.indexer import (
+    AllOrdersCancelled,
+    EventIndexer,
+    FileFillLedger,
+    OrderCancelled,
+    OrderFilled,
+)
+from zigzag_test import fill_orders_batch_args
+
+
+class ResumedSource:
+    """An event source whose history before start can no longer be read."""
+
+    def __init__(self, events, start):
+        self.events = [None] * start + events[start:]
+
+
+@pytest.mark.asyncio
+async def test_index_fills_and_cancels(exchange, make_message, tmp_path):
+    starknet, contract = exchange.starknet, exchange.contract
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer = exchange.seller, exchange.buyer
+
+    ledger_file = str(tmp_path / "fills.jsonl")
+    indexer = EventIndexer(starknet.state, contract.contract_address, FileFillLedger(ledger_file))
+    # The token transfers of deploy_exchange are not exchange events
+    assert indexer.poll() == []
+    assert indexer.ledger.checkpoint == len(starknet.state.events)
+
+    buy = make_message(buyer, 0, 30, (2, 1), 2 ** 40)
+    sell = make_message(seller, 1, 20, (1, 1), 2 ** 40)
+    await contract.fill_order(
+        buy_order=buy.to_starknet_args(buyer_signer),
+        sell_order=sell.to_starknet_args(seller_signer),
+        fill_price=(3, 2),
+        base_fill_quantity=5,
+    ).invoke()
+    first_fill = OrderFilled(
+        buy.hash(), sell.hash(), 5, (3, 2), buyer.contract_address, seller.contract_address
+    )
+    assert indexer.poll() == [first_fill]
+    assert indexer.poll() == []
+
+    # Resuming from the ledger file only reads what was emitted after the checkpoint
+    other_sell = make_message(seller, 1, 10, (1, 1), 2 ** 40 + 1)
+    fills = [
+        (buy, buyer_signer, sell, seller_signer, (3, 2), 10),
+        (buy, buyer_signer, other_sell, seller_signer, (1, 1), 10),
+    ]
+    await contract.fill_orders_batch_netted(**fill_orders_batch_args(fills)).invoke()
+    await contract.cancel_order(sell.to_starknet_args(seller_signer)).invoke(
+        caller_address=seller.contract_address
+    )
+    ledger = FileFillLedger(ledger_file)
+    assert ledger.fills == [first_fill]
+    resumed = EventIndexer(
+        ResumedSource(starknet.state.events, ledger.checkpoint), contract.contract_address, ledger
+    )
+    assert resumed.poll() == [
+        OrderFilled(
+            buy.hash(), sell.hash(), 10, (3, 2), buyer.contract_address, seller.contract_address
+        ),
+        OrderFilled(
+            buy.hash(),
+            other_sell.hash(),
+            10,
+            (1, 1),
+            buyer.contract_address,
+            seller.contract_address,
+        ),
+        OrderCancelled(sell.hash(), seller.contract_address),
+    ]
+    assert ledger.filled == {buy.hash(): 25, sell.hash(): 15, other_sell.hash(): 10}
+    assert ledger.cancelled == {sell.hash(): seller.contract_address}
+
+    # The ledger agrees with orderstatus, except for the cancelled order
+    statuses = await contract.get_order_statuses([buy.hash(), other_sell.hash()]).call()
+    assert statuses.result.filled == [25, 10]
+
+    # A line cut short by an interrupted write is dropped and read again
+    with open(ledger_file) as f:
+        lines = f.readlines()
+    with open(ledger_file, "w") as f:
+        f.writelines(lines[:-1])
+        f.write(lines[-1][:10])
+    ledger = FileFillLedger(ledger_file)
+    assert len(ledger.fills) == 1
+    assert EventIndexer(starknet.state, contract.contract_address, ledger).poll()[-1] == (
+        OrderCancelled(sell.hash(), seller.contract_address)
+    )
+    reopened = FileFillLedger(ledger_file)
+    assert reopened.fills == ledger.fills and reopened.cancels == ledger.cancels
+    assert reopened.checkpoint == len(starknet.state.events)
+
+    # cancel_all_orders is indexed as the new epoch of its sender
+    await contract.cancel_all_orders().invoke(caller_address=seller.contract_address)
+    indexer = EventIndexer(starknet.state, contract.contract_address, reopened)
+    assert indexer.poll() == [AllOrdersCancelled(seller.contract_address, 1)]
+    assert FileFillLedger(ledger_file).epochs == {seller.contract_address: 1}
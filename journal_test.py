@@ -0,0 +1,141 @@
+import random
+import time
+
+import pytest
+
+from lib.journal import HEADER_SIZE, OrderJournal
+from lib.zz_message import DOMAIN_PREFIX, MESSAGE_PREFIX, Order, ZZ_Message
+from zigzag_test import assert_same_message, random_message
+
+
+def signed(rng, message):
+    return message, (rng.randrange(2 ** 251), rng.randrange(2 ** 251))
+
+
+def test_journal(tmp_path):
+    rng = random.Random(0)
+    path = str(tmp_path / "orders.journal")
+    entries = [signed(rng, random_message(rng, side)) for side in (0, 1, 0)]
+    with OrderJournal(path) as journal:
+        hashes = [journal.append(message, signature) for message, signature in entries[:2]]
+        assert hashes == [message.hash() for message, _ in entries[:2]]
+        # Read from the map before and after it is extended
+        assert journal.get_order_status(hashes[0]) == 0
+        hashes.append(journal.append(*entries[2], filled=7))
+        assert journal.get_order_status(hashes[2]) == 7
+        with pytest.raises(ValueError, match="already in the journal"):
+            journal.extend([(*entries[0], hashes[0], 0)])
+        journal.set_order_status(hashes[1], 5)
+        assert journal.get(123) is None
+        assert 123 not in journal
+
+    # A torn append is dropped
+    with open(path, "ab") as f:
+        f.write(b"\1" * 100)
+    with OrderJournal(path) as journal:
+        assert len(journal) == 3
+        for message_hash, entry, filled in zip(hashes, entries, (0, 5, 7)):
+            assert message_hash in journal
+            message, signature, order_status = journal.get(message_hash)
+            assert_same_message((message, signature), entry)
+            assert message.hash() == message_hash
+            assert order_status == filled
+    assert (tmp_path / "orders.journal").stat().st_size == HEADER_SIZE + 3 * journal.record_size
+
+    # A header cut short by a crash starts the journal afresh
+    header = (tmp_path / "orders.journal").read_bytes()[:HEADER_SIZE]
+    torn_path = str(tmp_path / "torn.journal")
+    for size in (0, 5, HEADER_SIZE - 1):
+        with open(torn_path, "wb") as f:
+            f.write(header[:size])
+        with OrderJournal(torn_path) as journal:
+            assert len(journal) == 0
+            journal.append(*entries[0], message_hash=hashes[0])
+        with OrderJournal(torn_path) as journal:
+            assert list(journal.open_orders(0, {})) == [hashes[0]]
+
+    with open(path, "r+b") as f:
+        f.write(b"NOTJOURNAL")
+    with pytest.raises(ValueError, match="is not a journal"):
+        OrderJournal(path)
+    with open(torn_path, "wb") as f:
+        f.write(b"NOTJ")
+    with pytest.raises(ValueError, match="is not a journal"):
+        OrderJournal(torn_path)
+
+
+def test_compact(tmp_path):
+    rng = random.Random(1)
+    now = 1000
+    # 0x444 has called cancel_all_orders once
+    epochs = {0x444: 1}
+    # (sender, epoch, base_quantity, expiration, orderstatus) and whether fill_order could
+    # still fill it
+    orders = [
+        (0x333, 0, 100, 2 ** 40, 0, True),
+        (0x333, 0, 100, 2 ** 40, 60, True),
+        (0x333, 0, 100, now, 99, True),
+        (0x333, 0, 100, 2 ** 40, 100, False),
+        # Cancelled
+        (0x333, 0, 100, 2 ** 40, 101, False),
+        (0x333, 0, 100, now - 1, 0, False),
+        # Cancelled by cancel_all_orders
+        (0x444, 0, 100, 2 ** 40, 0, False),
+        (0x444, 1, 100, 2 ** 40, 0, True),
+    ]
+    with OrderJournal(str(tmp_path / "orders.journal")) as journal:
+        # Compacting an empty journal keeps it usable
+        assert journal.compact(now, epochs) == 0
+        entries = []
+        for i, (sender, epoch, base_quantity, expiration, filled, _) in enumerate(orders):
+            order = Order(0x111, 0x222, i % 2, base_quantity, (1, 1), expiration, epoch)
+            message = ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, sender, order)
+            entries.append((*signed(rng, message), i + 1, filled))
+        journal.extend(entries)
+        open_hashes = [i + 1 for i, (*_, is_open) in enumerate(orders) if is_open]
+        assert list(journal.open_orders(now, epochs)) == open_hashes
+        # Without the cancel_all_orders, the order of epoch 0 could be filled
+        assert list(journal.open_orders(now, {})) == open_hashes[:-1] + [7, 8]
+
+        assert journal.compact(now, epochs) == 4
+        assert len(journal) == 4
+        assert list(journal.open_orders(now, epochs)) == open_hashes
+        assert journal.get(4) is None
+        assert journal.get(7) is None
+        message, signature, filled = journal.get(2)
+        assert_same_message((message, signature), entries[1][:2])
+        assert filled == 60
+        # The journal takes appends after a compaction
+        journal.append(*entries[3][:2], message_hash=4)
+        assert list(journal.open_orders(now, epochs)) == open_hashes + [4]
+
+        # Nothing is left once all expire
+        assert journal.compact(2 ** 40 + 1, epochs) == 5
+        assert len(journal) == 0
+
+
+@pytest.mark.timing
+def test_reload_speed(tmp_path):
+    rng = random.Random(2)
+    path = str(tmp_path / "orders.journal")
+    n = 1000000
+    messages = [signed(rng, random_message(rng, side)) for side in (0, 1)]
+    # The hashes do not have to match the messages to time the reload
+    with OrderJournal(path) as journal:
+        for start in range(0, n, 10000):
+            journal.extend(
+                (*messages[i % 2], rng.randrange(2 ** 251), i) for i in range(start, start + 10000)
+            )
+        journal.flush()
+
+    start = time.perf_counter()
+    journal = OrderJournal(path)
+    elapsed = time.perf_counter() - start
+    with journal:
+        assert len(journal) == n
+        # A million orders in at most a second
+        assert n / elapsed >= 1000000, f"{n / elapsed:.0f} orders/s reloaded"
+        message_hash = next(journal.open_orders(0, {}))
+        message, signature, filled = journal.get(message_hash)
+        assert_same_message((message, signature), messages[0])
+        assert filled == 0
@@ -1,6 +1,9 @@
 %lang starknet
 %builtins pedersen range_check ecdsa
 
+from starkware.cairo.common.alloc import alloc
+from starkware.cairo.common.math import assert_nn_le
+from starkware.cairo.common.memcpy import memcpy
 from starkware.cairo.common.registers import get_fp_and_pc
 from starkware.cairo.common.signature import verify_ecdsa_signature
 from starkware.cairo.common.cairo_builtins import HashBuiltin, SignatureBuiltin
@@ -22,6 +25,15 @@ struct Message:
     member nonce: felt
 end
 
+# One call of execute_multicall. Its calldata is calldata[data_offset:data_offset + data_len]
+# of the shared calldata array
+struct AccountCallArray:
+    member to: felt
+    member selector: felt
+    member data_offset: felt
+    member data_len: felt
+end
+
 #
 # Storage
 #
@@ -235,6 +247,77 @@ func execute{
     return (response=response.retdata_size)
 end
 
+# Runs every call of call_array in order, under one signature and one nonce.
+# Returns the concatenated retdata of the calls
+@external
+func execute_multicall{
+        syscall_ptr : felt*, 
+        pedersen_ptr : HashBuiltin*,
+        range_check_ptr, 
+        ecdsa_ptr: SignatureBuiltin*
+    }(
+        call_array_len: felt,
+        call_array: AccountCallArray*,
+        calldata_len: felt,
+        calldata: felt*,
+        nonce: felt
+    ) -> (response_len: felt, response: felt*):
+    alloc_locals
+    assert_initialized()
+
+    let (_address) = address.read()
+    let (_current_nonce) = current_nonce.read()
+
+    local syscall_ptr : felt* = syscall_ptr
+    local _current_nonce = _current_nonce
+
+    # validate transaction
+    let (hash) = hash_multicall(
+        _address, call_array_len, call_array, calldata_len, calldata, _current_nonce)
+    local range_check_ptr = range_check_ptr
+    let (signature_len, signature) = get_tx_signature()
+    is_valid_signature(hash, signature_len, signature)
+
+    # bump nonce
+    current_nonce.write(_current_nonce + 1)
+
+    # execute calls
+    let (local response : felt*) = alloc()
+    let (response_len) = execute_calls(call_array_len, call_array, calldata, response)
+    return (response_len=response_len, response=response)
+end
+
+func execute_calls{
+        syscall_ptr : felt*
+    }(
+        call_array_len: felt,
+        call_array: AccountCallArray*,
+        calldata: felt*,
+        response: felt*
+    ) -> (response_len: felt):
+    alloc_locals
+    if call_array_len == 0:
+        return (response_len=0)
+    end
+
+    # hash_calls has checked that the calldata of every call lies within calldata
+    let res = call_contract(
+        contract_address=call_array.to,
+        function_selector=call_array.selector,
+        calldata_size=call_array.data_len,
+        calldata=calldata + call_array.data_offset
+    )
+    memcpy(response, res.retdata, res.retdata_size)
+
+    let (response_len) = execute_calls(
+        call_array_len - 1,
+        call_array + AccountCallArray.SIZE,
+        calldata,
+        response + res.retdata_size
+    )
+    return (response_len=response_len + res.retdata_size)
+end
+
 func hash_message{pedersen_ptr : HashBuiltin*}(message: Message*) -> (res: felt):
     alloc_locals
     # we need to make `res_calldata` local
@@ -276,3 +359,67 @@ func hash_calldata{pedersen_ptr: HashBuiltin*}(
         return (res=res)
     end
 end
+
+# Hashes the sender, the hash of the list of call hashes and the nonce. Each call hash covers
+# its to, selector and hash_calldata of its calldata. Unlike hash_message, which hashes 5
+# elements, this hashes 3, so a multicall signature is never valid for a single call
+func hash_multicall{pedersen_ptr: HashBuiltin*, range_check_ptr}(
+        sender: felt,
+        call_array_len: felt,
+        call_array: AccountCallArray*,
+        calldata_len: felt,
+        calldata: felt*,
+        nonce: felt
+    ) -> (res: felt):
+    alloc_locals
+    let (local call_hashes : felt*) = alloc()
+    hash_calls(call_array_len, call_array, calldata_len, calldata, call_hashes)
+    let (local res_calls) = hash_calldata(call_hashes, call_array_len)
+    let hash_ptr = pedersen_ptr
+    with hash_ptr:
+        let (hash_state_ptr) = hash_init()
+        let (hash_state_ptr) = hash_update_single(hash_state_ptr, sender)
+        let (hash_state_ptr) = hash_update_single(hash_state_ptr, res_calls)
+        let (hash_state_ptr) = hash_update_single(hash_state_ptr, nonce)
+        let (res) = hash_finalize(hash_state_ptr)
+        let pedersen_ptr = hash_ptr
+        return (res=res)
+    end
+end
+
+func hash_calls{pedersen_ptr: HashBuiltin*, range_check_ptr}(
+        call_array_len: felt,
+        call_array: AccountCallArray*,
+        calldata_len: felt,
+        calldata: felt*,
+        call_hashes: felt*
+    ):
+    alloc_locals
+    if call_array_len == 0:
+        return ()
+    end
+
+    # The calldata of the call must lie within calldata, before it is hashed here and passed
+    # on by execute_calls
+    assert_nn_le(call_array.data_offset, calldata_len)
+    assert_nn_le(call_array.data_len, calldata_len - call_array.data_offset)
+
+    let (local res_calldata) = hash_calldata(
+        calldata + call_array.data_offset, call_array.data_len)
+    let hash_ptr = pedersen_ptr
+    with hash_ptr:
+        let (hash_state_ptr) = hash_init()
+        let (hash_state_ptr) = hash_update(hash_state_ptr, call_array, 2)
+        let (hash_state_ptr) = hash_update_single(hash_state_ptr, res_calldata)
+        let (res) = hash_finalize(hash_state_ptr)
+        let pedersen_ptr = hash_ptr
+    end
+    assert [call_hashes] = res
+
+    return hash_calls(
+        call_array_len - 1,
+        call_array + AccountCallArray.SIZE,
+        calldata_len,
+        calldata,
+        call_hashes + 1)
+end
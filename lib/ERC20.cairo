@@ -1,6 +1,7 @@
 %lang starknet
 %builtins pedersen range_check ecdsa
 
+from starkware.cairo.common.alloc import alloc
 from starkware.cairo.common.cairo_builtins import HashBuiltin, SignatureBuiltin
 from starkware.starknet.common.syscalls import get_caller_address
 from starkware.cairo.common.math import assert_not_zero
@@ -89,10 +90,47 @@ func allowance{
     return (res)
 end
 
+# Returns the balance of every user in users and its allowance for spender, in the same order.
+# Each Uint256 takes two felts, low then high
+@view
+func get_balances_and_allowances{
+        syscall_ptr : felt*, 
+        pedersen_ptr : HashBuiltin*,
+        range_check_ptr
+    }(spender: felt, users_len: felt, users: felt*) -> (
+        user_balances_len: felt, user_balances: felt*,
+        user_allowances_len: felt, user_allowances: felt*):
+    alloc_locals
+    let (local user_balances: felt*) = alloc()
+    let (local user_allowances: felt*) = alloc()
+    _get_balances_and_allowances(spender, users_len, users, user_balances, user_allowances)
+    return (users_len * 2, user_balances, users_len * 2, user_allowances)
+end
+
 #
 # Internals
 #
 
+# Writes the balances and allowances of the remaining n users
+func _get_balances_and_allowances{
+        syscall_ptr : felt*, 
+        pedersen_ptr : HashBuiltin*,
+        range_check_ptr
+    }(spender: felt, n: felt, users: felt*, user_balances: felt*, user_allowances: felt*):
+    if n == 0:
+        return ()
+    end
+
+    let (balance: Uint256) = balances.read(user=[users])
+    assert [user_balances] = balance.low
+    assert [user_balances + 1] = balance.high
+    let (allowance: Uint256) = allowances.read(owner=[users], spender=spender)
+    assert [user_allowances] = allowance.low
+    assert [user_allowances + 1] = allowance.high
+    return _get_balances_and_allowances(
+        spender, n - 1, users + 1, user_balances + 2, user_allowances + 2)
+end
+
 func _mint{
         syscall_ptr : felt*, 
         pedersen_ptr : HashBuiltin*,
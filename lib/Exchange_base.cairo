@@ -2,21 +2,54 @@
 %lang starknet
 
 from starkware.cairo.common.cairo_builtins import HashBuiltin
+from starkware.cairo.common.dict import dict_read, dict_write
+from starkware.cairo.common.dict_access import DictAccess
+from starkware.cairo.common.hash import hash2
 from starkware.cairo.common.math import unsigned_div_rem
+from starkware.cairo.common.math_cmp import is_nn
 from starkware.cairo.common.uint256 import (
     Uint256
 )
 from starkware.cairo.common.registers import get_fp_and_pc
+from starkware.starknet.common.syscalls import get_contract_address
 
-from lib.config import TRUE, PROTOCOL_FEE_BIPS
+from lib.config import TRUE
 from lib.Order_base import PriceRatio
 
+##############
+# Storage
+##############
+
+# Protocol fee, in basis points of the base quantity of each trade
+@storage_var
+func Exchange_protocol_fee_bips() -> (bips : felt):
+end
+
+# Fees of an asset held by the exchange and not yet swept
+@storage_var
+func Exchange_accrued_fees(asset : felt) -> (amount : felt):
+end
+
+##############
+# Structs
+##############
+
+# A (asset, account) balance touched by a netted trade. key is hash2(asset, account)
+struct NetLeg:
+    member asset : felt
+    member account : felt
+    member key : felt
+end
+
 ##############
 # Interfaces
 ##############
 
 @contract_interface
 namespace IERC20:
+    func transfer(recipient: felt, amount: Uint256):
+    end
+
     func transfer_from(sender: felt, recipient: felt, amount: Uint256):
     end
 end
@@ -25,6 +58,33 @@ end
 # Exchange Functions
 ##############
 
+# Amounts moved by a trade: base_amount from seller to buyer, quote_amount from buyer to seller
+# and fee, in the base asset, from seller to the exchange
+func Exchange_trade_amounts{range_check_ptr}(
+        base_fill_quantity: felt,
+        fill_price: PriceRatio,
+        fee_bips: felt) -> (base_amount: felt, quote_amount: felt, fee: felt):
+        # Calculate protocol fee
+        let (fee, remainder) = unsigned_div_rem(base_fill_quantity * fee_bips, 10000)
+        let base_fill_quantity_minus_fee = base_fill_quantity - fee
+
+        # For now, fee is paid by seller. Can change later
+        let (quote_fill_quantity, remainder_fill_qty) = unsigned_div_rem(base_fill_quantity * fill_price.numerator, fill_price.denominator)
+        return (base_fill_quantity_minus_fee, quote_fill_quantity, fee)
+    end
+
+# Adds fee to the accrued fees of asset
+func Exchange_accrue_fee{
+        syscall_ptr : felt*, 
+        pedersen_ptr : HashBuiltin*,
+        range_check_ptr}(
+        asset: felt,
+        fee: felt):
+        let (accrued) = Exchange_accrued_fees.read(asset)
+        Exchange_accrued_fees.write(asset, accrued + fee)
+        return ()
+    end
+
 func Exchange_execute_trade{
         syscall_ptr : felt*, 
         pedersen_ptr : HashBuiltin*,
@@ -41,15 +101,151 @@ func Exchange_execute_trade{
         let fp_and_pc = get_fp_and_pc()
         local __fp__ = fp_and_pc.fp_val  
 
-        # Calculate protocol fee
-        let (fee, remainder) = unsigned_div_rem(base_fill_quantity * PROTOCOL_FEE_BIPS, 10000)
-        let base_fill_quantity_minus_fee = base_fill_quantity - fee
-        
+        let (fee_bips) = Exchange_protocol_fee_bips.read()
+        let (base_fill_quantity_minus_fee, quote_fill_quantity, local fee) = Exchange_trade_amounts(base_fill_quantity, fill_price, fee_bips)
+
         # Transfer tokens
-        # For now, fee is paid by seller. Can change later
-        let (quote_fill_quantity, remainder_fill_qty) = unsigned_div_rem(base_fill_quantity * fill_price.numerator, fill_price.denominator)
         IERC20.transfer_from(contract_address=base_asset, sender=seller, recipient=buyer, amount=Uint256(base_fill_quantity_minus_fee, 0))
         IERC20.transfer_from(contract_address=quote_asset, sender=buyer, recipient=seller, amount=Uint256(quote_fill_quantity, 0))
 
+        # A trade that settles on its own has no transfer into the exchange to add the fee to,
+        # so it is collected with a third one. Netted batches accrue it without one
+        if fee != 0:
+            let (exchange) = get_contract_address()
+            IERC20.transfer_from(contract_address=base_asset, sender=seller, recipient=exchange, amount=Uint256(fee, 0))
+            Exchange_accrue_fee(base_asset, fee)
+            return (TRUE)
+        end
+        return (TRUE)
+    end
+
+##############
+# Net Settlement
+##############
+
+# Records the balance changes of a trade in net_deltas instead of transferring tokens.
+# Writes the 4 legs it touches to legs, for Exchange_settle_net_deltas to pay out
+func Exchange_record_trade{
+        syscall_ptr : felt*, 
+        pedersen_ptr : HashBuiltin*,
+        range_check_ptr,
+        net_deltas : DictAccess*}(
+        base_fill_quantity: felt,
+        fill_price: PriceRatio,
+        base_asset: felt,
+        quote_asset: felt,
+        buyer: felt,
+        seller: felt,
+        legs: NetLeg*) -> (bool: felt):
+        alloc_locals
+
+        let (fee_bips) = Exchange_protocol_fee_bips.read()
+        let (local base_amount, local quote_amount, local fee) = Exchange_trade_amounts(base_fill_quantity, fill_price, fee_bips)
+
+        # The seller is debited the fee too. It stays in the exchange, which settles the batch,
+        # so accruing it costs no transfer
+        _add_net_delta(legs, base_asset, seller, -base_fill_quantity)
+        _add_net_delta(legs + NetLeg.SIZE, base_asset, buyer, base_amount)
+        _add_net_delta(legs + 2 * NetLeg.SIZE, quote_asset, buyer, -quote_amount)
+        _add_net_delta(legs + 3 * NetLeg.SIZE, quote_asset, seller, quote_amount)
+
+        if fee != 0:
+            Exchange_accrue_fee(base_asset, fee)
+            return (TRUE)
+        end
+        return (TRUE)
+    end
+
+func _add_net_delta{
+        pedersen_ptr : HashBuiltin*,
+        net_deltas : DictAccess*}(
+        leg: NetLeg*,
+        asset: felt,
+        account: felt,
+        amount: felt):
+        let (key) = hash2{hash_ptr=pedersen_ptr}(asset, account)
+        let (delta) = dict_read{dict_ptr=net_deltas}(key)
+        dict_write{dict_ptr=net_deltas}(key, delta + amount)
+
+        assert leg.asset = asset
+        assert leg.account = account
+        assert leg.key = key
+        return ()
+    end
+
+# Settles the net change of every leg with one transfer per (asset, account) whose delta is not
+# zero. Debits are pulled into the exchange first, then credits are paid out of it
+func Exchange_settle_net_deltas{
+        syscall_ptr : felt*, 
+        range_check_ptr,
+        net_deltas : DictAccess*}(
+        legs: NetLeg*,
+        n_legs: felt) -> (bool: felt):
+        alloc_locals
+
+        let (local exchange) = get_contract_address()
+        _collect_net_debits(exchange, legs, n_legs)
+        _pay_net_credits(legs, n_legs)
+
         return (TRUE)
-    end
\ No newline at end of file
+    end
+
+func _collect_net_debits{
+        syscall_ptr : felt*, 
+        range_check_ptr,
+        net_deltas : DictAccess*}(
+        exchange: felt,
+        legs: NetLeg*,
+        n_legs: felt):
+        alloc_locals
+
+        if n_legs == 0:
+            return ()
+        end
+
+        let (local delta) = dict_read{dict_ptr=net_deltas}(legs.key)
+        let (is_credit) = is_nn(delta)
+        if is_credit == 0:
+            # Zeroed so that later legs with the same key are not debited again
+            dict_write{dict_ptr=net_deltas}(legs.key, 0)
+            IERC20.transfer_from(contract_address=legs.asset, sender=legs.account, recipient=exchange, amount=Uint256(-delta, 0))
+            tempvar syscall_ptr = syscall_ptr
+            tempvar range_check_ptr = range_check_ptr
+            tempvar net_deltas = net_deltas
+        else:
+            tempvar syscall_ptr = syscall_ptr
+            tempvar range_check_ptr = range_check_ptr
+            tempvar net_deltas = net_deltas
+        end
+
+        return _collect_net_debits(exchange, legs + NetLeg.SIZE, n_legs - 1)
+    end
+
+func _pay_net_credits{
+        syscall_ptr : felt*, 
+        range_check_ptr,
+        net_deltas : DictAccess*}(
+        legs: NetLeg*,
+        n_legs: felt):
+        alloc_locals
+
+        if n_legs == 0:
+            return ()
+        end
+
+        let (local delta) = dict_read{dict_ptr=net_deltas}(legs.key)
+        if delta != 0:
+            # Debits are zero after _collect_net_debits, so delta is a credit
+            dict_write{dict_ptr=net_deltas}(legs.key, 0)
+            IERC20.transfer(contract_address=legs.asset, recipient=legs.account, amount=Uint256(delta, 0))
+            tempvar syscall_ptr = syscall_ptr
+            tempvar range_check_ptr = range_check_ptr
+            tempvar net_deltas = net_deltas
+        else:
+            tempvar syscall_ptr = syscall_ptr
+            tempvar range_check_ptr = range_check_ptr
+            tempvar net_deltas = net_deltas
+        end
+
+        return _pay_net_credits(legs + NetLeg.SIZE, n_legs - 1)
+    end
@@ -26,6 +26,7 @@ struct Order:
     member base_quantity : felt
     member price : PriceRatio
     member expiration : felt
+    member epoch : felt # must be at least the sender's order_epoch
 end
 
 ##############
@@ -50,6 +51,7 @@ func compute_order_hash{
         let (hash_state_ptr) = hash_update_single(hash_state_ptr, order_ptr.price.numerator)
         let (hash_state_ptr) = hash_update_single(hash_state_ptr, order_ptr.price.denominator)
         let (hash_state_ptr) = hash_update_single(hash_state_ptr, order_ptr.expiration)
+        let (hash_state_ptr) = hash_update_single(hash_state_ptr, order_ptr.epoch)
         let (hash) = hash_finalize(hash_state_ptr)
         let pedersen_ptr = hash_ptr
         return (hash=hash)
@@ -65,6 +67,8 @@ func check_order_valid{
         sell_order: Order*,
         filledbuy: felt,
         filledsell: felt,
+        buy_epoch: felt,
+        sell_epoch: felt,
         base_fill_quantity: felt,
         fill_price: PriceRatio) -> (bool: felt):
     alloc_locals
@@ -95,6 +99,48 @@ func check_order_valid{
 
         assert_nn_le(contract_time, buy_order.expiration)
         assert_nn_le(contract_time, sell_order.expiration)
+        assert_nn_le(buy_epoch, buy_order.epoch)
+        assert_nn_le(sell_epoch, sell_order.epoch)
     end
     return (TRUE)
-end
\ No newline at end of file
+end
+
+# sanity checks for an order filled by a batch auction at clearing_price. filled and epoch are
+# the orderstatus of the order and the order_epoch of its sender
+func check_auction_order{
+        syscall_ptr : felt*, 
+        pedersen_ptr : HashBuiltin*,
+        range_check_ptr}(
+        order: Order*,
+        side: felt,
+        base_asset: felt,
+        quote_asset: felt,
+        filled: felt,
+        epoch: felt,
+        base_fill_quantity: felt,
+        clearing_price: PriceRatio) -> (bool: felt):
+    alloc_locals
+
+    with_attr error_message("Invalid order"):
+        assert order.base_asset = base_asset
+        assert order.quote_asset = quote_asset
+        assert order.side = side
+        assert_nn_le(0, filled) # Sanity Check
+        assert_nn_le(0, order.base_quantity)
+        assert_nn_le(0, base_fill_quantity)
+        assert_nn_le(filled + base_fill_quantity, order.base_quantity)
+
+        # A buy limit must be at or above the clearing price and a sell limit at or below it
+        if side == BUY_SIDE:
+            assert_nn_le(clearing_price.numerator * order.price.denominator, order.price.numerator * clearing_price.denominator)
+        else:
+            assert_nn_le(order.price.numerator * clearing_price.denominator, clearing_price.numerator * order.price.denominator)
+        end
+
+        let (contract_time: felt) = get_block_timestamp()
+
+        assert_nn_le(contract_time, order.expiration)
+        assert_nn_le(epoch, order.epoch)
+    end
+    return (TRUE)
+end
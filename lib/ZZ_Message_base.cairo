@@ -3,12 +3,16 @@
 
 from starkware.cairo.common.hash_state import (
     HashState, hash_finalize, hash_init, hash_update, hash_update_single, hash2)
-from starkware.cairo.common.cairo_builtins import HashBuiltin
+from starkware.cairo.common.cairo_builtins import HashBuiltin, SignatureBuiltin
+from starkware.cairo.common.math import split_felt, unsigned_div_rem
 from starkware.cairo.common.registers import get_fp_and_pc
+from starkware.cairo.common.signature import verify_ecdsa_signature
 
 from lib.Order_base import PriceRatio, Order, compute_order_hash
 from lib.StructHash import StarkNet_Domain, hashDomain
-from lib.config import DOMAIN_NAME, APP_VERSION, CHAIN_ID, STARKNET_MESSAGE_PREFIX, TRUE, STARKNET_DOMAIN_TYPE_HASH, ORDER_TYPE_HASH
+from lib.config import (
+    DOMAIN_NAME, APP_VERSION, CHAIN_ID, STARKNET_MESSAGE_PREFIX, TRUE, ORDER_TYPE_HASH,
+    DOMAIN_HASH_MIDSTATE)
 
 ##############
 # STRUCTS
@@ -23,6 +27,23 @@ struct ZZ_Message:
     member sig_s: felt
 end
 
+# v2 encoding of a ZZ_Message. The prefix and domain are dropped, since they can only be the
+# lib/config.cairo constants, and the side, expiration and price are packed into one felt:
+#   packed = side + 2 * expiration + 2**64 * price.numerator + 2**128 * price.denominator
+# with expiration < 2**63, price.numerator < 2**64 and price.denominator < 2**123
+struct PackedMessage:
+    member sender: felt
+    member base_asset: felt
+    member quote_asset: felt
+    member base_quantity: felt
+    member packed: felt
+    member epoch: felt
+    member sig_r: felt
+    member sig_s: felt
+end
+
+const PACKED_NUMERATOR_SHIFT = 0x10000000000000000
+
 ##############
 # Interfaces
 ##############
@@ -66,21 +87,29 @@ func validate_message_prefix{
     return (TRUE)
 end
 
-# Verifies an order signature
+# Verifies an order signature against its hash from compute_message_hash. public_key is the
+# key the sender registered with the exchange: the signature is checked with the ECDSA builtin
+# if it is set, and by the sender's account contract if it is 0
 func verify_message_signature{
         syscall_ptr : felt*, 
         pedersen_ptr : HashBuiltin*,
-        range_check_ptr}(
-        msg_ptr : ZZ_Message*) -> (bool: felt):
-    alloc_locals
-    let (local msghash: felt) = compute_message_hash(msg_ptr) 
-
+        range_check_ptr,
+        ecdsa_ptr : SignatureBuiltin*}(
+        msg_ptr : ZZ_Message*, msghash : felt, public_key : felt) -> (bool: felt):
+    if public_key != 0:
+        verify_ecdsa_signature(
+            message=msghash, public_key=public_key, signature_r=msg_ptr.sig_r,
+            signature_s=msg_ptr.sig_s)
+        return (TRUE)
+    end
     IAccount.is_valid_signature(contract_address=msg_ptr.sender, hash=msghash, signature_len=2, signature=&msg_ptr.sig_r)
     return (TRUE)
 end
 
 
 # Computes a hash from a message
+# The prefix and domain are not hashed: validate_message_prefix must have checked them against
+# lib/config.cairo, so their part of the chain is the constant DOMAIN_HASH_MIDSTATE
 func compute_message_hash{
         pedersen_ptr: HashBuiltin*,
         range_check_ptr}(
@@ -91,16 +120,8 @@ func compute_message_hash{
         with hash_ptr:
             #let (hash_state_ptr: HashState*) = hash_init()
             
-            #hash prefix
-            let (hash) = hash2(msg_ptr.message_prefix, STARKNET_DOMAIN_TYPE_HASH)
-
-            #hash domain
-            let (hash) = hash2(hash, msg_ptr.domain_prefix.name)
-            let (hash) = hash2(hash, msg_ptr.domain_prefix.version)
-            let (hash) = hash2(hash, msg_ptr.domain_prefix.chain_id)
-
-            #hash sender
-            let (hash) = hash2(hash, msg_ptr.sender)
+            #hash sender, continuing from the prefix and domain midstate
+            let (hash) = hash2(DOMAIN_HASH_MIDSTATE, msg_ptr.sender)
 
             #hash order
             let (hash) = hash2(hash, ORDER_TYPE_HASH)
@@ -111,10 +132,49 @@ func compute_message_hash{
             let (hash) = hash2(hash, msg_ptr.order.price.numerator)
             let (hash) = hash2(hash, msg_ptr.order.price.denominator)
             let (hash) = hash2(hash, msg_ptr.order.expiration)
+            let (hash) = hash2(hash, msg_ptr.order.epoch)
 
             #finalize
             #let (hash) = hash_finalize(hash_state_ptr)
             let pedersen_ptr = hash_ptr
             return (hash=hash)
         end
-end
\ No newline at end of file
+end
+
+# Writes the ZZ_Message encoded by packed_ptr to msg_ptr. The message has the same hash and
+# signature as its v1 encoding
+func unpack_message{range_check_ptr}(packed_ptr : PackedMessage*, msg_ptr : ZZ_Message*):
+    # split_felt range checks both halves, so every field below is in its range and every
+    # packed value decodes to exactly one message
+    let (denominator, low) = split_felt(packed_ptr.packed)
+    let (numerator, side_expiration) = unsigned_div_rem(low, PACKED_NUMERATOR_SHIFT)
+    let (expiration, side) = unsigned_div_rem(side_expiration, 2)
+
+    assert msg_ptr.message_prefix = STARKNET_MESSAGE_PREFIX
+    assert msg_ptr.domain_prefix.name = DOMAIN_NAME
+    assert msg_ptr.domain_prefix.version = APP_VERSION
+    assert msg_ptr.domain_prefix.chain_id = CHAIN_ID
+    assert msg_ptr.sender = packed_ptr.sender
+    assert msg_ptr.order.base_asset = packed_ptr.base_asset
+    assert msg_ptr.order.quote_asset = packed_ptr.quote_asset
+    assert msg_ptr.order.side = side
+    assert msg_ptr.order.base_quantity = packed_ptr.base_quantity
+    assert msg_ptr.order.price.numerator = numerator
+    assert msg_ptr.order.price.denominator = denominator
+    assert msg_ptr.order.expiration = expiration
+    assert msg_ptr.order.epoch = packed_ptr.epoch
+    assert msg_ptr.sig_r = packed_ptr.sig_r
+    assert msg_ptr.sig_s = packed_ptr.sig_s
+    return ()
+end
+
+# Unpacks the remaining n messages of packed_ptr to msg_ptr
+func unpack_messages{range_check_ptr}(
+        n : felt, packed_ptr : PackedMessage*, msg_ptr : ZZ_Message*):
+    if n == 0:
+        return ()
+    end
+
+    unpack_message(packed_ptr, msg_ptr)
+    return unpack_messages(n - 1, packed_ptr + PackedMessage.SIZE, msg_ptr + ZZ_Message.SIZE)
+end
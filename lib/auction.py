@@ -0,0 +1,144 @@
+"""Uniform-price clearing of signed ZZ_Messages into settle_batch_auction arguments.
+
+The clearing price is the limit price that maximizes the traded base quantity. Only limit
+prices need to be tried, since demand and supply only change at them, so sorting the orders
+once and sweeping the candidate prices in order solves an auction in O(n log n). Prices are
+compared by cross-multiplication, like lib.matching and check_auction_order.
+"""
+
+from lib.matching import BUY_SIDE, SELL_SIDE, _Price
+
+
+class AuctionOrder:
+    __slots__ = ("message", "signature", "remaining", "limit", "sequence")
+
+    def __init__(self, message, signature, remaining, sequence):
+        self.message = message
+        self.signature = signature
+        self.remaining = remaining
+        price = message.order.price
+        self.limit = _Price(price.numerator, price.denominator)
+        self.sequence = sequence
+
+
+class AuctionResult:
+    """The clearing price of an auction and the base quantity filled on each order.
+
+    buy_fills and sell_fills are (AuctionOrder, base_fill_quantity) pairs of the orders that
+    trade, best limit first. Both sides add up to volume.
+    """
+
+    __slots__ = ("clearing_price", "volume", "buy_fills", "sell_fills")
+
+    def __init__(self, clearing_price, volume, buy_fills, sell_fills):
+        self.clearing_price = clearing_price
+        self.volume = volume
+        self.buy_fills = buy_fills
+        self.sell_fills = sell_fills
+
+    def to_starknet_args(self):
+        """Keyword arguments for settle_batch_auction."""
+        return dict(
+            buy_orders=[
+                order.message.to_signed_starknet_args(*order.signature)
+                for order, _ in self.buy_fills
+            ],
+            buy_fills=[fill for _, fill in self.buy_fills],
+            sell_orders=[
+                order.message.to_signed_starknet_args(*order.signature)
+                for order, _ in self.sell_fills
+            ],
+            sell_fills=[fill for _, fill in self.sell_fills],
+            clearing_price=self.clearing_price,
+        )
+
+
+class BatchAuction:
+    """Collects the orders of one market and clears them all at a single price.
+
+    Orders are not validated beyond their side and remaining quantity; expired or cancelled
+    orders should be filtered out, for example with FillValidator, before they are added.
+    """
+
+    def __init__(self):
+        self.buys = []
+        self.sells = []
+        self._sequence = 0
+
+    def add_order(self, message, signature, filled=0):
+        """Adds a signed message, of which filled is already filled on chain."""
+        order = message.order
+        if order.side == BUY_SIDE:
+            orders = self.buys
+        elif order.side == SELL_SIDE:
+            orders = self.sells
+        else:
+            raise ValueError(f"Invalid side {order.side}")
+        remaining = order.base_quantity - filled
+        if remaining <= 0:
+            return
+        self._sequence += 1
+        orders.append(AuctionOrder(message, signature, remaining, self._sequence))
+
+    def solve(self):
+        """Returns the AuctionResult that trades the most base quantity, or None if no buy and
+        sell limits cross. Raises ValueError if the orders are not all of one market.
+
+        Among prices that trade the same quantity, the one that leaves the smallest imbalance
+        between demand and supply wins, then the lowest. Within a side, better limits are
+        filled first and equal limits in the order they were added.
+        """
+        markets = {
+            (order.message.order.base_asset, order.message.order.quote_asset)
+            for order in self.buys + self.sells
+        }
+        if len(markets) > 1:
+            raise ValueError(f"Orders of {len(markets)} markets in one auction")
+
+        # Stable sorts, so equal limits stay in the order they were added
+        buys = sorted(self.buys, key=lambda order: order.limit)
+        sells = sorted(self.sells, key=lambda order: order.limit)
+        if not buys or not sells or buys[-1].limit < sells[0].limit:
+            return None
+        # One candidate per price level, however its ratio is written
+        prices = sorted({order.limit.key: order.limit for order in buys + sells}.values())
+
+        # demand is the remaining quantity of buys with a limit at or above price, supply that
+        # of sells with a limit at or below it
+        demand = sum(order.remaining for order in buys)
+        supply = 0
+        i = j = 0
+        best = None
+        for price in prices:
+            while i < len(buys) and buys[i].limit < price:
+                demand -= buys[i].remaining
+                i += 1
+            while j < len(sells) and not price < sells[j].limit:
+                supply += sells[j].remaining
+                j += 1
+            key = (min(demand, supply), -abs(demand - supply))
+            if best is None or key > best[0]:
+                best = (key, price)
+        (volume, _), price = best
+
+        buy_fills = _allocate(
+            sorted(
+                (order for order in buys if not order.limit < price),
+                key=lambda order: order.limit,
+                reverse=True,
+            ),
+            volume,
+        )
+        sell_fills = _allocate((order for order in sells if not price < order.limit), volume)
+        return AuctionResult((price.numerator, price.denominator), volume, buy_fills, sell_fills)
+
+
+def _allocate(orders, volume):
+    fills = []
+    for order in orders:
+        if volume == 0:
+            break
+        fill = min(order.remaining, volume)
+        fills.append((order, fill))
+        volume -= fill
+    return fills
@@ -0,0 +1,62 @@
+"""Execution-resource benchmarks for the exchange entry points."""
+
+import json
+import os
+
+METRICS = (
+    "n_steps",
+    "pedersen_builtin",
+    "range_check_builtin",
+    "ecdsa_builtin",
+    "n_memory_holes",
+    "calldata_len",
+)
+
+# Allowed relative increase of any metric over its baseline value. n_steps and n_memory_holes
+# move by a few units with the Python hash seed, so this stays above that noise.
+DEFAULT_THRESHOLD = 0.05
+
+
+def execution_resources(execution_info):
+    """Returns the METRICS of an invoke or call result, including nested contract calls."""
+    call_info = execution_info.call_info
+    usage = call_info.cairo_usage
+    builtins = usage.builtin_instance_counter
+    return {
+        "n_steps": usage.n_steps,
+        "pedersen_builtin": builtins.get("pedersen_builtin", 0),
+        "range_check_builtin": builtins.get("range_check_builtin", 0),
+        "ecdsa_builtin": builtins.get("ecdsa_builtin", 0),
+        "n_memory_holes": usage.n_memory_holes,
+        "calldata_len": len(call_info.calldata),
+    }
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+        f.write("\n")
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Returns a message for every scenario metric that exceeds its baseline by more than
+    threshold, and for every scenario that has no baseline yet.
+    """
+    regressions = []
+    for scenario, metrics in sorted(results.items()):
+        if scenario not in baseline:
+            regressions.append(f"{scenario}: no baseline")
+            continue
+        for metric in METRICS:
+            old = baseline[scenario].get(metric, 0)
+            new = metrics[metric]
+            if new > old * (1 + threshold):
+                regressions.append(f"{scenario}.{metric}: {old} -> {new}")
+    return regressions
@@ -0,0 +1,245 @@
+"""Flat calldata of the exchange externals, laid out from zigzag_abi.json.
+
+The testing framework takes arguments as nested tuples, which ZZ_Message.to_starknet_args builds
+per message, and flattens them again on every invoke. CalldataSerializer instead reads the member
+offsets of every struct from the ABI once, and writes arguments straight into a flat list of
+felts, which starknet.state.invoke_raw or an account multicall takes as is. decode reads such
+calldata back into the same arguments.
+
+Arguments are passed by input name, as to the contract:
+- felt inputs are ints and array inputs lists, whose _len inputs are filled in
+- ZZ_Message inputs are (ZZ_Message, (sig_r, sig_s)) pairs, since signatures are not part of
+  the Python message
+- other structs are objects with attributes named like their members, or flat tuples of their
+  felts, such as a (numerator, denominator) PriceRatio or to_signed_packed_starknet_args()
+"""
+
+import json
+import os
+from collections import namedtuple
+from operator import attrgetter
+
+from lib.zz_message import Order, StarkNetDomain, ZZ_Message
+
+ABI_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "zigzag_abi.json")
+
+# Members of ZZ_Message that are passed next to the message instead of read from it
+SIGNATURE_MEMBERS = ("sig_r", "sig_s")
+
+
+class StructLayout:
+    """The felts of an ABI struct in calldata order.
+
+    paths holds the dotted member path of each felt, such as "order.price.numerator", and
+    tuple_type the namedtuple that decode returns.
+    """
+
+    __slots__ = ("name", "size", "paths", "tuple_type", "_members", "_getter")
+
+    def __init__(self, name, size, paths, members):
+        self.name = name
+        self.size = size
+        self.paths = paths
+        self.tuple_type = namedtuple(name, [member for member, _, _ in members])
+        # (name, offset, StructLayout or None for a felt) of every member
+        self._members = members
+        self._getter = attrgetter(*paths)
+
+    def write(self, buffer, offset, value):
+        """Writes an object or a flat tuple of the struct at offset and returns the offset after
+        it."""
+        end = offset + self.size
+        if isinstance(value, tuple):
+            if len(value) != self.size:
+                raise ValueError(f"{self.name} takes {self.size} felts, got {len(value)}")
+            buffer[offset:end] = value
+        elif self.size == 1:
+            buffer[offset] = self._getter(value)
+        else:
+            buffer[offset:end] = self._getter(value)
+        return end
+
+    def read(self, buffer, offset):
+        """Returns the struct at offset as nested namedtuples."""
+        return self.tuple_type(
+            *(
+                buffer[offset + member_offset]
+                if layout is None
+                else layout.read(buffer, offset + member_offset)
+                for _, member_offset, layout in self._members
+            )
+        )
+
+
+class AbiLayout:
+    """StructLayouts and function inputs of a contract ABI."""
+
+    def __init__(self, abi):
+        definitions = {entry["name"]: entry for entry in abi if entry["type"] == "struct"}
+        self.structs = {}
+        for name in definitions:
+            self._struct(name, definitions)
+        # function name -> [(input name, type)]
+        self.functions = {
+            entry["name"]: [(arg["name"], arg["type"]) for arg in entry["inputs"]]
+            for entry in abi
+            if entry["type"] == "function"
+        }
+
+    @classmethod
+    def from_file(cls, path=ABI_FILE):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def size(self, cairo_type):
+        return 1 if cairo_type == "felt" else self.structs[cairo_type].size
+
+    def _struct(self, name, definitions):
+        layout = self.structs.get(name)
+        if layout is not None:
+            return layout
+        definition = definitions[name]
+        paths = []
+        members = []
+        for member in sorted(definition["members"], key=lambda member: member["offset"]):
+            if member["offset"] != len(paths):
+                raise ValueError(f"Member {name}.{member['name']} is not packed")
+            if member["type"] == "felt":
+                members.append((member["name"], member["offset"], None))
+                paths.append(member["name"])
+                continue
+            inner = self._struct(member["type"], definitions)
+            members.append((member["name"], member["offset"], inner))
+            paths.extend(f"{member['name']}.{path}" for path in inner.paths)
+        if len(paths) != definition["size"]:
+            raise ValueError(f"Struct {name} has {len(paths)} felts, size {definition['size']}")
+        layout = self.structs[name] = StructLayout(name, definition["size"], paths, members)
+        return layout
+
+
+class CalldataSerializer:
+    """Encodes and decodes the calldata of the functions of an ABI, zigzag_abi.json by default."""
+
+    def __init__(self, layout=None):
+        if layout is None:
+            layout = AbiLayout.from_file()
+        self.layout = layout
+        message = layout.structs["ZZ_Message"]
+        if tuple(message.paths[-2:]) != SIGNATURE_MEMBERS:
+            raise ValueError("ZZ_Message must end with its signature")
+        self.message_size = message.size
+        self._message_getter = attrgetter(*message.paths[:-2])
+        self._writers = {"ZZ_Message": self.write_message}
+        self._readers = {"ZZ_Message": self.read_message}
+
+    def calldata_size(self, function, args):
+        size = 0
+        for name, cairo_type in self.layout.functions[function]:
+            if cairo_type.endswith("*"):
+                size += len(args[name]) * self.layout.size(cairo_type[:-1])
+            else:
+                size += self.layout.size(cairo_type)
+        return size
+
+    def encode(self, function, args):
+        """Returns the calldata of function for a dict of arguments by input name."""
+        buffer = [0] * self.calldata_size(function, args)
+        self.encode_into(buffer, 0, function, args)
+        return buffer
+
+    def encode_into(self, buffer, offset, function, args):
+        """Writes the calldata of function into buffer at offset, for example into a buffer
+        reused across calls. Returns the offset after it."""
+        layout = self.layout
+        for name, cairo_type in layout.functions[function]:
+            if cairo_type == "felt":
+                array = args.get(name[:-4]) if name.endswith("_len") else None
+                buffer[offset] = args[name] if array is None else len(array)
+                offset += 1
+            elif cairo_type.endswith("*"):
+                element_type = cairo_type[:-1]
+                write = self._writer(element_type)
+                for value in args[name]:
+                    offset = write(buffer, offset, value)
+            else:
+                offset = self._writer(cairo_type)(buffer, offset, args[name])
+        return offset
+
+    def decode(self, function, calldata, offset=0):
+        """Inverse of encode. Returns the arguments by input name, without the _len inputs of
+        arrays, and ZZ_Messages as (ZZ_Message, (sig_r, sig_s)) pairs."""
+        args = {}
+        length = None
+        for name, cairo_type in self.layout.functions[function]:
+            if cairo_type.endswith("*"):
+                element_type = cairo_type[:-1]
+                read = self._reader(element_type)
+                size = self.layout.size(element_type)
+                args[name] = [read(calldata, offset + i * size) for i in range(length)]
+                offset += length * size
+            elif cairo_type == "felt":
+                length = calldata[offset]
+                if not name.endswith("_len"):
+                    args[name] = length
+                offset += 1
+            else:
+                args[name] = self._reader(cairo_type)(calldata, offset)
+                offset += self.layout.size(cairo_type)
+        return args
+
+    def _writer(self, cairo_type):
+        writer = self._writers.get(cairo_type)
+        if writer is None:
+            if cairo_type == "felt":
+                writer = _write_felt
+            else:
+                writer = self.layout.structs[cairo_type].write
+        return writer
+
+    def _reader(self, cairo_type):
+        reader = self._readers.get(cairo_type)
+        if reader is None:
+            if cairo_type == "felt":
+                reader = _read_felt
+            else:
+                reader = self.layout.structs[cairo_type].read
+        return reader
+
+    def write_message(self, buffer, offset, value):
+        """Writes a (ZZ_Message, (sig_r, sig_s)) pair at offset and returns the offset after
+        it."""
+        message, signature = value
+        end = offset + self.message_size
+        buffer[offset : end - 2] = self._message_getter(message)
+        buffer[end - 2 : end] = signature
+        return end
+
+    def read_message(self, buffer, offset):
+        """Returns the (ZZ_Message, (sig_r, sig_s)) pair at offset."""
+        encoded = self.layout.structs["ZZ_Message"].read(buffer, offset)
+        domain = encoded.domain_prefix
+        order = encoded.order
+        message = ZZ_Message(
+            encoded.message_prefix,
+            StarkNetDomain(domain.name, domain.version, domain.chain_id),
+            encoded.sender,
+            Order(
+                order.base_asset,
+                order.quote_asset,
+                order.side,
+                order.base_quantity,
+                tuple(order.price),
+                order.expiration,
+                order.epoch,
+            ),
+        )
+        return message, (encoded.sig_r, encoded.sig_s)
+
+
+def _write_felt(buffer, offset, value):
+    buffer[offset] = value
+    return offset + 1
+
+
+def _read_felt(buffer, offset):
+    return buffer[offset]
@@ -20,7 +20,10 @@ const APP_VERSION = 1
 const CHAIN_ID = 'SN_GOERLI'
 
 const STARKNET_DOMAIN_TYPE_HASH = 0x1bfc207425a47a5dfa1a50a4f5241203f50624ca5fdf5e18755765416b8e288
-const ORDER_TYPE_HASH = 0x1c40c16f3451462e7f4a563be58271e0a15bfc1cb3fe2e4849e78ccc3bd557
+const ORDER_TYPE_HASH = 0x322a1210ba11025d10a6817a7f5e1ca2477cf4110104013356d1bc7a4270bf7
+
+# hash2 chain over STARKNET_MESSAGE_PREFIX, STARKNET_DOMAIN_TYPE_HASH, DOMAIN_NAME, APP_VERSION, CHAIN_ID
+const DOMAIN_HASH_MIDSTATE = 0x4fcebc04e93c6da6bf147c871f4118181ed5ff9902f3efd75d53f8f76965aab
 
 #
 # Order Config
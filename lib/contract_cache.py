@@ -0,0 +1,169 @@
+"""On-disk caches of compiled contracts and contract hashes, for fast test and simulation startup.
+
+starknet.deploy(source=...) compiles the source and then computes the contract hash on every
+deploy, which takes far longer than running the contract. Both only depend on the sources, so
+compile_contract stores the compiled definition under CACHE_DIR, keyed by a hash of the source,
+the lib files it imports and the cairo-lang version. use_contract_hash_cache installs a
+persistent cache for compute_contract_hash through its cache hook.
+
+Most of the remaining cost of a deploy is loading the contract definition back from the state,
+so tests deploy once and then work on copies made by copy_state.
+"""
+
+import copy
+import hashlib
+import os
+import re
+
+from starkware.cairo.lang.version import __version__ as CAIRO_LANG_VERSION
+from starkware.cairo.lang.vm.crypto import pedersen_hash
+from starkware.starknet.compiler.compile import compile_starknet_files
+from starkware.starknet.core.os.contract_hash import contract_hash_cache_ctx_var
+from starkware.starknet.services.api.contract_definition import ContractDefinition
+from starkware.starknet.testing.contract import StarknetContract
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(REPO_ROOT, ".cairo_cache")
+
+_IMPORT = re.compile(r"^from\s+([\w.]+)\s+import", re.MULTILINE)
+
+# (path, source hash) -> ContractDefinition, so a process loads each cache file once
+_loaded = {}
+
+
+def _source_files(path, cairo_path):
+    """Returns path and every file it imports, directly or not, found under cairo_path."""
+    files = []
+    pending = [os.path.abspath(path)]
+    while pending:
+        source = pending.pop()
+        if source in files:
+            continue
+        files.append(source)
+        with open(source) as f:
+            modules = _IMPORT.findall(f.read())
+        for module in modules:
+            relative = module.replace(".", os.sep) + ".cairo"
+            for directory in cairo_path:
+                candidate = os.path.join(directory, relative)
+                if os.path.exists(candidate):
+                    pending.append(candidate)
+                    break
+    return sorted(files)
+
+
+def source_hash(path, cairo_path=(REPO_ROOT,)):
+    """Hashes the cairo-lang version and the contents of path and of the files it imports."""
+    digest = hashlib.sha256(CAIRO_LANG_VERSION.encode())
+    for source in _source_files(path, cairo_path):
+        with open(source, "rb") as f:
+            content = f.read()
+        for part in (os.path.relpath(source, REPO_ROOT).encode(), content):
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        f.write(text)
+    os.replace(temporary, path)
+
+
+def compile_contract(path, cache_dir=CACHE_DIR, cairo_path=(REPO_ROOT,)):
+    """Returns the ContractDefinition of a Cairo source, compiling it only if no cached
+    definition exists for the current sources."""
+    key = source_hash(path, cairo_path)
+    contract_def = _loaded.get((path, key))
+    if contract_def is not None:
+        return contract_def
+    name = os.path.splitext(os.path.basename(path))[0]
+    cache_file = os.path.join(cache_dir, f"{name}-{key}.json")
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            contract_def = ContractDefinition.loads(f.read())
+    else:
+        contract_def = compile_starknet_files(
+            files=[path], debug_info=True, cairo_path=list(cairo_path)
+        )
+        _write_atomic(cache_file, contract_def.dumps())
+    _loaded[(path, key)] = contract_def
+    return contract_def
+
+
+class ContractHashCache:
+    """Cache for compute_contract_hash, keyed like it by (definition keccak, hash function).
+
+    Hashes computed with the default Pedersen hash are also stored in cache_dir.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hashes = {}
+
+    def _file(self, key):
+        definition_keccak, hash_func = key
+        if hash_func is not pedersen_hash:
+            return None
+        return os.path.join(self.cache_dir, f"contract_hash-{definition_keccak:x}")
+
+    def __contains__(self, key):
+        if key in self.hashes:
+            return True
+        path = self._file(key)
+        if path is None or not os.path.exists(path):
+            return False
+        with open(path) as f:
+            self.hashes[key] = int(f.read(), 16)
+        return True
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.hashes[key]
+
+    def __setitem__(self, key, contract_hash):
+        self.hashes[key] = contract_hash
+        path = self._file(key)
+        if path is not None:
+            _write_atomic(path, hex(contract_hash))
+
+
+def use_contract_hash_cache(cache_dir=CACHE_DIR):
+    """Makes compute_contract_hash use a ContractHashCache in the current context, unless a
+    cache is already set. Returns the cache in use."""
+    cache = contract_hash_cache_ctx_var.get()
+    if cache is None:
+        cache = ContractHashCache(cache_dir)
+        contract_hash_cache_ctx_var.set(cache)
+    return cache
+
+
+async def deploy_contract(starknet, path, **kwargs):
+    """starknet.deploy(source=path, **kwargs) through compile_contract and the contract hash
+    cache."""
+    use_contract_hash_cache()
+    return await starknet.deploy(contract_def=compile_contract(path), **kwargs)
+
+
+def copy_state(state):
+    """StarknetState.copy(), except that the contract definitions, which are never modified,
+    are shared with state instead of copied. That is most of the work of StarknetState.copy().
+    """
+    memo = {}
+    for definitions in state.state.contract_definitions.maps:
+        for contract_def in definitions.values():
+            memo[id(contract_def)] = contract_def
+    return copy.deepcopy(state, memo)
+
+
+def fork_contract(contract, state, abi):
+    """Returns contract bound to state, typically a copy of the state it was deployed to."""
+    return StarknetContract(
+        state=state,
+        abi=abi,
+        contract_address=contract.contract_address,
+        deploy_execution_info=contract.deploy_execution_info,
+    )
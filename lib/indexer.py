@@ -0,0 +1,220 @@
+"""Incremental indexer of the order_filled, order_cancelled and all_orders_cancelled events of
+the exchange.
+
+Reads any object with an append-only events list of (from_address, keys, data) events, such
+as the StarknetState of starkware.starknet.testing. The ledger remembers how many events it
+has read, so polling again, or resuming from a ledger file, only reads the new ones.
+"""
+
+import json
+import os
+
+from starkware.starknet.public.abi import get_selector_from_name
+
+ORDER_FILLED_SELECTOR = get_selector_from_name("order_filled")
+ORDER_CANCELLED_SELECTOR = get_selector_from_name("order_cancelled")
+ALL_ORDERS_CANCELLED_SELECTOR = get_selector_from_name("all_orders_cancelled")
+
+
+class OrderFilled:
+    __slots__ = (
+        "buy_order_hash",
+        "sell_order_hash",
+        "base_fill_quantity",
+        "fill_price",
+        "buyer",
+        "seller",
+    )
+
+    def __init__(
+        self, buy_order_hash, sell_order_hash, base_fill_quantity, fill_price, buyer, seller
+    ):
+        self.buy_order_hash = buy_order_hash
+        self.sell_order_hash = sell_order_hash
+        self.base_fill_quantity = base_fill_quantity
+        self.fill_price = tuple(fill_price)
+        self.buyer = buyer
+        self.seller = seller
+
+    @classmethod
+    def from_data(cls, data):
+        buy_hash, sell_hash, base_fill_quantity, numerator, denominator, buyer, seller = data
+        return cls(buy_hash, sell_hash, base_fill_quantity, (numerator, denominator), buyer, seller)
+
+    def to_json(self):
+        return dict(
+            event="order_filled",
+            buy_order_hash=self.buy_order_hash,
+            sell_order_hash=self.sell_order_hash,
+            base_fill_quantity=self.base_fill_quantity,
+            fill_price=list(self.fill_price),
+            buyer=self.buyer,
+            seller=self.seller,
+        )
+
+    def __eq__(self, other):
+        return type(other) is OrderFilled and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"OrderFilled({fields})"
+
+
+class OrderCancelled:
+    __slots__ = ("order_hash", "sender")
+
+    def __init__(self, order_hash, sender):
+        self.order_hash = order_hash
+        self.sender = sender
+
+    @classmethod
+    def from_data(cls, data):
+        order_hash, sender = data
+        return cls(order_hash, sender)
+
+    def to_json(self):
+        return dict(event="order_cancelled", order_hash=self.order_hash, sender=self.sender)
+
+    def __eq__(self, other):
+        return type(other) is OrderCancelled and (self.order_hash, self.sender) == (
+            other.order_hash,
+            other.sender,
+        )
+
+    def __repr__(self):
+        return f"OrderCancelled(order_hash={self.order_hash!r}, sender={self.sender!r})"
+
+
+class AllOrdersCancelled:
+    __slots__ = ("sender", "epoch")
+
+    def __init__(self, sender, epoch):
+        self.sender = sender
+        self.epoch = epoch
+
+    @classmethod
+    def from_data(cls, data):
+        sender, epoch = data
+        return cls(sender, epoch)
+
+    def to_json(self):
+        return dict(event="all_orders_cancelled", sender=self.sender, epoch=self.epoch)
+
+    def __eq__(self, other):
+        return type(other) is AllOrdersCancelled and (self.sender, self.epoch) == (
+            other.sender,
+            other.epoch,
+        )
+
+    def __repr__(self):
+        return f"AllOrdersCancelled(sender={self.sender!r}, epoch={self.epoch!r})"
+
+
+def _from_json(record):
+    record = dict(record)
+    event = record.pop("event")
+    if event == "order_filled":
+        return OrderFilled(**record)
+    if event == "all_orders_cancelled":
+        return AllOrdersCancelled(**record)
+    return OrderCancelled(**record)
+
+
+class FillLedger:
+    """In-memory ledger of indexed events.
+
+    checkpoint is the number of events of the source already read. filled mirrors
+    orderstatus for filled orders, while cancelled maps a cancelled hash to its sender.
+    epochs mirrors order_epoch for every sender that has called cancel_all_orders.
+    """
+
+    def __init__(self):
+        self.checkpoint = 0
+        self.fills = []
+        self.cancels = []
+        # message hash -> base quantity filled
+        self.filled = {}
+        # message hash -> sender
+        self.cancelled = {}
+        # sender -> epoch
+        self.epochs = {}
+
+    def _apply(self, record):
+        if isinstance(record, OrderFilled):
+            self.fills.append(record)
+            filled = self.filled
+            for message_hash in (record.buy_order_hash, record.sell_order_hash):
+                filled[message_hash] = filled.get(message_hash, 0) + record.base_fill_quantity
+        elif isinstance(record, AllOrdersCancelled):
+            self.cancels.append(record)
+            self.epochs[record.sender] = record.epoch
+        else:
+            self.cancels.append(record)
+            self.cancelled[record.order_hash] = record.sender
+
+    def add(self, records, checkpoint):
+        """Records the events read up to checkpoint."""
+        for record in records:
+            self._apply(record)
+        self.checkpoint = checkpoint
+
+
+class FileFillLedger(FillLedger):
+    """A FillLedger appended to a JSON lines file, and rebuilt from it when reopened.
+
+    Each poll writes one line holding its records and the new checkpoint, so a poll that
+    is interrupted before the line is complete is read again on resume.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        if not os.path.exists(path):
+            return
+        with open(path, "r+") as f:
+            complete = 0
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                entry = json.loads(line)
+                super().add(map(_from_json, entry["records"]), entry["checkpoint"])
+                complete += len(line)
+            # Drop an interrupted last line so that the next one starts on its own line
+            f.truncate(complete)
+
+    def add(self, records, checkpoint):
+        records = list(records)
+        entry = dict(checkpoint=checkpoint, records=[record.to_json() for record in records])
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        super().add(records, checkpoint)
+
+
+class EventIndexer:
+    """Streams the events of the exchange at contract_address from source into a ledger."""
+
+    def __init__(self, source, contract_address, ledger=None):
+        self.source = source
+        self.contract_address = contract_address
+        self.ledger = FillLedger() if ledger is None else ledger
+
+    def poll(self):
+        """Reads the events emitted since the ledger checkpoint. Returns the new records."""
+        events = self.source.events
+        checkpoint = self.ledger.checkpoint
+        if checkpoint == len(events):
+            return []
+        records = []
+        for event in events[checkpoint:]:
+            if event.from_address != self.contract_address or not event.keys:
+                continue
+            if event.keys[0] == ORDER_FILLED_SELECTOR:
+                records.append(OrderFilled.from_data(event.data))
+            elif event.keys[0] == ORDER_CANCELLED_SELECTOR:
+                records.append(OrderCancelled.from_data(event.data))
+            elif event.keys[0] == ALL_ORDERS_CANCELLED_SELECTOR:
+                records.append(AllOrdersCancelled.from_data(event.data))
+        self.ledger.add(records, len(events))
+        return records
@@ -0,0 +1,213 @@
+"""Append-only journal of signed ZZ_Messages and their orderstatus, read through a memory map.
+
+Every record has the same width. It holds the 15 felts of a signed ZZ_Message in calldata order,
+as laid out by lib.calldata, then the message hash, then the orderstatus the relayer knows for
+it: the filled base quantity, or base_quantity + 1 once cancelled. Each felt takes 32 big-endian
+bytes.
+
+Opening a journal maps the file and indexes the hash bytes of every record. No message is
+decoded or hashed, so a restart costs one pass over the file, and messages are decoded only
+when read. Orders are only ever appended; the orderstatus is the one field written in place.
+compact rewrites the journal without the orders that can not be filled any more, given the
+order_epoch of each sender.
+"""
+
+import mmap
+import os
+
+from lib.calldata import CalldataSerializer
+
+MAGIC = b"ZZJOURNAL"
+FELT_BYTES = 32
+# MAGIC and the record size, padded to one felt
+HEADER_SIZE = FELT_BYTES
+
+
+def _felt_bytes(felt):
+    return felt.to_bytes(FELT_BYTES, "big")
+
+
+class OrderJournal:
+    """The signed orders of the journal file at path, by message hash. The file is created if
+    it does not exist.
+
+    A record cut short by a crash during an append is dropped when the journal is opened, and
+    a file cut short within the header is started afresh.
+    """
+
+    def __init__(self, path, serializer=None):
+        if serializer is None:
+            serializer = CalldataSerializer()
+        self.path = path
+        self._serializer = serializer
+        paths = serializer.layout.structs["ZZ_Message"].paths
+        self._message_size = len(paths)
+        self._hash_offset = self._message_size * FELT_BYTES
+        self._filled_offset = self._hash_offset + FELT_BYTES
+        self.record_size = self._filled_offset + FELT_BYTES
+        self._base_quantity_offset = paths.index("order.base_quantity") * FELT_BYTES
+        self._expiration_offset = paths.index("order.expiration") * FELT_BYTES
+        self._sender_offset = paths.index("sender") * FELT_BYTES
+        self._epoch_offset = paths.index("order.epoch") * FELT_BYTES
+        self._header = (MAGIC + self.record_size.to_bytes(4, "big")).ljust(HEADER_SIZE, b"\0")
+        self._open()
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(fd).st_size
+        if size < HEADER_SIZE and self._header.startswith(os.pread(fd, size, 0)):
+            # New, or the header write was cut short
+            os.pwrite(fd, self._header, 0)
+            size = HEADER_SIZE
+        elif os.pread(fd, HEADER_SIZE, 0) != self._header:
+            os.close(fd)
+            raise ValueError(f"{self.path} is not a journal of {self.record_size} byte records")
+        torn = (size - HEADER_SIZE) % self.record_size
+        if torn:
+            size -= torn
+            os.ftruncate(fd, size)
+        self._fd = fd
+        self._size = size
+        self._map = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        # hash bytes -> record number
+        data = self._map
+        start = HEADER_SIZE + self._hash_offset
+        self._index = {
+            data[offset : offset + FELT_BYTES]: i
+            for i, offset in enumerate(range(start, size, self.record_size))
+        }
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, message_hash):
+        return _felt_bytes(message_hash) in self._index
+
+    def flush(self):
+        """Makes the appends and orderstatus writes so far durable."""
+        os.fsync(self._fd)
+
+    def append(self, message, signature, message_hash=None, filled=0):
+        """Appends a signed message. message_hash defaults to message.hash(). Returns it."""
+        if message_hash is None:
+            message_hash = message.hash()
+        self.extend([(message, signature, message_hash, filled)])
+        return message_hash
+
+    def extend(self, entries):
+        """Appends (message, (sig_r, sig_s), message_hash, filled) entries in one write. Raises
+        ValueError, without appending any, if a hash is already in the journal."""
+        write_message = self._serializer.write_message
+        felts = [0] * (self._message_size + 2)
+        records = {}
+        for message, signature, message_hash, filled in entries:
+            key = _felt_bytes(message_hash)
+            if key in self._index or key in records:
+                raise ValueError(f"Order {message_hash:#x} is already in the journal")
+            write_message(felts, 0, (message, signature))
+            felts[-2] = message_hash
+            felts[-1] = filled
+            records[key] = b"".join(map(_felt_bytes, felts))
+        os.pwrite(self._fd, b"".join(records.values()), self._size)
+        self._size += len(records) * self.record_size
+        first = len(self._index)
+        self._index.update((key, first + i) for i, key in enumerate(records))
+
+    def get(self, message_hash):
+        """Returns the (ZZ_Message, (sig_r, sig_s), orderstatus) of a hash, or None."""
+        i = self._index.get(_felt_bytes(message_hash))
+        if i is None:
+            return None
+        start = self._record_offset(i)
+        data = self._map
+        felts = [
+            int.from_bytes(data[offset : offset + FELT_BYTES], "big")
+            for offset in range(start, start + self.record_size, FELT_BYTES)
+        ]
+        message, signature = self._serializer.read_message(felts, 0)
+        return message, signature, felts[-1]
+
+    def get_order_status(self, message_hash):
+        """The orderstatus of a hash in the journal, read without decoding its message."""
+        offset = self._record_offset(self._index[_felt_bytes(message_hash)])
+        return self._felt(offset + self._filled_offset)
+
+    def set_order_status(self, message_hash, filled):
+        """Records the orderstatus of a hash in the journal, as read from the contract."""
+        i = self._index[_felt_bytes(message_hash)]
+        offset = HEADER_SIZE + i * self.record_size + self._filled_offset
+        os.pwrite(self._fd, _felt_bytes(filled), offset)
+
+    def open_orders(self, block_timestamp, epochs):
+        """Yields the hash of every order that fill_order could still fill at block_timestamp.
+
+        epochs maps senders to their order_epoch, such as FillLedger.epochs. Orders of other
+        senders are checked against epoch 0.
+        """
+        hash_offset = self._hash_offset
+        for i in range(len(self._index)):
+            start = self._record_offset(i)
+            if self._is_open(start, block_timestamp, epochs):
+                yield self._felt(start + hash_offset)
+
+    def compact(self, block_timestamp, epochs):
+        """Rewrites the journal without the orders that are fully filled, cancelled or expired
+        at block_timestamp, with epochs as for open_orders. Returns the number of orders
+        removed."""
+        self._remap()
+        data = self._map
+        record_size = self.record_size
+        path = self.path + ".compact"
+        kept = 0
+        with open(path, "wb") as f:
+            f.write(self._header)
+            for start in range(HEADER_SIZE, self._size, record_size):
+                if self._is_open(start, block_timestamp, epochs):
+                    f.write(data[start : start + record_size])
+                    kept += 1
+            f.flush()
+            os.fsync(f.fileno())
+        removed = len(self._index) - kept
+        self.close()
+        os.replace(path, self.path)
+        self._open()
+        return removed
+
+    def _remap(self):
+        """Maps the records appended since the map was made."""
+        if len(self._map) < self._size:
+            self._map.close()
+            self._map = mmap.mmap(self._fd, self._size, access=mmap.ACCESS_READ)
+
+    def _record_offset(self, i):
+        """The offset of record i in the map."""
+        start = HEADER_SIZE + i * self.record_size
+        if start + self.record_size > len(self._map):
+            self._remap()
+        return start
+
+    def _felt(self, offset):
+        return int.from_bytes(self._map[offset : offset + FELT_BYTES], "big")
+
+    def _is_open(self, start, block_timestamp, epochs):
+        # check_order_valid rejects a fill past base_quantity, which a cancel sets it beyond,
+        # one after the expiration and one of an epoch below the order_epoch of the sender
+        return (
+            self._felt(start + self._filled_offset)
+            < self._felt(start + self._base_quantity_offset)
+            and block_timestamp <= self._felt(start + self._expiration_offset)
+            and epochs.get(self._felt(start + self._sender_offset), 0)
+            <= self._felt(start + self._epoch_offset)
+        )
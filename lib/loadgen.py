@@ -0,0 +1,308 @@
+"""Load generator for sustained multi-market matching sessions against a local Starknet.
+
+deploy_load_session deploys an exchange with N accounts and M token pairs, funds every account
+in every token and approves the exchange for all of it. run_load_session then streams random
+signed orders from one producer into a lib.matching MatchingEngine. Many asyncio worker tasks
+submit the fills and cancels that the producer yields. The block timestamp moves forward as
+orders come in, so short-lived orders expire on the way, sometimes after their fill is queued.
+
+The testing framework applies one transaction at a time, so workers take turns on a lock, like
+transactions waiting for a sequencer. A latency runs from the moment the producer queues the
+transaction until it is applied or rejected, so it includes that wait.
+"""
+
+import asyncio
+import dataclasses
+import os
+import random
+import re
+import time
+from collections import Counter
+
+from starkware.starkware_utils.error_handling import StarkException
+
+from lib.contract_cache import REPO_ROOT, deploy_contract
+from lib.matching import MatchingEngine
+from lib.order_signer import OrderSigner
+from lib.utils import MAX_UINT256, Signer
+from lib.zz_message import DOMAIN_PREFIX, MESSAGE_PREFIX, Order
+
+CONTRACT_FILE = os.path.join(REPO_ROOT, "zigzag.cairo")
+ERC20_FILE = os.path.join(REPO_ROOT, "lib/ERC20.cairo")
+ACCOUNT_FILE = os.path.join(REPO_ROOT, "lib/Account.cairo")
+
+# Receives the supply that every token mints in its constructor, and owns the exchange
+FUNDER = 0xF0
+# Supply minted by the lib/ERC20.cairo constructor
+MINTED = 100 * 10 ** 18
+# Expiration of the orders that are not short-lived
+NO_EXPIRATION = 2 ** 40
+
+
+class LoadConfig:
+    """Size and mix of a session.
+
+    Every orders_per_tick orders the block timestamp advances by one. A short-lived order
+    expires one or two ticks after it is made, and after each order a resting one is cancelled
+    with probability cancel_rate. Prices are drawn around 1 so that buys and sells cross often.
+    """
+
+    def __init__(
+        self,
+        n_accounts=4,
+        n_markets=2,
+        n_orders=100,
+        workers=8,
+        orders_per_tick=10,
+        short_lived_rate=0.1,
+        cancel_rate=0.1,
+        max_quantity=1000,
+        seed=0,
+    ):
+        if n_accounts < 2 or n_markets < 1:
+            raise ValueError("A session needs two accounts and a market")
+        self.n_accounts = n_accounts
+        self.n_markets = n_markets
+        self.n_orders = n_orders
+        self.workers = workers
+        self.orders_per_tick = orders_per_tick
+        self.short_lived_rate = short_lived_rate
+        self.cancel_rate = cancel_rate
+        self.max_quantity = max_quantity
+        self.seed = seed
+
+
+class LoadSession:
+    """The deployed contracts of a session and an OrderSigner for every account."""
+
+    def __init__(self, starknet, exchange, accounts, markets, order_signers):
+        self.starknet = starknet
+        self.exchange = exchange
+        # (Signer, account contract) pairs
+        self.accounts = accounts
+        # (base token, quote token) pairs
+        self.markets = markets
+        # account address -> OrderSigner
+        self.order_signers = order_signers
+
+    @property
+    def block_timestamp(self):
+        return self.starknet.state.state.block_info.block_timestamp
+
+    @block_timestamp.setter
+    def block_timestamp(self, timestamp):
+        state = self.starknet.state.state
+        state.block_info = dataclasses.replace(state.block_info, block_timestamp=timestamp)
+
+
+class LoadReport:
+    """What a session did, and the latency in seconds of every submitted transaction by kind,
+    "fill" or "cancel"."""
+
+    def __init__(self):
+        self.orders = 0
+        self.expired = 0
+        self.fills = 0
+        # Fills that leave the resting or the incoming order with a remainder
+        self.partial_fills = 0
+        self.cancels = 0
+        # (kind, cause) -> rejected transactions
+        self.failures = Counter()
+        self.latencies = {"fill": [], "cancel": []}
+        self.elapsed = 0.0
+
+    @property
+    def fills_per_second(self):
+        return self.fills / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, kind, q):
+        """The nearest-rank q-th percentile of the latencies of kind, or None without any."""
+        latencies = sorted(self.latencies[kind])
+        if not latencies:
+            return None
+        rank = max(1, -(-len(latencies) * q // 100))
+        return latencies[int(rank) - 1]
+
+    def summary(self):
+        lines = [
+            f"{self.orders} orders, {self.expired} expired in the book, {self.elapsed:.1f} s",
+            f"{self.fills} fills, {self.partial_fills} partial, "
+            f"{self.fills_per_second:.2f} fills/s",
+            f"{self.cancels} cancels",
+        ]
+        for kind, latencies in sorted(self.latencies.items()):
+            if latencies:
+                p50, p90, p99 = (self.percentile(kind, q) for q in (50, 90, 99))
+                lines.append(
+                    f"{kind} latency p50 {p50:.3f} s, p90 {p90:.3f} s, p99 {p99:.3f} s,"
+                    f" max {max(latencies):.3f} s"
+                )
+        for (kind, cause), count in sorted(self.failures.items()):
+            lines.append(f"{kind} failed {count}x: {cause}")
+        return "\n".join(lines)
+
+
+async def deploy_load_session(starknet, config):
+    """Deploys the exchange, config.n_accounts accounts and config.n_markets token pairs,
+    splits the supply of every token over the accounts and approves the exchange."""
+    salts = iter(range(1, 2 ** 32))
+    exchange = await deploy_contract(
+        starknet, CONTRACT_FILE, contract_address_salt=next(salts), constructor_calldata=[FUNDER]
+    )
+    accounts = []
+    for i in range(config.n_accounts):
+        signer = Signer(10 ** 20 + config.seed * 10 ** 6 + i)
+        account = await deploy_contract(
+            starknet,
+            ACCOUNT_FILE,
+            contract_address_salt=next(salts),
+            constructor_calldata=[signer.public_key],
+        )
+        await account.initialize(account.contract_address).invoke()
+        accounts.append((signer, account))
+
+    tokens = []
+    for _ in range(2 * config.n_markets):
+        token = await deploy_contract(
+            starknet, ERC20_FILE, contract_address_salt=next(salts), constructor_calldata=[FUNDER]
+        )
+        tokens.append(token)
+    markets = list(zip(tokens[::2], tokens[1::2]))
+
+    share = MINTED // config.n_accounts
+    for signer, account in accounts:
+        for token in tokens:
+            await token.transfer(account.contract_address, (share, 0)).invoke(
+                caller_address=FUNDER
+            )
+        approve_calldata = [exchange.contract_address, *MAX_UINT256]
+        await signer.send_transactions(
+            account, [(token.contract_address, "approve", approve_calldata) for token in tokens]
+        )
+
+    order_signers = {
+        account.contract_address: OrderSigner(
+            signer, account.contract_address, MESSAGE_PREFIX, DOMAIN_PREFIX
+        )
+        for signer, account in accounts
+    }
+    return LoadSession(starknet, exchange, accounts, markets, order_signers)
+
+
+async def run_load_session(session, config):
+    """Runs config.n_orders random orders through a MatchingEngine and submits the fills and
+    cancels from config.workers tasks. Returns a LoadReport."""
+    rng = random.Random(config.seed)
+    report = LoadReport()
+    queue = asyncio.Queue(maxsize=2 * config.workers)
+    sequencer = asyncio.Lock()
+    start = time.perf_counter()
+    workers = [
+        asyncio.ensure_future(_worker(session, queue, sequencer, report))
+        for _ in range(config.workers)
+    ]
+    try:
+        await _produce(session, config, rng, queue, sequencer, report)
+        await queue.join()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+async def _produce(session, config, rng, queue, sequencer, report):
+    engine = MatchingEngine(now=session.block_timestamp)
+    senders = [account.contract_address for _, account in session.accounts]
+    markets = [
+        (base.contract_address, quote.contract_address) for base, quote in session.markets
+    ]
+    for i in range(config.n_orders):
+        if i and i % config.orders_per_tick == 0:
+            # Not while a transaction runs, which reads the block info
+            async with sequencer:
+                session.block_timestamp += 1
+            report.expired += len(engine.expire(session.block_timestamp))
+
+        now = session.block_timestamp
+        base_asset, quote_asset = rng.choice(markets)
+        if rng.random() < config.short_lived_rate:
+            expiration = now + rng.randrange(1, 3)
+        else:
+            expiration = NO_EXPIRATION
+        order = Order(
+            base_asset,
+            quote_asset,
+            rng.randrange(2),
+            rng.randrange(1, config.max_quantity + 1),
+            (rng.randrange(90, 111), 100),
+            expiration,
+        )
+        signer = session.order_signers[rng.choice(senders)]
+        message_hash = signer.hash(order)
+        fills = engine.add_order(signer.message(order), signer.sign(order), message_hash)
+        report.orders += 1
+        taker_remaining = order.base_quantity
+        for fill in fills:
+            maker = fill.sell if fill.buy.message_hash == message_hash else fill.buy
+            # A taker meets each maker once, so the maker keeps its remainder after this fill,
+            # while the taker's remainder is counted down fill by fill
+            taker_remaining -= fill.base_fill_quantity
+            partial = maker.remaining > 0 or taker_remaining > 0
+            await queue.put(("fill", fill, time.perf_counter(), partial))
+
+        if engine.orders and rng.random() < config.cancel_rate:
+            book_order = rng.choice(list(engine.orders.values()))
+            engine.cancel_order(book_order.message_hash)
+            await queue.put(("cancel", book_order, time.perf_counter(), False))
+        # Lets the workers pick up what was queued while orders are signed
+        await asyncio.sleep(0)
+
+
+async def _worker(session, queue, sequencer, report):
+    while True:
+        kind, item, queued, partial = await queue.get()
+        try:
+            async with sequencer:
+                await _submit(session, kind, item, partial, report)
+        finally:
+            report.latencies[kind].append(time.perf_counter() - queued)
+            queue.task_done()
+
+
+async def _submit(session, kind, item, partial, report):
+    """Applies a fill or a cancel at the current block timestamp and counts it in report."""
+    exchange = session.exchange
+    now = session.block_timestamp
+    try:
+        if kind == "fill":
+            await exchange.fill_order(**item.to_starknet_args()).invoke()
+        else:
+            message = item.message
+            await exchange.cancel_order(
+                message.to_signed_starknet_args(*item.signature)
+            ).invoke(caller_address=message.sender)
+    except StarkException as e:
+        report.failures[(kind, _failure_cause(kind, item, now, e))] += 1
+    else:
+        if kind == "fill":
+            report.fills += 1
+            report.partial_fills += partial
+        else:
+            report.cancels += 1
+
+
+def _failure_cause(kind, item, now, exception):
+    """"expired" for a fill of an order that expired before it was applied, otherwise the Cairo
+    error_message of the failing assertion or the StarkNet error code."""
+    if kind == "fill":
+        # check_order_valid asserts assert_nn_le(contract_time, expiration), so an order can
+        # still be filled at its expiration and not after it
+        expirations = (item.buy.message.order.expiration, item.sell.message.order.expiration)
+        if any(now > expiration for expiration in expirations):
+            return "expired"
+    match = re.search(r"Error message: (.*)", str(exception.message))
+    if match is not None:
+        return match.group(1).strip()
+    return exception.code.name
@@ -0,0 +1,294 @@
+"""Price-time priority matching of signed ZZ_Messages into fill_order arguments.
+
+Prices are compared exactly by cross-multiplication, as check_order_valid does, and
+partial fills are tracked by message hash so that they line up with orderstatus.
+"""
+
+import heapq
+from collections import deque
+from math import gcd
+
+BUY_SIDE = 0
+SELL_SIDE = 1
+
+
+class _Price:
+    """An exact PriceRatio ordered by value. Equal ratios share one price level."""
+
+    __slots__ = ("numerator", "denominator", "key")
+
+    def __init__(self, numerator, denominator):
+        divisor = gcd(numerator, denominator) or 1
+        self.numerator = numerator
+        self.denominator = denominator
+        self.key = (numerator // divisor, denominator // divisor)
+
+    def __lt__(self, other):
+        return self.numerator * other.denominator < other.numerator * self.denominator
+
+
+class _BidPrice(_Price):
+    """Reversed order so that heapq pops the highest bid first."""
+
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return self.numerator * other.denominator > other.numerator * self.denominator
+
+
+class BookOrder:
+    __slots__ = (
+        "message",
+        "message_hash",
+        "signature",
+        "remaining",
+        "expiration",
+        "sequence",
+        "active",
+    )
+
+    def __init__(self, message, message_hash, signature, remaining, expiration, sequence):
+        self.message = message
+        self.message_hash = message_hash
+        self.signature = signature
+        self.remaining = remaining
+        self.expiration = expiration
+        self.sequence = sequence
+        self.active = True
+
+
+class Fill:
+    """A match between a resting maker and an incoming taker, at the maker's price."""
+
+    __slots__ = ("buy", "sell", "fill_price", "base_fill_quantity")
+
+    def __init__(self, buy, sell, fill_price, base_fill_quantity):
+        self.buy = buy
+        self.sell = sell
+        self.fill_price = fill_price
+        self.base_fill_quantity = base_fill_quantity
+
+    def to_starknet_args(self):
+        """Keyword arguments for fill_order."""
+        return dict(
+            buy_order=self.buy.message.to_signed_starknet_args(*self.buy.signature),
+            sell_order=self.sell.message.to_signed_starknet_args(*self.sell.signature),
+            fill_price=self.fill_price,
+            base_fill_quantity=self.base_fill_quantity,
+        )
+
+
+def fill_orders_batch_args(fills):
+    """Keyword arguments for fill_orders_batch or fill_orders_batch_netted."""
+    args = [fill.to_starknet_args() for fill in fills]
+    return dict(
+        buy_orders=[a["buy_order"] for a in args],
+        sell_orders=[a["sell_order"] for a in args],
+        fill_prices=[a["fill_price"] for a in args],
+        base_fill_quantities=[a["base_fill_quantity"] for a in args],
+    )
+
+
+class _BookSide:
+    __slots__ = ("price_type", "levels", "heap")
+
+    def __init__(self, price_type):
+        self.price_type = price_type
+        # price key -> deque of BookOrders in time priority
+        self.levels = {}
+        # _Price of every level, which may be empty until it reaches the top
+        self.heap = []
+
+    def add(self, numerator, denominator, book_order):
+        divisor = gcd(numerator, denominator) or 1
+        level = self.levels.get((numerator // divisor, denominator // divisor))
+        if level is None:
+            price = self.price_type(numerator, denominator)
+            level = self.levels[price.key] = deque()
+            heapq.heappush(self.heap, price)
+        level.append(book_order)
+
+    def best(self):
+        """Returns the best price and its level, dropping cancelled or expired orders on top."""
+        heap = self.heap
+        while heap:
+            price = heap[0]
+            level = self.levels[price.key]
+            while level and not level[0].active:
+                level.popleft()
+            if level:
+                return price, level
+            heapq.heappop(heap)
+            del self.levels[price.key]
+        return None, None
+
+
+class OrderBook:
+    """Bids and asks of one (base_asset, quote_asset) market."""
+
+    __slots__ = ("bids", "asks")
+
+    def __init__(self):
+        self.bids = _BookSide(_BidPrice)
+        self.asks = _BookSide(_Price)
+
+
+class MatchingEngine:
+    """Continuous price-time priority matching over one book per (base_asset, quote_asset).
+
+    Orders are matched on insertion; whatever is left rests in the book. Each fill happens
+    at the resting order's price, which satisfies both limits of check_order_valid.
+    """
+
+    def __init__(self, now=0):
+        self.now = now
+        self.books = {}
+        # message hash -> BookOrder, for every order resting in a book
+        self.orders = {}
+        # message hash -> base quantity filled, mirroring orderstatus
+        self.filled = {}
+        self._expiry = []
+        self._sequence = 0
+
+    def book(self, base_asset, quote_asset):
+        book = self.books.get((base_asset, quote_asset))
+        if book is None:
+            book = self.books[(base_asset, quote_asset)] = OrderBook()
+        return book
+
+    def add_order(self, message, signature, message_hash=None, filled=None):
+        """Matches a signed message against the book and rests the remainder.
+
+        message_hash defaults to message.hash(), which costs 13 Pedersen hashes; pass it when
+        it is already known. filled is the quantity already filled on chain and defaults to
+        what this engine has recorded. Returns the list of Fills produced.
+        """
+        if message_hash is None:
+            message_hash = message.hash()
+        orders = self.orders
+        if message_hash in orders:
+            raise ValueError("Order is already in the book")
+        order = message.order
+        if filled is None:
+            filled = self.filled.get(message_hash, 0)
+        else:
+            self.filled[message_hash] = filled
+        remaining = order.base_quantity - filled
+        expiration = order.expiration
+        if remaining <= 0 or expiration < self.now:
+            return []
+
+        sequence = self._sequence = self._sequence + 1
+        book_order = BookOrder(message, message_hash, signature, remaining, expiration, sequence)
+        book = self.books.get((order.base_asset, order.quote_asset))
+        if book is None:
+            book = self.book(order.base_asset, order.quote_asset)
+        price = order.price
+        numerator = price.numerator
+        denominator = price.denominator
+        side = order.side
+        if side == BUY_SIDE:
+            makers, resting_side = book.asks, book.bids
+        elif side == SELL_SIDE:
+            makers, resting_side = book.bids, book.asks
+        else:
+            raise ValueError(f"Invalid side {side}")
+
+        # The top of the heap may be an emptied level, but it is never worse than the real best
+        # price, so if it does not cross there is nothing to match
+        fills = []
+        if makers.heap:
+            top = makers.heap[0]
+            if side == BUY_SIDE:
+                crosses = top.numerator * denominator <= numerator * top.denominator
+            else:
+                crosses = numerator * top.denominator <= top.numerator * denominator
+            if crosses:
+                fills = self._match(book_order, makers, side == BUY_SIDE)
+
+        if book_order.remaining > 0:
+            resting_side.add(numerator, denominator, book_order)
+            orders[message_hash] = book_order
+            heapq.heappush(self._expiry, (expiration, sequence, book_order))
+        return fills
+
+    def _match(self, taker, makers, taker_is_buy):
+        fills = []
+        limit = taker.message.order.price
+        limit_numerator = limit.numerator
+        limit_denominator = limit.denominator
+        filled = self.filled
+        orders = self.orders
+        heap = makers.heap
+        levels = makers.levels
+        remaining = taker.remaining
+        taker_filled = 0
+        while remaining > 0:
+            # best(), inlined for the usual case of an active order at the top of the heap
+            if not heap:
+                break
+            price = heap[0]
+            level = levels[price.key]
+            if not (level and level[0].active):
+                price, level = makers.best()
+                if price is None:
+                    break
+            # The maker's price must not be worse than the taker's limit
+            if taker_is_buy:
+                if price.numerator * limit_denominator > limit_numerator * price.denominator:
+                    break
+            elif limit_numerator * price.denominator > price.numerator * limit_denominator:
+                break
+
+            maker = level[0]
+            maker_remaining = maker.remaining
+            quantity = remaining if remaining < maker_remaining else maker_remaining
+            remaining -= quantity
+            maker.remaining = maker_remaining - quantity
+            taker_filled += quantity
+            filled[maker.message_hash] = filled.get(maker.message_hash, 0) + quantity
+            maker_price = maker.message.order.price
+            fill_price = (maker_price.numerator, maker_price.denominator)
+            if taker_is_buy:
+                fills.append(Fill(taker, maker, fill_price, quantity))
+            else:
+                fills.append(Fill(maker, taker, fill_price, quantity))
+            if maker_remaining == quantity:
+                maker.active = False
+                level.popleft()
+                del orders[maker.message_hash]
+        taker.remaining = remaining
+        if taker_filled:
+            filled[taker.message_hash] = filled.get(taker.message_hash, 0) + taker_filled
+        return fills
+
+    def cancel_order(self, message_hash):
+        """Removes a resting order. Returns False if it was not in the book."""
+        book_order = self.orders.pop(message_hash, None)
+        if book_order is None:
+            return False
+        book_order.active = False
+        return True
+
+    def expire(self, now):
+        """Advances the clock and drops every resting order whose expiration is before now,
+        the same condition under which check_order_valid rejects it. Returns their hashes.
+        """
+        self.now = now
+        expired = []
+        expiry = self._expiry
+        while expiry and expiry[0][0] < now:
+            _, _, book_order = heapq.heappop(expiry)
+            if book_order.active:
+                book_order.active = False
+                del self.orders[book_order.message_hash]
+                expired.append(book_order.message_hash)
+        return expired
+
+    def best_bid(self, base_asset, quote_asset):
+        price, _ = self.book(base_asset, quote_asset).bids.best()
+        return None if price is None else (price.numerator, price.denominator)
+
+    def best_ask(self, base_asset, quote_asset):
+        price, _ = self.book(base_asset, quote_asset).asks.best()
+        return None if price is None else (price.numerator, price.denominator)
@@ -0,0 +1,639 @@
+"""Pure-Python model of zigzag.cairo and the lib/ERC20.cairo tokens it trades, for simulations
+of far more fills than the testing framework can run.
+
+Each external makes the contract's checks and writes in the contract's order, with felt
+arithmetic wherever it changes the outcome, and is atomic like a transaction: a call that raises
+ModelError leaves the state as it was. Signatures are not checked, so the model accepts any
+message its sender could have signed. Message fields must be felts.
+
+State lives in flat dicts keyed by felts or tuples of felts. Hashing a message costs far more
+than the rest of a fill, so the fill functions take precomputed message hashes as well.
+"""
+
+from starkware.crypto.signature.signature import FIELD_PRIME
+
+from lib.validation import CONFIG_FILE, MAX_DIV, RANGE_CHECK_BOUND, _nn_le, load_config
+
+UINT256_BOUND = 2 ** 256
+# lib/ERC20.cairo fails these assertions without an error_message, so the contract only reports
+# the failing assert_not_zero
+INSUFFICIENT_ALLOWANCE = "transfer_from: uint256_le(amount, caller_allowance)"
+INSUFFICIENT_BALANCE = "_transfer: uint256_le(amount, sender_balance)"
+
+
+class ModelError(Exception):
+    """A call the contract would revert. The message is the Cairo error_message where the
+    failing assertion has one, and otherwise names the assertion, which the contract does not
+    report."""
+
+
+class ExchangeModel:
+    """State of one exchange contract and every token it trades.
+
+    balances is keyed by (asset, account) and allowances by (asset, owner, spender), with the
+    Uint256 amounts of lib/ERC20.cairo as ints. Tokens exist once something is minted in them.
+    """
+
+    __slots__ = (
+        "address",
+        "owner",
+        "block_timestamp",
+        "orderstatus",
+        "order_epoch",
+        "signing_key",
+        "accrued_fees",
+        "balances",
+        "allowances",
+        "tokens",
+        "_storage",
+        "_journal",
+        "_message_prefix",
+        "_domain",
+        "_buy_side",
+        "_sell_side",
+    )
+
+    def __init__(self, address, owner, block_timestamp=0, config_path=CONFIG_FILE):
+        config = load_config(config_path)
+        self.address = address
+        self.owner = owner
+        self.block_timestamp = block_timestamp
+        # message hash -> filled base quantity
+        self.orderstatus = {}
+        # sender -> epoch
+        self.order_epoch = {}
+        # account -> registered public key
+        self.signing_key = {}
+        # asset -> fees not swept yet
+        self.accrued_fees = {}
+        self.balances = {}
+        self.allowances = {}
+        self.tokens = set()
+        # name -> value of the storage variables without keys, so that _write journals them
+        self._storage = {"protocol_fee_bips": config["PROTOCOL_FEE_BIPS"]}
+        # (table, key, previous value) of every write of the current call. Storage reads 0 where
+        # it was never written, so a rollback writes 0 back instead of deleting the key
+        self._journal = None
+        self._message_prefix = config["STARKNET_MESSAGE_PREFIX"]
+        self._domain = (config["DOMAIN_NAME"], config["APP_VERSION"], config["CHAIN_ID"])
+        self._buy_side = config["BUY_SIDE"]
+        self._sell_side = config["SELL_SIDE"]
+
+    @property
+    def protocol_fee_bips(self):
+        return self._storage["protocol_fee_bips"]
+
+    ##############
+    # Exchange externals
+    ##############
+
+    def fill_order(
+        self, buy_order, sell_order, fill_price, base_fill_quantity, buy_hash=None, sell_hash=None
+    ):
+        """Mirrors fill_order for two ZZ_Messages and a (numerator, denominator) fill_price."""
+        # _call, inlined since simulations make this call far more than any other
+        self._journal = []
+        try:
+            self._fill_order(
+                buy_order, sell_order, fill_price, base_fill_quantity, buy_hash, sell_hash
+            )
+        except ModelError:
+            self._rollback()
+            raise
+        finally:
+            self._journal = None
+
+    def fill_orders_batch(
+        self,
+        buy_orders,
+        sell_orders,
+        fill_prices,
+        base_fill_quantities,
+        buy_hashes=None,
+        sell_hashes=None,
+    ):
+        self._call(
+            self._fill_orders_batch,
+            buy_orders,
+            sell_orders,
+            fill_prices,
+            base_fill_quantities,
+            buy_hashes,
+            sell_hashes,
+        )
+
+    def fill_orders_batch_netted(
+        self,
+        buy_orders,
+        sell_orders,
+        fill_prices,
+        base_fill_quantities,
+        buy_hashes=None,
+        sell_hashes=None,
+    ):
+        self._call(
+            self._fill_orders_batch_netted,
+            buy_orders,
+            sell_orders,
+            fill_prices,
+            base_fill_quantities,
+            buy_hashes,
+            sell_hashes,
+        )
+
+    def settle_batch_auction(
+        self,
+        buy_orders,
+        buy_fills,
+        sell_orders,
+        sell_fills,
+        clearing_price,
+        buy_hashes=None,
+        sell_hashes=None,
+    ):
+        """Mirrors settle_batch_auction for lists of ZZ_Messages and their fills."""
+        self._call(
+            self._settle_batch_auction,
+            buy_orders,
+            buy_fills,
+            sell_orders,
+            sell_fills,
+            clearing_price,
+            buy_hashes,
+            sell_hashes,
+        )
+
+    def cancel_order(self, message, caller, message_hash=None):
+        self._call(self._cancel_order, message, caller, message_hash)
+
+    def cancel_all_orders(self, caller):
+        """Returns the new epoch of caller."""
+        return self._call(self._cancel_all_orders, caller)
+
+    def register_signing_key(self, public_key, caller):
+        self._call(self._register_signing_key, public_key, caller)
+
+    def set_protocol_fee_bips(self, bips, caller):
+        self._call(self._set_protocol_fee_bips, bips, caller)
+
+    def sweep_fees(self, asset, caller):
+        """Returns the amount paid to the owner."""
+        return self._call(self._sweep_fees, asset, caller)
+
+    ##############
+    # Exchange views
+    ##############
+
+    def get_order_status(self, message_hash):
+        return self.orderstatus.get(message_hash, 0)
+
+    def get_order_epoch(self, sender):
+        return self.order_epoch.get(sender, 0)
+
+    def get_signing_key(self, account):
+        return self.signing_key.get(account, 0)
+
+    def get_accrued_fees(self, asset):
+        """The fees of asset that sweep_fees would pay out, all held by the exchange."""
+        return self.accrued_fees.get(asset, 0)
+
+    ##############
+    # ERC20
+    ##############
+
+    def mint(self, asset, recipient, amount):
+        """The constructor of a token, or a later mint, for amount < 2 ** 256."""
+        self.tokens.add(asset)
+        key = (asset, recipient)
+        self.balances[key] = (self.balances.get(key, 0) + amount) % UINT256_BOUND
+
+    def approve(self, asset, caller, spender, amount):
+        self._call(self._approve, asset, caller, spender, amount)
+
+    def transfer(self, asset, caller, recipient, amount):
+        self._call(self._transfer, asset, caller, recipient, amount)
+
+    def balance_of(self, asset, account):
+        return self.balances.get((asset, account), 0)
+
+    def allowance(self, asset, owner, spender):
+        return self.allowances.get((asset, owner, spender), 0)
+
+    ##############
+    # Transactions
+    ##############
+
+    def _call(self, function, *args):
+        self._journal = []
+        try:
+            return function(*args)
+        except ModelError:
+            self._rollback()
+            raise
+        finally:
+            self._journal = None
+
+    def _rollback(self):
+        for table, key, value in reversed(self._journal):
+            table[key] = value
+
+    def _write(self, table, key, value):
+        self._journal.append((table, key, table.get(key, 0)))
+        table[key] = value
+
+    ##############
+    # Exchange internals
+    ##############
+
+    def _fill_order(
+        self, buy_order, sell_order, fill_price, base_fill_quantity, buy_hash, sell_hash
+    ):
+        self._match_orders(
+            buy_order, sell_order, fill_price, base_fill_quantity, buy_hash, sell_hash
+        )
+        # _execute_trade, inlined
+        buy = buy_order.order
+        base_asset = buy.base_asset
+        buyer = buy_order.sender
+        seller = sell_order.sender
+        base_amount, quote_amount, fee = self._trade_amounts(base_fill_quantity, fill_price)
+        self._transfer_from(base_asset, self.address, seller, buyer, base_amount)
+        self._transfer_from(buy.quote_asset, self.address, buyer, seller, quote_amount)
+        if fee != 0:
+            self._transfer_from(base_asset, self.address, seller, self.address, fee)
+            self._accrue_fee(base_asset, fee)
+
+    def _execute_trade(
+        self, base_fill_quantity, fill_price, base_asset, quote_asset, buyer, seller
+    ):
+        """Exchange_execute_trade."""
+        base_amount, quote_amount, fee = self._trade_amounts(base_fill_quantity, fill_price)
+        self._transfer_from(base_asset, self.address, seller, buyer, base_amount)
+        self._transfer_from(quote_asset, self.address, buyer, seller, quote_amount)
+        if fee != 0:
+            self._transfer_from(base_asset, self.address, seller, self.address, fee)
+            self._accrue_fee(base_asset, fee)
+
+    def _fill_orders_batch(
+        self, buy_orders, sell_orders, fill_prices, base_fill_quantities, buy_hashes, sell_hashes
+    ):
+        n = _batch_len(buy_orders, sell_orders, fill_prices, base_fill_quantities)
+        for i in range(n):
+            self._fill_order(
+                buy_orders[i],
+                sell_orders[i],
+                fill_prices[i],
+                base_fill_quantities[i],
+                None if buy_hashes is None else buy_hashes[i],
+                None if sell_hashes is None else sell_hashes[i],
+            )
+
+    def _fill_orders_batch_netted(
+        self, buy_orders, sell_orders, fill_prices, base_fill_quantities, buy_hashes, sell_hashes
+    ):
+        n = _batch_len(buy_orders, sell_orders, fill_prices, base_fill_quantities)
+        # (asset, account) of every leg in the order Exchange_record_trade writes them
+        legs = []
+        net_deltas = {}
+        for i in range(n):
+            buy_order = buy_orders[i]
+            sell_order = sell_orders[i]
+            base_fill_quantity = base_fill_quantities[i]
+            self._match_orders(
+                buy_order,
+                sell_order,
+                fill_prices[i],
+                base_fill_quantity,
+                None if buy_hashes is None else buy_hashes[i],
+                None if sell_hashes is None else sell_hashes[i],
+            )
+            base_amount, quote_amount, fee = self._trade_amounts(
+                base_fill_quantity, fill_prices[i]
+            )
+            base_asset = buy_order.order.base_asset
+            quote_asset = buy_order.order.quote_asset
+            for leg, delta in (
+                ((base_asset, sell_order.sender), -base_fill_quantity),
+                ((base_asset, buy_order.sender), base_amount),
+                ((quote_asset, buy_order.sender), -quote_amount),
+                ((quote_asset, sell_order.sender), quote_amount),
+            ):
+                legs.append(leg)
+                net_deltas[leg] = net_deltas.get(leg, 0) + delta
+            if fee != 0:
+                self._accrue_fee(base_asset, fee)
+
+        # Exchange_settle_net_deltas: every debit into the exchange, then every credit out of it
+        for leg in legs:
+            delta = net_deltas[leg]
+            if delta < 0:
+                net_deltas[leg] = 0
+                self._transfer_from(leg[0], self.address, leg[1], self.address, _uint(-delta))
+        for leg in legs:
+            delta = net_deltas[leg]
+            if delta != 0:
+                net_deltas[leg] = 0
+                self._transfer(leg[0], self.address, leg[1], _uint(delta))
+
+    def _match_orders(
+        self, buy_order, sell_order, fill_price, base_fill_quantity, buy_hash, sell_hash
+    ):
+        # _validate_message_prefix of both messages, inlined since every fill makes them
+        domain = self._domain
+        buy_domain = buy_order.domain_prefix
+        sell_domain = sell_order.domain_prefix
+        if not (
+            buy_order.message_prefix == sell_order.message_prefix == self._message_prefix
+            and (buy_domain.name, buy_domain.version, buy_domain.chain_id) == domain
+            and (sell_domain.name, sell_domain.version, sell_domain.chain_id) == domain
+        ):
+            raise ModelError("Invalid Message")
+        if buy_hash is None:
+            buy_hash = buy_order.hash()
+        if sell_hash is None:
+            sell_hash = sell_order.hash()
+        orderstatus = self.orderstatus
+        filled_buy = orderstatus.get(buy_hash, 0)
+        filled_sell = orderstatus.get(sell_hash, 0)
+        buy = buy_order.order
+        sell = sell_order.order
+        buy_quantity = buy.base_quantity
+        sell_quantity = sell.base_quantity
+        fill_numerator, fill_denominator = fill_price
+        p = FIELD_PRIME
+        bound = RANGE_CHECK_BOUND
+        q = base_fill_quantity
+        time = self.block_timestamp
+        order_epoch = self.order_epoch
+        buy_epoch = order_epoch.get(buy_order.sender, 0)
+        sell_epoch = order_epoch.get(sell_order.sender, 0)
+        buy_limit = fill_numerator * buy.price.denominator % p
+        sell_limit = sell.price.numerator * fill_denominator % p
+
+        # check_order_valid. For felts a < bound and b, assert_nn_le(a, b) holds iff
+        # a <= b < a + bound. Once the quantities are below the bound, their sums need no
+        # reduction and assert_nn_le is a plain comparison, which also covers
+        # assert_nn_le(base_fill_quantity, base_quantity)
+        if not (
+            buy.base_asset == sell.base_asset
+            and buy.quote_asset == sell.quote_asset
+            and buy.side == self._buy_side
+            and sell.side == self._sell_side
+            and filled_buy < bound
+            and filled_sell < bound
+            and buy_quantity < bound
+            and sell_quantity < bound
+            and q < bound
+            and filled_buy + q <= buy_quantity
+            and filled_sell + q <= sell_quantity
+            and buy_limit < bound
+            and buy_limit <= buy.price.numerator * fill_denominator % p < buy_limit + bound
+            and sell_limit < bound
+            and sell_limit <= fill_numerator * sell.price.denominator % p < sell_limit + bound
+            and time < bound
+            and time <= buy.expiration < time + bound
+            and time <= sell.expiration < time + bound
+            and buy_epoch < bound
+            and buy_epoch <= buy.epoch < buy_epoch + bound
+            and sell_epoch < bound
+            and sell_epoch <= sell.epoch < sell_epoch + bound
+        ):
+            raise ModelError("Invalid order")
+
+        journal = self._journal
+        journal.append((orderstatus, buy_hash, filled_buy))
+        orderstatus[buy_hash] = filled_buy + q
+        journal.append((orderstatus, sell_hash, filled_sell))
+        orderstatus[sell_hash] = filled_sell + q
+
+    def _settle_batch_auction(
+        self,
+        buy_orders,
+        buy_fills,
+        sell_orders,
+        sell_fills,
+        clearing_price,
+        buy_hashes,
+        sell_hashes,
+    ):
+        n_buys = len(buy_orders)
+        n_sells = len(sell_orders)
+        if n_buys == 0 or n_sells == 0 or len(buy_fills) != n_buys or len(sell_fills) != n_sells:
+            raise ModelError("Invalid batch")
+        base_asset = buy_orders[0].order.base_asset
+        quote_asset = buy_orders[0].order.quote_asset
+        buy_total = self._fill_auction_orders(
+            buy_orders,
+            buy_fills,
+            buy_hashes,
+            self._buy_side,
+            base_asset,
+            quote_asset,
+            clearing_price,
+        )
+        sell_total = self._fill_auction_orders(
+            sell_orders,
+            sell_fills,
+            sell_hashes,
+            self._sell_side,
+            base_asset,
+            quote_asset,
+            clearing_price,
+        )
+        if buy_total != sell_total:
+            raise ModelError("Unbalanced auction")
+
+        # Trades the smaller of the remaining fills of the current buy and sell, moving on from
+        # a side once its fill is used up, until the last buy is
+        i = j = 0
+        buy_remaining = buy_fills[0]
+        sell_remaining = sell_fills[0]
+        while True:
+            if buy_remaining == 0:
+                if i == n_buys - 1:
+                    return
+                i += 1
+                buy_remaining = buy_fills[i]
+            elif sell_remaining == 0:
+                j += 1
+                sell_remaining = sell_fills[j]
+            else:
+                quantity = min(buy_remaining, sell_remaining)
+                self._execute_trade(
+                    quantity,
+                    clearing_price,
+                    buy_orders[i].order.base_asset,
+                    buy_orders[i].order.quote_asset,
+                    buy_orders[i].sender,
+                    sell_orders[j].sender,
+                )
+                buy_remaining -= quantity
+                sell_remaining -= quantity
+
+    def _fill_auction_orders(
+        self, orders, fills, hashes, side, base_asset, quote_asset, clearing_price
+    ):
+        """_fill_auction_orders for one side. Returns the sum of its fills."""
+        p = FIELD_PRIME
+        bound = RANGE_CHECK_BOUND
+        clearing_numerator, clearing_denominator = clearing_price
+        time = self.block_timestamp
+        total = 0
+        for i, message in enumerate(orders):
+            self._validate_message_prefix(message)
+            message_hash = message.hash() if hashes is None else hashes[i]
+            filled = self.orderstatus.get(message_hash, 0)
+            epoch = self.order_epoch.get(message.sender, 0)
+            order = message.order
+            q = fills[i]
+            # check_auction_order
+            if side == self._buy_side:
+                limit = (
+                    clearing_numerator * order.price.denominator % p,
+                    order.price.numerator * clearing_denominator % p,
+                )
+            else:
+                limit = (
+                    order.price.numerator * clearing_denominator % p,
+                    clearing_numerator * order.price.denominator % p,
+                )
+            if not (
+                order.base_asset == base_asset
+                and order.quote_asset == quote_asset
+                and order.side == side
+                and filled < bound
+                and order.base_quantity < bound
+                and q < bound
+                and _nn_le((filled + q) % p, order.base_quantity)
+                and _nn_le(*limit)
+                and _nn_le(time, order.expiration)
+                and _nn_le(epoch, order.epoch)
+            ):
+                raise ModelError("Invalid order")
+            self._write(self.orderstatus, message_hash, (filled + q) % p)
+            total = (total + q) % p
+        return total
+
+    def _validate_message_prefix(self, message):
+        domain = message.domain_prefix
+        if (
+            message.message_prefix != self._message_prefix
+            or (domain.name, domain.version, domain.chain_id) != self._domain
+        ):
+            raise ModelError("Invalid Message")
+
+    def _trade_amounts(self, base_fill_quantity, fill_price):
+        """Exchange_trade_amounts. Returns (base_amount, quote_amount, fee)."""
+        fee_product = base_fill_quantity * self._storage["protocol_fee_bips"] % FIELD_PRIME
+        fee = fee_product // 10000
+        if fee >= RANGE_CHECK_BOUND:
+            raise ModelError("unsigned_div_rem(base_fill_quantity * fee_bips, 10000)")
+        numerator, denominator = fill_price
+        if not 0 < denominator <= MAX_DIV:
+            raise ModelError(
+                "unsigned_div_rem(base_fill_quantity * fill_price.numerator, "
+                "fill_price.denominator)"
+            )
+        quote_amount = base_fill_quantity * numerator % FIELD_PRIME // denominator
+        if quote_amount >= RANGE_CHECK_BOUND:
+            raise ModelError(
+                "unsigned_div_rem(base_fill_quantity * fill_price.numerator, "
+                "fill_price.denominator)"
+            )
+        return base_fill_quantity - fee, quote_amount, fee
+
+    def _accrue_fee(self, asset, fee):
+        accrued = self.accrued_fees.get(asset, 0)
+        self._write(self.accrued_fees, asset, (accrued + fee) % FIELD_PRIME)
+
+    def _cancel_order(self, message, caller, message_hash):
+        if caller != message.sender:
+            raise ModelError("Caller is not the sender")
+        self._validate_message_prefix(message)
+        if message_hash is None:
+            message_hash = message.hash()
+        cancelled = (message.order.base_quantity + 1) % FIELD_PRIME
+        self._write(self.orderstatus, message_hash, cancelled)
+
+    def _cancel_all_orders(self, caller):
+        epoch = (self.order_epoch.get(caller, 0) + 1) % FIELD_PRIME
+        self._write(self.order_epoch, caller, epoch)
+        return epoch
+
+    def _register_signing_key(self, public_key, caller):
+        self._write(self.signing_key, caller, public_key)
+
+    def _assert_only_owner(self, caller):
+        if caller != self.owner:
+            raise ModelError("Caller is not the owner")
+
+    def _set_protocol_fee_bips(self, bips, caller):
+        self._assert_only_owner(caller)
+        if not 0 <= bips <= 10000:
+            raise ModelError("Invalid fee")
+        self._write(self._storage, "protocol_fee_bips", bips)
+
+    def _sweep_fees(self, asset, caller):
+        self._assert_only_owner(caller)
+        amount = self.accrued_fees.get(asset, 0)
+        self._write(self.accrued_fees, asset, 0)
+        self._transfer(asset, self.address, self.owner, _uint(amount))
+        return amount
+
+    ##############
+    # ERC20 internals
+    ##############
+
+    def _approve(self, asset, caller, spender, amount):
+        if asset not in self.tokens:
+            raise ModelError(f"No token at {asset:#x}")
+        self._write(self.allowances, (asset, caller, spender), amount)
+
+    def _transfer(self, asset, sender, recipient, amount):
+        """ERC20 _transfer, which transfer calls with the caller as sender."""
+        self._transfer_from(asset, None, sender, recipient, amount)
+
+    def _transfer_from(self, asset, caller, sender, recipient, amount):
+        """ERC20 transfer_from, or _transfer without an allowance if caller is None. Inlined,
+        since every fill makes two or three of them."""
+        if asset not in self.tokens:
+            raise ModelError(f"No token at {asset:#x}")
+        balances = self.balances
+        journal = self._journal
+        sender_key = (asset, sender)
+        if caller is None:
+            sender_balance = balances.get(sender_key, 0)
+            if amount > sender_balance:
+                raise ModelError(INSUFFICIENT_BALANCE)
+            journal.append((balances, sender_key, sender_balance))
+        else:
+            allowances = self.allowances
+            allowance_key = (asset, sender, caller)
+            allowance = allowances.get(allowance_key, 0)
+            if amount > allowance:
+                raise ModelError(INSUFFICIENT_ALLOWANCE)
+            sender_balance = balances.get(sender_key, 0)
+            if amount > sender_balance:
+                raise ModelError(INSUFFICIENT_BALANCE)
+            journal.append((allowances, allowance_key, allowance))
+            journal.append((balances, sender_key, sender_balance))
+            allowances[allowance_key] = allowance - amount
+        balances[sender_key] = sender_balance - amount
+        recipient_key = (asset, recipient)
+        recipient_balance = balances.get(recipient_key, 0)
+        journal.append((balances, recipient_key, recipient_balance))
+        balances[recipient_key] = (recipient_balance + amount) % UINT256_BOUND
+
+
+def _batch_len(buy_orders, sell_orders, fill_prices, base_fill_quantities):
+    n = len(buy_orders)
+    if not len(sell_orders) == len(fill_prices) == len(base_fill_quantities) == n:
+        raise ModelError("Invalid batch")
+    return n
+
+
+def _uint(amount):
+    """The low word of a Uint256(amount, 0) argument, which must fit in 128 bits."""
+    if not 0 <= amount < RANGE_CHECK_BOUND:
+        raise ModelError("Uint256 amount out of range")
+    return amount
@@ -0,0 +1,70 @@
+"""Local nonce reservation for the transactions of one account."""
+
+import asyncio
+
+from starkware.starknet.public.abi import get_selector_from_name
+from starkware.starkware_utils.error_handling import StarkException
+
+from lib.utils import hash_message
+
+
+class NonceManager:
+    """Sends transactions through account like Signer.send_transaction, without reading
+    get_nonce before each one.
+
+    Nonces are reserved locally, so any number of send_transaction calls can be signed
+    concurrently. They are then submitted one at a time in nonce order. When a transaction
+    is rejected, the nonce is read again from the account: if the rejected nonce was the
+    next one, the transaction itself failed and its error is raised. Otherwise it only
+    failed because an earlier transaction did. In both cases every transaction queued
+    behind it is signed again with the new nonces and replayed.
+    """
+
+    def __init__(self, signer, account):
+        self.signer = signer
+        self.account = account
+        self.next_nonce = None
+        # Bumped by every sync, so that nonces reserved before it are signed again
+        self.generation = 0
+        self.syncs = 0
+        self._sync_lock = asyncio.Lock()
+        self._submit_lock = asyncio.Lock()
+
+    async def sync(self):
+        """Reads the account nonce and reserves from it. Returns the nonce."""
+        execution_info = await self.account.get_nonce().call()
+        (self.next_nonce,) = execution_info.result
+        self.generation += 1
+        self.syncs += 1
+        return self.next_nonce
+
+    def _take(self):
+        nonce = self.next_nonce
+        self.next_nonce += 1
+        return nonce, self.generation
+
+    def _sign(self, to, selector, calldata, nonce):
+        message_hash = hash_message(self.account.contract_address, to, selector, calldata, nonce)
+        return list(self.signer.sign(message_hash))
+
+    async def send_transaction(self, to, selector_name, calldata):
+        if self.next_nonce is None:
+            async with self._sync_lock:
+                if self.next_nonce is None:
+                    await self.sync()
+        selector = get_selector_from_name(selector_name)
+        nonce, generation = self._take()
+        signature = self._sign(to, selector, calldata, nonce)
+
+        async with self._submit_lock:
+            while True:
+                if generation != self.generation:
+                    nonce, generation = self._take()
+                    signature = self._sign(to, selector, calldata, nonce)
+                try:
+                    return await self.account.execute(to, selector, calldata, nonce).invoke(
+                        signature=signature
+                    )
+                except StarkException:
+                    if await self.sync() == nonce:
+                        raise
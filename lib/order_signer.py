@@ -0,0 +1,135 @@
+"""Hashing and signing of ZZ_Messages for clients that generate orders in bulk.
+
+ZZ_Message.hash chains 14 Pedersen hashes per message. The first 6 only depend on the message
+prefix, domain and sender and the next 2 on the market, so OrderSigner keeps the hash state after
+them and hashes only the 6 remaining order fields of each order. It hashes with
+fast_pedersen_hash, which returns the same hash as signature.pedersen_hash from a precomputed
+table of points.
+
+Signing costs far more than hashing. Signatures are memoized per message hash, so resending or
+retrying an order does not sign it again, and sign_orders can spread new signatures over a
+process pool made by signing_pool.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from starkware.crypto.signature.fast_pedersen_hash import pedersen_hash
+from starkware.crypto.signature.signature import sign
+
+from lib.zz_message import ORDER_TYPE_HASH, STARKNET_DOMAIN_TYPE_HASH, ZZ_Message
+
+DEFAULT_MAX_CACHED = 100000
+
+# Private key of a signing_pool worker, set by its initializer
+_worker_private_key = None
+
+
+def _init_worker(private_key):
+    global _worker_private_key
+    _worker_private_key = private_key
+
+
+def _sign_hash(message_hash):
+    return sign(msg_hash=message_hash, priv_key=_worker_private_key)
+
+
+def signing_pool(signer, processes=None):
+    """Returns a ProcessPoolExecutor whose workers sign with the key of signer, for
+    OrderSigner.sign_orders. processes defaults to the number of CPUs."""
+    return ProcessPoolExecutor(
+        max_workers=processes, initializer=_init_worker, initargs=(signer.private_key,)
+    )
+
+
+class OrderSigner:
+    """Hashes and signs the Orders of one sender, for one message prefix and domain.
+
+    Keeps up to max_cached signatures, evicting the least recently used. signature_hits and
+    signature_misses count the signatures served from that cache and those signed.
+    """
+
+    def __init__(
+        self, signer, sender, message_prefix, domain_prefix, max_cached=DEFAULT_MAX_CACHED
+    ):
+        self.signer = signer
+        self.sender = sender
+        self.message_prefix = message_prefix
+        self.domain_prefix = domain_prefix
+        self.max_cached = max_cached
+        # message hash -> (r, s)
+        self.signatures = OrderedDict()
+        self.signature_hits = 0
+        self.signature_misses = 0
+        # (base_asset, quote_asset) -> hash state after the quote asset
+        self._markets = {}
+
+        state = pedersen_hash(message_prefix, STARKNET_DOMAIN_TYPE_HASH)
+        state = pedersen_hash(state, domain_prefix.name)
+        state = pedersen_hash(state, domain_prefix.version)
+        state = pedersen_hash(state, domain_prefix.chain_id)
+        state = pedersen_hash(state, sender)
+        self._sender_state = pedersen_hash(state, ORDER_TYPE_HASH)
+
+    def message(self, order):
+        return ZZ_Message(self.message_prefix, self.domain_prefix, self.sender, order)
+
+    def hash(self, order):
+        """The hash of message(order), as computed by ZZ_Message.hash."""
+        market = (order.base_asset, order.quote_asset)
+        state = self._markets.get(market)
+        if state is None:
+            state = pedersen_hash(self._sender_state, order.base_asset)
+            state = self._markets[market] = pedersen_hash(state, order.quote_asset)
+        state = pedersen_hash(state, order.side)
+        state = pedersen_hash(state, order.base_quantity)
+        state = pedersen_hash(state, order.price.numerator)
+        state = pedersen_hash(state, order.price.denominator)
+        state = pedersen_hash(state, order.expiration)
+        return pedersen_hash(state, order.epoch)
+
+    def sign(self, order):
+        """Returns the (r, s) signature of message(order)."""
+        message_hash = self.hash(order)
+        signature = self._cached(message_hash)
+        if signature is None:
+            signature = self.signer.sign(message_hash)
+            self._cache(message_hash, signature)
+        return signature
+
+    def sign_orders(self, orders, pool=None):
+        """Returns the signature of every order. Orders without a cached signature are signed
+        on pool, a signing_pool of the same signer, if one is given."""
+        hashes = [self.hash(order) for order in orders]
+        signatures = [self._cached(message_hash) for message_hash in hashes]
+        missing = list(
+            {h: None for h, signature in zip(hashes, signatures) if signature is None}
+        )
+        if pool is None:
+            signed = map(self.signer.sign, missing)
+        else:
+            # A signature takes long enough that sending hashes one at a time costs little
+            signed = pool.map(_sign_hash, missing)
+        new = dict(zip(missing, signed))
+        for message_hash, signature in new.items():
+            self._cache(message_hash, signature)
+        return [
+            new[h] if signature is None else signature for h, signature in zip(hashes, signatures)
+        ]
+
+    def to_starknet_args(self, order):
+        return self.message(order).to_signed_starknet_args(*self.sign(order))
+
+    def _cached(self, message_hash):
+        signature = self.signatures.get(message_hash)
+        if signature is None:
+            self.signature_misses += 1
+        else:
+            self.signature_hits += 1
+            self.signatures.move_to_end(message_hash)
+        return signature
+
+    def _cache(self, message_hash, signature):
+        self.signatures[message_hash] = signature
+        if len(self.signatures) > self.max_cached:
+            self.signatures.popitem(last=False)
@@ -0,0 +1,91 @@
+"""Client-side cache of orderstatus, read in bulk through get_order_statuses."""
+
+from lib.matching import fill_orders_batch_args
+
+# Hashes per get_order_statuses call
+DEFAULT_CHUNK_SIZE = 500
+
+
+class OrderStatusClient:
+    """Wraps a deployed exchange contract and caches the filled amount of each message hash.
+
+    Fills and cancels must go through this client for the cache to stay correct: every
+    hash they touch is dropped from the cache, so the next read fetches it again. Changes
+    made by anyone else are only seen once the entry is invalidated or the cache cleared.
+
+    Every invalidation starts a new generation. A read that was pending across one returns
+    what it fetched but does not cache it, since the status may have changed meanwhile.
+    """
+
+    def __init__(self, contract, chunk_size=DEFAULT_CHUNK_SIZE):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        self.contract = contract
+        self.chunk_size = chunk_size
+        # message hash -> filled
+        self.cache = {}
+        self._generation = 0
+
+    async def get_order_statuses(self, hashes):
+        """Returns the filled amount of every hash, fetching the ones not cached in chunks."""
+        cache = self.cache
+        # Taken now, since an invalidation may drop cached entries while a chunk is fetched
+        statuses = {h: cache[h] for h in hashes if h in cache}
+        missing = list(dict.fromkeys(h for h in hashes if h not in statuses))
+        for start in range(0, len(missing), self.chunk_size):
+            chunk = missing[start : start + self.chunk_size]
+            generation = self._generation
+            execution_info = await self.contract.get_order_statuses(chunk).call()
+            fetched = dict(zip(chunk, execution_info.result.filled))
+            statuses.update(fetched)
+            if generation == self._generation:
+                cache.update(fetched)
+        return [statuses[h] for h in hashes]
+
+    async def get_order_status(self, message_hash):
+        (filled,) = await self.get_order_statuses([message_hash])
+        return filled
+
+    def invalidate(self, hashes):
+        self._generation += 1
+        for message_hash in hashes:
+            self.cache.pop(message_hash, None)
+
+    def clear(self):
+        self._generation += 1
+        self.cache.clear()
+
+    async def _invoke(self, hashes, call, invoke_args):
+        self.invalidate(hashes)
+        try:
+            return await call.invoke(**invoke_args)
+        finally:
+            # A read that completed while the transaction was pending may have cached the old
+            # status. One still pending sees the new generation and does not cache it
+            self.invalidate(hashes)
+
+    async def fill_order(self, fill, **invoke_args):
+        """Invokes fill_order for a lib.matching Fill."""
+        return await self._invoke(
+            (fill.buy.message_hash, fill.sell.message_hash),
+            self.contract.fill_order(**fill.to_starknet_args()),
+            invoke_args,
+        )
+
+    async def fill_orders_batch(self, fills, netted=False, **invoke_args):
+        """Invokes fill_orders_batch, or fill_orders_batch_netted, for a list of Fills."""
+        hashes = [h for fill in fills for h in (fill.buy.message_hash, fill.sell.message_hash)]
+        entry_point = (
+            self.contract.fill_orders_batch_netted if netted else self.contract.fill_orders_batch
+        )
+        return await self._invoke(hashes, entry_point(**fill_orders_batch_args(fills)), invoke_args)
+
+    async def cancel_order(self, message, signature, message_hash=None, **invoke_args):
+        """Invokes cancel_order for a signed ZZ_Message. message_hash defaults to message.hash()."""
+        if message_hash is None:
+            message_hash = message.hash()
+        return await self._invoke(
+            (message_hash,),
+            self.contract.cancel_order(message.to_signed_starknet_args(*signature)),
+            invoke_args,
+        )
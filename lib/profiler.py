@@ -0,0 +1,354 @@
+"""Per-function profiles of the Cairo steps and builtins of contract invocations.
+
+execution_resources only reports the totals of an invocation. A StepProfiler, used as a context
+manager around invocations of the testing framework, keeps the VM trace of every entry point run
+inside it, including the contracts it calls, and attributes each step to the call stack it ran
+in. The stack of a step is read from the frame chain of the trace: [fp - 2] holds the fp of the
+caller and [fp - 1] the pc to return to. Calls to other contracts continue the stack of the
+call_contract syscall that made them, with the frames of the callee named after its contract.
+
+Builtin instances are attributed to the first step whose instruction accesses one of their
+cells, so a pedersen hash counts for hash2 and a range check for the function that writes it.
+
+StepProfile.write saves a profile in the folded stack format of flamegraph.pl, inferno and
+speedscope ("frame;frame;frame count" per line) and a text summary. Two profiles, in memory or
+loaded from folded files, are compared per function with diff_summary, or per stack with
+differential_folded, whose output difffolded-style flamegraph tools read.
+
+StepProfiler hooks into private methods of the cairo-lang testing framework, so it only runs on
+the cairo-lang version it was written against.
+"""
+
+import bisect
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from starkware.cairo.common.cairo_function_runner import CairoFunctionRunner
+from starkware.cairo.lang.compiler.encode import decode_instruction
+from starkware.cairo.lang.compiler.identifier_definition import FunctionDefinition
+from starkware.cairo.lang.compiler.instruction import Instruction, Register
+from starkware.cairo.lang.version import __version__ as CAIRO_LANG_VERSION
+from starkware.cairo.lang.vm.builtin_runner import SimpleBuiltinRunner
+from starkware.cairo.lang.vm.relocatable import RelocatableValue
+from starkware.starknet.business_logic.internal_transaction import InternalInvokeFunction
+
+STEPS = "n_steps"
+# The cairo-lang version whose InternalInvokeFunction._run and
+# CairoFunctionRunner.run_from_entrypoint StepProfiler replaces
+SUPPORTED_CAIRO_LANG_VERSION = "0.7.1"
+
+
+class StepProfile:
+    """Steps and builtin instances per call stack.
+
+    counts maps a metric, STEPS or a builtin name such as "pedersen_builtin", to a Counter of
+    call stacks, each a tuple of "contract:function" frames from the entry point down.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = {} if counts is None else counts
+
+    @classmethod
+    def from_folded(cls, path, metric=STEPS):
+        """Loads one metric of a profile saved by write, to diff it against another run."""
+        stacks = Counter()
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack:
+                    stacks[tuple(stack.split(";"))] += int(count)
+        return cls({metric: stacks})
+
+    def metrics(self):
+        return [STEPS] + sorted(metric for metric in self.counts if metric != STEPS)
+
+    def total(self, metric=STEPS):
+        return sum(self.counts.get(metric, Counter()).values())
+
+    def folded(self, metric=STEPS):
+        """The lines of the folded stack format for metric."""
+        stacks = self.counts.get(metric, Counter())
+        return [f"{';'.join(stack)} {count}" for stack, count in sorted(stacks.items()) if count]
+
+    def functions(self, metric=STEPS):
+        """Returns Counters of the self and the total (inclusive) count of every function."""
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.counts.get(metric, Counter()).items():
+            self_counts[stack[-1]] += count
+            # A recursive function counts once per step
+            for frame in set(stack):
+                total_counts[frame] += count
+        return self_counts, total_counts
+
+    def summary(self, limit=None):
+        """A table of the functions by total steps, with the builtins they use in total."""
+        metrics = self.metrics()
+        builtins = [metric for metric in metrics if metric != STEPS]
+        self_steps, total_steps = self.functions(STEPS)
+        totals = {metric: self.functions(metric)[1] for metric in builtins}
+        functions = sorted(total_steps, key=lambda frame: (-total_steps[frame], frame))
+        if limit is not None:
+            functions = functions[:limit]
+
+        width = max([len(frame) for frame in functions] + [len("function")])
+        columns = ["self", "total"] + [metric[: -len("_builtin")] for metric in builtins]
+        lines = [
+            ", ".join(f"{metric} {self.total(metric)}" for metric in metrics),
+            "function".ljust(width) + "".join(f"{column:>13}" for column in columns),
+        ]
+        for frame in functions:
+            values = [self_steps[frame], total_steps[frame]]
+            values += [totals[metric][frame] for metric in builtins]
+            lines.append(frame.ljust(width) + "".join(f"{value:>13}" for value in values))
+        return "\n".join(lines)
+
+    def write(self, path):
+        """Writes path.folded with the steps, path.<builtin>.folded per builtin used and the
+        summary to path.txt."""
+        for metric in self.metrics():
+            suffix = ".folded" if metric == STEPS else f".{metric}.folded"
+            with open(path + suffix, "w") as f:
+                f.writelines(line + "\n" for line in self.folded(metric))
+        with open(path + ".txt", "w") as f:
+            f.write(self.summary() + "\n")
+
+
+def diff_summary(old, new, metric=STEPS, limit=None):
+    """A table of the functions whose self count of metric changed from old to new, by the size
+    of the change."""
+    old_counts = old.functions(metric)[0]
+    new_counts = new.functions(metric)[0]
+    frames = old_counts.keys() | new_counts.keys()
+    changed = [frame for frame in frames if old_counts[frame] != new_counts[frame]]
+    changed.sort(key=lambda frame: (-abs(new_counts[frame] - old_counts[frame]), frame))
+    if limit is not None:
+        changed = changed[:limit]
+
+    width = max([len(frame) for frame in changed] + [len("function")])
+    lines = [
+        f"{metric} {old.total(metric)} -> {new.total(metric)}",
+        "function".ljust(width) + "".join(f"{column:>13}" for column in ("old", "new", "delta")),
+    ]
+    for frame in changed:
+        old_count, new_count = old_counts[frame], new_counts[frame]
+        delta = new_count - old_count
+        lines.append(f"{frame.ljust(width)}{old_count:>13}{new_count:>13}{delta:>+13}")
+    return "\n".join(lines)
+
+
+def differential_folded(old, new, metric=STEPS):
+    """Lines of "stack old new" for every stack of either profile, the input of differential
+    flamegraphs."""
+    old_stacks = old.counts.get(metric, Counter())
+    new_stacks = new.counts.get(metric, Counter())
+    return [
+        f"{';'.join(stack)} {old_stacks[stack]} {new_stacks[stack]}"
+        for stack in sorted(old_stacks.keys() | new_stacks.keys())
+    ]
+
+
+class StepProfiler:
+    """Profiles every entry point run by the testing framework while it is entered.
+
+    Each invocation or call, with the contracts it calls, adds one StepProfile to runs, so
+    profiles of consecutive invocations can be told apart. names maps contract addresses to the
+    names that their frames are prefixed with, instead of the address in hex.
+    """
+
+    def __init__(self, names=None):
+        self.names = {} if names is None else names
+        self.runs = []
+        # Entry points being run, innermost last, and all of the current invocation
+        self._active = []
+        self._calls = []
+        self._patches = None
+
+    @property
+    def last(self):
+        return self.runs[-1]
+
+    def __enter__(self):
+        if self._patches is not None:
+            raise RuntimeError("StepProfiler is already entered")
+        if CAIRO_LANG_VERSION != SUPPORTED_CAIRO_LANG_VERSION:
+            raise RuntimeError(
+                f"StepProfiler supports cairo-lang {SUPPORTED_CAIRO_LANG_VERSION}, "
+                f"not {CAIRO_LANG_VERSION}"
+            )
+        run = InternalInvokeFunction._run
+        run_from_entrypoint = CairoFunctionRunner.run_from_entrypoint
+        profiler = self
+
+        def profiled_run(tx, *args, **kwargs):
+            profiler._enter_call(tx.contract_address)
+            try:
+                return run(tx, *args, **kwargs)
+            finally:
+                profiler._exit_call()
+
+        def profiled_run_from_entrypoint(runner, *args, **kwargs):
+            if profiler._active and profiler._active[-1].runner is None:
+                profiler._active[-1].runner = runner
+            return run_from_entrypoint(runner, *args, **kwargs)
+
+        with ExitStack() as patches:
+            patches.enter_context(_patched(InternalInvokeFunction, "_run", profiled_run))
+            patches.enter_context(
+                _patched(
+                    CairoFunctionRunner, "run_from_entrypoint", profiled_run_from_entrypoint
+                )
+            )
+            self._patches = patches.pop_all()
+        return self
+
+    def __exit__(self, *exc_info):
+        patches, self._patches = self._patches, None
+        patches.close()
+
+    def _enter_call(self, contract_address):
+        parent = self._active[-1] if self._active else None
+        call = _Call(contract_address, parent)
+        if parent is not None and parent.runner is not None:
+            # The syscall of the parent is being handled, so its registers are at the
+            # call_contract that makes this call
+            run_context = parent.runner.vm.run_context
+            call.pc, call.fp = run_context.pc, run_context.fp
+        self._active.append(call)
+        self._calls.append(call)
+
+    def _exit_call(self):
+        self._active.pop()
+        if not self._active:
+            calls, self._calls = self._calls, []
+            self.runs.append(self._profile(calls))
+
+    def _profile(self, calls):
+        counts = {STEPS: Counter()}
+        traces = {}
+        prefixes = {}
+        for call in calls:
+            runner = call.runner
+            if runner is None or getattr(runner, "vm", None) is None:
+                continue
+            name = self.names.get(call.contract_address, hex(call.contract_address))
+            trace = traces[call] = _Trace(runner, name)
+            parent = call.parent
+            if parent is None or parent not in traces:
+                prefix = ()
+            else:
+                prefix = prefixes[parent] + traces[parent].stack(call.pc, call.fp)
+            prefixes[call] = prefix
+            trace.count(prefix, counts)
+        return StepProfile(counts)
+
+
+@contextmanager
+def _patched(owner, name, replacement):
+    """Replaces an attribute of owner, restoring the original on exit."""
+    original = getattr(owner, name)
+    setattr(owner, name, replacement)
+    try:
+        yield
+    finally:
+        setattr(owner, name, original)
+
+
+class _Call:
+    """An entry point run: the contract, the runner once created, and the caller with its
+    registers at the call."""
+
+    __slots__ = ("contract_address", "parent", "runner", "pc", "fp")
+
+    def __init__(self, contract_address, parent):
+        self.contract_address = contract_address
+        self.parent = parent
+        self.runner = None
+        self.pc = None
+        self.fp = None
+
+
+class _Trace:
+    """Resolves the call stacks of the trace of one runner."""
+
+    def __init__(self, runner, name):
+        self.runner = runner
+        self.memory = runner.vm_memory
+        self.program_base = runner.program_base
+        functions = sorted(
+            (definition.pc, str(scope))
+            for scope, definition in runner.program.identifiers.as_dict().items()
+            if isinstance(definition, FunctionDefinition)
+        )
+        self._starts = [pc for pc, _ in functions]
+        self._frames = [f"{name}:{scope.replace('__main__.', '')}" for _, scope in functions]
+        self._name = name
+        # fp -> frames of the callers of the function running at fp
+        self._callers = {runner.initial_fp: ()}
+        self._instructions = {}
+
+    def frame(self, pc):
+        offset = pc - self.program_base
+        i = bisect.bisect_right(self._starts, offset) - 1
+        return self._frames[i] if i >= 0 else f"{self._name}:pc_{offset}"
+
+    def callers(self, fp):
+        frames = self._callers.get(fp)
+        if frames is None:
+            return_fp = self.memory[fp - 2]
+            return_pc = self.memory[fp - 1]
+            frames = self._callers[fp] = self.callers(return_fp) + (self.frame(return_pc),)
+        return frames
+
+    def stack(self, pc, fp):
+        return self.callers(fp) + (self.frame(pc),)
+
+    def count(self, prefix, counts):
+        """Adds the steps and builtin instances of the trace under prefix to counts."""
+        # segment index -> (builtin name, cells per instance) of the builtins with a segment of
+        # fixed size instances, which are all but the output builtin
+        builtins = {
+            builtin.base.segment_index: (name, builtin.cells_per_instance)
+            for name, builtin in self.runner.builtin_runners.items()
+            if isinstance(builtin, SimpleBuiltinRunner)
+        }
+        seen = set()
+        steps = counts[STEPS]
+        for entry in self.runner.vm.trace:
+            stack = prefix + self.stack(entry.pc, entry.fp)
+            steps[stack] += 1
+            for address in self._accessed(entry):
+                if not isinstance(address, RelocatableValue):
+                    continue
+                builtin = builtins.get(address.segment_index)
+                if builtin is None:
+                    continue
+                name, cells_per_instance = builtin
+                instance = (address.segment_index, address.offset // cells_per_instance)
+                if instance not in seen:
+                    seen.add(instance)
+                    counts.setdefault(name, Counter())[stack] += 1
+
+    def _accessed(self, entry):
+        """The memory addresses accessed by the instruction of a trace entry."""
+        instruction = self._instructions.get(entry.pc)
+        if instruction is None:
+            instruction = self._instructions[entry.pc] = decode_instruction(
+                self.memory[entry.pc], self.memory.get(entry.pc + 1)
+            )
+        ap, fp = entry.ap, entry.fp
+        dst = (ap if instruction.dst_register is Register.AP else fp) + instruction.off0
+        op0 = (ap if instruction.op0_register is Register.AP else fp) + instruction.off1
+        op1_addr = instruction.op1_addr
+        if op1_addr is Instruction.Op1Addr.IMM:
+            return dst, op0
+        if op1_addr is Instruction.Op1Addr.AP:
+            op1 = ap + instruction.off2
+        elif op1_addr is Instruction.Op1Addr.FP:
+            op1 = fp + instruction.off2
+        else:
+            base = self.memory.get(op0)
+            if not isinstance(base, RelocatableValue):
+                return dst, op0
+            op1 = base + instruction.off2
+        return dst, op0, op1
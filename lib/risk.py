@@ -0,0 +1,222 @@
+"""Pre-screening of fills against the balances and allowances of the traders.
+
+fill_order only fails on a missing balance or allowance at transfer_from, after the signatures
+are verified and the hashes computed. RiskCache keeps the balance of every (asset, account) and
+its allowance for the exchange, read in bulk through get_balances_and_allowances of
+lib/ERC20.cairo, together with the debits of the fills submitted but not confirmed yet. A
+candidate batch is checked against them in Python, so a fill that would fail, such as one that
+spends liquidity a pending fill already spends, is dropped before it is submitted.
+
+Pending fills are applied optimistically: their debits count as spent as soon as they are
+reserved, but their credits only count once a block confirms them, since the fill may still
+fail. resync after every block releases the submissions it settled and reads the balances again.
+Prices, quantities and order status are the business of lib.validation.FillValidator.
+"""
+
+import itertools
+
+from starkware.crypto.signature.signature import FIELD_PRIME
+
+from lib.validation import MAX_DIV, RANGE_CHECK_BOUND
+
+DEFAULT_CHUNK_SIZE = 200
+
+# Why check_fills rejects a fill. lib/ERC20.cairo fails a transfer_from without an error message
+# when the sender lacks the balance or allowance
+INSUFFICIENT_BALANCE = "insufficient balance"
+INSUFFICIENT_ALLOWANCE = "insufficient allowance"
+# Exchange_trade_amounts can not compute the fee or the quote amount of the fill
+INVALID_AMOUNTS = "invalid trade amounts"
+
+_NO_CHANGE = (0, 0)
+
+
+class RiskCache:
+    """Confirmed balances and allowances of the accounts trading on one exchange, and the
+    reservations of pending submissions.
+
+    tokens maps the address of every traded asset to its deployed token contract. Only the
+    accounts added with track are read by sync. balances and allowances are keyed by
+    (asset, account), with Uint256 amounts as ints.
+    """
+
+    def __init__(
+        self, exchange_address, tokens, protocol_fee_bips=0, chunk_size=DEFAULT_CHUNK_SIZE
+    ):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        self.exchange_address = exchange_address
+        self.tokens = tokens
+        self.protocol_fee_bips = protocol_fee_bips
+        self.chunk_size = chunk_size
+        self.accounts = set()
+        self.balances = {}
+        self.allowances = {}
+        # submission -> {(asset, account): (balance debit, allowance debit)}
+        self.pending = {}
+        # (asset, account) -> (balance debit, allowance debit) of all pending submissions
+        self._reserved = {}
+        self._submissions = itertools.count()
+
+    def track(self, accounts):
+        self.accounts.update(accounts)
+
+    async def sync(self):
+        """Reads the balance and allowance of every tracked account in every token."""
+        accounts = sorted(self.accounts)
+        for asset, token in self.tokens.items():
+            for start in range(0, len(accounts), self.chunk_size):
+                chunk = accounts[start : start + self.chunk_size]
+                execution_info = await token.get_balances_and_allowances(
+                    self.exchange_address, chunk
+                ).call()
+                result = execution_info.result
+                for i, account in enumerate(chunk):
+                    low, high = result.user_balances[2 * i : 2 * i + 2]
+                    self.balances[(asset, account)] = low + (high << 128)
+                    low, high = result.user_allowances[2 * i : 2 * i + 2]
+                    self.allowances[(asset, account)] = low + (high << 128)
+
+    async def resync(self, settled=()):
+        """Call once a block is confirmed, with the submissions it included, whether they
+        succeeded or failed. Their reservations are released and the balances read again."""
+        for submission in settled:
+            self.release(submission)
+        await self.sync()
+
+    def available(self, asset, account):
+        """Returns the (balance, allowance) that pending submissions leave for new fills."""
+        key = (asset, account)
+        balance_debit, allowance_debit = self._reserved.get(key, _NO_CHANGE)
+        return (
+            self.balances.get(key, 0) - balance_debit,
+            self.allowances.get(key, 0) - allowance_debit,
+        )
+
+    def check_fills(self, fills, netted=False):
+        """Returns, for every lib.matching Fill, None if its transfers would pass, or the reason
+        it would fail.
+
+        The fills are checked as one fill_orders_batch, or fill_orders_batch_netted if netted,
+        with the rejected ones left out, so the accepted fills pass together in their order.
+        A single fill_order is a batch of one.
+        """
+        return self._simulate(fills, netted)[0]
+
+    def reserve(self, fills, netted=False):
+        """Checks fills like check_fills and reserves the debits of the accepted ones, which
+        the caller then submits as one transaction. Returns the submission to release, or None
+        if no fill was accepted, and the result of every fill."""
+        results, debits = self._simulate(fills, netted)
+        if not debits:
+            return None, results
+        submission = next(self._submissions)
+        self.pending[submission] = debits
+        reserved = self._reserved
+        for key, (balance_debit, allowance_debit) in debits.items():
+            old_balance_debit, old_allowance_debit = reserved.get(key, _NO_CHANGE)
+            reserved[key] = (
+                old_balance_debit + balance_debit,
+                old_allowance_debit + allowance_debit,
+            )
+        return submission, results
+
+    def release(self, submission):
+        """Drops the reservation of a submission that was settled or abandoned."""
+        reserved = self._reserved
+        for key, (balance_debit, allowance_debit) in self.pending.pop(submission).items():
+            old_balance_debit, old_allowance_debit = reserved[key]
+            left = (old_balance_debit - balance_debit, old_allowance_debit - allowance_debit)
+            if left == _NO_CHANGE:
+                del reserved[key]
+            else:
+                reserved[key] = left
+
+    def _trade_amounts(self, base_fill_quantity, fill_price):
+        """The (base_amount, quote_amount, fee) of Exchange_trade_amounts, or None if one of its
+        unsigned_div_rem fails. The products are felts, and the quotients must pass a range
+        check."""
+        fee = base_fill_quantity * self.protocol_fee_bips % FIELD_PRIME // 10000
+        numerator, denominator = fill_price
+        if fee >= RANGE_CHECK_BOUND or not 0 < denominator <= MAX_DIV:
+            return None
+        quote_amount = base_fill_quantity * numerator % FIELD_PRIME // denominator
+        if quote_amount >= RANGE_CHECK_BOUND:
+            return None
+        return (base_fill_quantity - fee) % FIELD_PRIME, quote_amount, fee
+
+    def _transfers(self, fill):
+        """The (asset, sender, recipient, amount) of the transfer_from calls of
+        Exchange_execute_trade for fill, or None if its amounts can not be computed."""
+        amounts = self._trade_amounts(fill.base_fill_quantity, fill.fill_price)
+        if amounts is None:
+            return None
+        base_amount, quote_amount, fee = amounts
+        buy = fill.buy.message
+        sell = fill.sell.message
+        base_asset = buy.order.base_asset
+        transfers = [
+            (base_asset, sell.sender, buy.sender, base_amount),
+            (buy.order.quote_asset, buy.sender, sell.sender, quote_amount),
+        ]
+        if fee != 0:
+            transfers.append((base_asset, sell.sender, self.exchange_address, fee))
+        return transfers
+
+    def _shortfall(self, key, net, spent):
+        """The assertion that fails if key changes by net and spends spent of its allowance."""
+        balance_debit, allowance_debit = self._reserved.get(key, _NO_CHANGE)
+        if self.balances.get(key, 0) - balance_debit + net < 0:
+            return INSUFFICIENT_BALANCE
+        if self.allowances.get(key, 0) - allowance_debit < spent:
+            return INSUFFICIENT_ALLOWANCE
+        return None
+
+    def _simulate(self, fills, netted):
+        """Returns the result of every fill and the debits of the accepted ones."""
+        # (asset, account) -> [net balance change, allowance spent] of the accepted fills
+        changes = {}
+        results = []
+        for fill in fills:
+            # The changes with this fill, copied on first write so a rejection drops them
+            trial = {}
+            reason = None
+            transfers = self._transfers(fill)
+            if transfers is None:
+                results.append(INVALID_AMOUNTS)
+                continue
+            for asset, sender, recipient, amount in transfers:
+                sender_key = (asset, sender)
+                change = trial.get(sender_key)
+                if change is None:
+                    change = trial[sender_key] = list(changes.get(sender_key, _NO_CHANGE))
+                change[0] -= amount
+                change[1] += amount
+                # Without netting every transfer_from needs the balance and allowance in turn
+                if not netted:
+                    reason = self._shortfall(sender_key, change[0], change[1])
+                    if reason is not None:
+                        break
+                recipient_key = (asset, recipient)
+                change = trial.get(recipient_key)
+                if change is None:
+                    change = trial[recipient_key] = list(changes.get(recipient_key, _NO_CHANGE))
+                change[0] += amount
+            if netted:
+                # Exchange_settle_net_deltas only transfers the net debit of each account
+                for key, (net, _) in trial.items():
+                    if net < 0:
+                        reason = self._shortfall(key, net, -net)
+                        if reason is not None:
+                            break
+            results.append(reason)
+            if reason is None:
+                changes.update(trial)
+
+        debits = {}
+        for key, (net, spent) in changes.items():
+            balance_debit = max(0, -net)
+            allowance_debit = balance_debit if netted else spent
+            if balance_debit or allowance_debit:
+                debits[key] = (balance_debit, allowance_debit)
+        return results, debits
@@ -51,7 +51,40 @@ class Signer:
             signature=[sig_r, sig_s]
         )
 
+    async def send_transactions(self, account, calls, nonce=None):
+        """Sends calls, a list of (to, selector_name, calldata), as one execute_multicall."""
+        if nonce is None:
+            execution_info = await account.get_nonce().call()
+            (nonce,) = execution_info.result
+
+        calls = [(to, get_selector_from_name(name), calldata) for to, name, calldata in calls]
+        message_hash = hash_multicall(account.contract_address, calls, nonce)
+        sig_r, sig_s = self.sign(message_hash)
+
+        call_array, calldata = multicall_args(calls)
+        return await account.execute_multicall(call_array, calldata, nonce).invoke(
+            signature=[sig_r, sig_s]
+        )
+
 
 def hash_message(sender, to, selector, calldata, nonce):
     message = [sender, to, selector, compute_hash_on_elements(calldata), nonce]
     return compute_hash_on_elements(message)
+
+
+def hash_multicall(sender, calls, nonce):
+    call_hashes = [
+        compute_hash_on_elements([to, selector, compute_hash_on_elements(calldata)])
+        for to, selector, calldata in calls
+    ]
+    return compute_hash_on_elements([sender, compute_hash_on_elements(call_hashes), nonce])
+
+
+def multicall_args(calls):
+    """Flattens (to, selector, calldata) calls into execute_multicall's call_array and calldata."""
+    call_array = []
+    flat_calldata = []
+    for to, selector, calldata in calls:
+        call_array.append((to, selector, len(flat_calldata), len(calldata)))
+        flat_calldata.extend(calldata)
+    return call_array, flat_calldata
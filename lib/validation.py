@@ -0,0 +1,255 @@
+"""Off-chain pre-validation of fill_order arguments.
+
+Mirrors validate_message_prefix, check_order_valid and the divisions in Exchange_trade_amounts,
+so that a match which the contract would reject is dropped before it costs a transaction.
+Signatures, balances and allowances are not checked.
+
+Felts do not fit in fixed-width numeric arrays, so the batch is split into one Python list per
+field and every assertion runs as a single pass over those columns, in the contract's order.
+"""
+
+import os
+import re
+
+from starkware.crypto.signature.signature import FIELD_PRIME
+
+from lib.utils import str_to_felt
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), "config.cairo")
+
+# Bound of the range check builtin: assert_nn(a) holds iff 0 <= a % FIELD_PRIME < RANGE_CHECK_BOUND
+RANGE_CHECK_BOUND = 2 ** 128
+# unsigned_div_rem requires 0 < div <= MAX_DIV
+MAX_DIV = FIELD_PRIME // RANGE_CHECK_BOUND
+
+
+def load_config(path=CONFIG_FILE):
+    """Returns the integer and short string constants of a Cairo file by name."""
+    config = {}
+    with open(path) as f:
+        for line in f:
+            match = re.match(r"const (\w+) = (.+)$", line.strip())
+            if match is None:
+                continue
+            name, value = match.groups()
+            if value.startswith("'"):
+                config[name] = str_to_felt(value.strip("'"))
+            else:
+                config[name] = int(value, 0)
+    return config
+
+
+def _nn(a):
+    return a < RANGE_CHECK_BOUND
+
+
+def _nn_le(a, b):
+    return a < RANGE_CHECK_BOUND and (b - a) % FIELD_PRIME < RANGE_CHECK_BOUND
+
+
+def _quotient_fits(value, div):
+    return 0 < div <= MAX_DIV and value // div < RANGE_CHECK_BOUND
+
+
+def _message_columns(messages):
+    columns = dict(
+        message_prefix=[],
+        name=[],
+        version=[],
+        chain_id=[],
+        base_asset=[],
+        quote_asset=[],
+        side=[],
+        base_quantity=[],
+        price_numerator=[],
+        price_denominator=[],
+        expiration=[],
+        epoch=[],
+    )
+    for message in messages:
+        domain = message.domain_prefix
+        order = message.order
+        for name, value in (
+            ("message_prefix", message.message_prefix),
+            ("name", domain.name),
+            ("version", domain.version),
+            ("chain_id", domain.chain_id),
+            ("base_asset", order.base_asset),
+            ("quote_asset", order.quote_asset),
+            ("side", order.side),
+            ("base_quantity", order.base_quantity),
+            ("price_numerator", order.price.numerator),
+            ("price_denominator", order.price.denominator),
+            ("expiration", order.expiration),
+            ("epoch", order.epoch),
+        ):
+            columns[name].append(value % FIELD_PRIME)
+    return columns
+
+
+class FillValidator:
+    """Checks candidate fills the way fill_order does, against the constants in lib/config.cairo."""
+
+    def __init__(self, config=None):
+        if config is None:
+            config = load_config()
+        self.message_prefix = config["STARKNET_MESSAGE_PREFIX"]
+        self.domain_name = config["DOMAIN_NAME"]
+        self.app_version = config["APP_VERSION"]
+        self.chain_id = config["CHAIN_ID"]
+        self.buy_side = config["BUY_SIDE"]
+        self.sell_side = config["SELL_SIDE"]
+        self.protocol_fee_bips = config["PROTOCOL_FEE_BIPS"]
+
+    def validate(
+        self,
+        buy_messages,
+        sell_messages,
+        fill_prices,
+        base_fill_quantities,
+        filled_buys=None,
+        filled_sells=None,
+        block_timestamp=0,
+        buy_epochs=None,
+        sell_epochs=None,
+        protocol_fee_bips=None,
+    ):
+        """Returns, for every fill, None if fill_order would accept it, or the first assertion
+        that would fail. Entry i of each list describes one fill_order call.
+
+        filled_buys and filled_sells are the orderstatus of each message and default to 0.
+        Every fill is checked on its own, so a batch that fills the same order more than once
+        must pass the orderstatus that the earlier fills leave behind.
+
+        buy_epochs and sell_epochs are the order_epoch of each sender and default to 0.
+        protocol_fee_bips is the fee set on the exchange and defaults to PROTOCOL_FEE_BIPS, the
+        one it is deployed with.
+        """
+        n = len(buy_messages)
+        if not (len(sell_messages) == len(fill_prices) == len(base_fill_quantities) == n):
+            raise ValueError("Invalid batch")
+        p = FIELD_PRIME
+        buy = _message_columns(buy_messages)
+        sell = _message_columns(sell_messages)
+        fill_numerator = [price[0] % p for price in fill_prices]
+        fill_denominator = [price[1] % p for price in fill_prices]
+        quantity = [q % p for q in base_fill_quantities]
+        filled_buy = [0] * n if filled_buys is None else [f % p for f in filled_buys]
+        filled_sell = [0] * n if filled_sells is None else [f % p for f in filled_sells]
+        time = block_timestamp % p
+        buy_epoch = [0] * n if buy_epochs is None else [e % p for e in buy_epochs]
+        sell_epoch = [0] * n if sell_epochs is None else [e % p for e in sell_epochs]
+
+        errors = [None] * n
+
+        def check(assertion, passed):
+            for i, ok in enumerate(passed):
+                if not ok and errors[i] is None:
+                    errors[i] = assertion
+
+        # validate_message_prefix, buy order first
+        for order, columns in (("buy_order", buy), ("sell_order", sell)):
+            for field, constant, expected in (
+                ("message_prefix", "STARKNET_MESSAGE_PREFIX", self.message_prefix),
+                ("domain_prefix.name", "DOMAIN_NAME", self.domain_name),
+                ("domain_prefix.version", "APP_VERSION", self.app_version),
+                ("domain_prefix.chain_id", "CHAIN_ID", self.chain_id),
+            ):
+                column = columns[field.split(".")[-1]]
+                check(f"assert {order}.{field} = {constant}", [v == expected for v in column])
+
+        # check_order_valid
+        check(
+            "assert buy_order.base_asset = sell_order.base_asset",
+            [a == b for a, b in zip(buy["base_asset"], sell["base_asset"])],
+        )
+        check(
+            "assert buy_order.quote_asset = sell_order.quote_asset",
+            [a == b for a, b in zip(buy["quote_asset"], sell["quote_asset"])],
+        )
+        check("assert buy_order.side = BUY_SIDE", [s == self.buy_side for s in buy["side"]])
+        check("assert sell_order.side = SELL_SIDE", [s == self.sell_side for s in sell["side"]])
+        check("assert_nn_le(0, filledbuy)", [_nn(f) for f in filled_buy])
+        check("assert_nn_le(0, filledsell)", [_nn(f) for f in filled_sell])
+        check("assert_nn_le(0, buy_order.base_quantity)", [_nn(q) for q in buy["base_quantity"]])
+        check("assert_nn_le(0, sell_order.base_quantity)", [_nn(q) for q in sell["base_quantity"]])
+        check("assert_nn_le(0, base_fill_quantity)", [_nn(q) for q in quantity])
+        check(
+            "assert_nn_le(filledbuy + base_fill_quantity, buy_order.base_quantity)",
+            [
+                _nn_le((f + q) % p, b)
+                for f, q, b in zip(filled_buy, quantity, buy["base_quantity"])
+            ],
+        )
+        check(
+            "assert_nn_le(filledsell + base_fill_quantity, sell_order.base_quantity)",
+            [
+                _nn_le((f + q) % p, b)
+                for f, q, b in zip(filled_sell, quantity, sell["base_quantity"])
+            ],
+        )
+        check(
+            "assert_nn_le(fill_price.numerator * buy_order.price.denominator, "
+            "buy_order.price.numerator * fill_price.denominator)",
+            [
+                _nn_le(fn * bd % p, bn * fd % p)
+                for fn, fd, bn, bd in zip(
+                    fill_numerator,
+                    fill_denominator,
+                    buy["price_numerator"],
+                    buy["price_denominator"],
+                )
+            ],
+        )
+        check(
+            "assert_nn_le(sell_order.price.numerator * fill_price.denominator, "
+            "fill_price.numerator * sell_order.price.denominator)",
+            [
+                _nn_le(sn * fd % p, fn * sd % p)
+                for fn, fd, sn, sd in zip(
+                    fill_numerator,
+                    fill_denominator,
+                    sell["price_numerator"],
+                    sell["price_denominator"],
+                )
+            ],
+        )
+        check(
+            "assert_nn_le(base_fill_quantity, buy_order.base_quantity)",
+            [_nn_le(q, b) for q, b in zip(quantity, buy["base_quantity"])],
+        )
+        check(
+            "assert_nn_le(base_fill_quantity, sell_order.base_quantity)",
+            [_nn_le(q, b) for q, b in zip(quantity, sell["base_quantity"])],
+        )
+        check(
+            "assert_nn_le(contract_time, buy_order.expiration)",
+            [_nn_le(time, e) for e in buy["expiration"]],
+        )
+        check(
+            "assert_nn_le(contract_time, sell_order.expiration)",
+            [_nn_le(time, e) for e in sell["expiration"]],
+        )
+        check(
+            "assert_nn_le(buy_epoch, buy_order.epoch)",
+            [_nn_le(a, b) for a, b in zip(buy_epoch, buy["epoch"])],
+        )
+        check(
+            "assert_nn_le(sell_epoch, sell_order.epoch)",
+            [_nn_le(a, b) for a, b in zip(sell_epoch, sell["epoch"])],
+        )
+
+        # Exchange_trade_amounts
+        fee_bips = self.protocol_fee_bips if protocol_fee_bips is None else protocol_fee_bips
+        check(
+            "unsigned_div_rem(base_fill_quantity * fee_bips, 10000)",
+            [_quotient_fits(q * fee_bips % p, 10000) for q in quantity],
+        )
+        check(
+            "unsigned_div_rem(base_fill_quantity * fill_price.numerator, fill_price.denominator)",
+            [
+                _quotient_fits(q * fn % p, fd)
+                for q, fn, fd in zip(quantity, fill_numerator, fill_denominator)
+            ],
+        )
+        return errors
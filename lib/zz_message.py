@@ -0,0 +1,190 @@
+"""Python mirror of the ZZ_Message and Order structs in lib/ZZ_Message_base.cairo and
+lib/Order_base.cairo, with the same hashing as compute_message_hash."""
+
+from starkware.crypto.signature.signature import pedersen_hash
+from starkware.starknet.public.abi import get_selector_from_name
+
+from lib.utils import str_to_felt
+
+STARKNET_DOMAIN_TYPE_HASH = get_selector_from_name(
+    "StarkNetDomain(name:felt,version:felt,chainId:felt)"
+)
+ORDER_TYPE_HASH = get_selector_from_name(
+    "Order(base_asset:felt,quote_asset:felt,side:felt,base_quantity:felt,price:PriceRatio,expiration:felt,epoch:felt)PriceRatio(numerator:felt,denominator:felt)"
+)
+
+# Layout of PackedMessage.packed in lib/ZZ_Message_base.cairo
+PACKED_EXPIRATION_BOUND = 2 ** 63
+PACKED_NUMERATOR_SHIFT = 2 ** 64
+PACKED_DENOMINATOR_SHIFT = 2 ** 128
+PACKED_DENOMINATOR_BOUND = 2 ** 123
+
+
+def pack_order_fields(side, expiration, price):
+    """Packs side, expiration and a PriceRatio into the packed felt of a v2 message. Raises
+    ValueError for orders that only have a v1 encoding."""
+    if side not in (0, 1):
+        raise ValueError(f"side {side} can not be packed")
+    if not 0 <= expiration < PACKED_EXPIRATION_BOUND:
+        raise ValueError(f"expiration {expiration} can not be packed")
+    if not 0 <= price.numerator < PACKED_NUMERATOR_SHIFT:
+        raise ValueError(f"price numerator {price.numerator} can not be packed")
+    if not 0 <= price.denominator < PACKED_DENOMINATOR_BOUND:
+        raise ValueError(f"price denominator {price.denominator} can not be packed")
+    return (
+        side
+        + 2 * expiration
+        + PACKED_NUMERATOR_SHIFT * price.numerator
+        + PACKED_DENOMINATOR_SHIFT * price.denominator
+    )
+
+
+def unpack_order_fields(packed):
+    """Inverse of pack_order_fields. Returns (side, expiration, PriceRatio)."""
+    low = packed % PACKED_DENOMINATOR_SHIFT
+    side_expiration = low % PACKED_NUMERATOR_SHIFT
+    return (
+        side_expiration % 2,
+        side_expiration // 2,
+        PriceRatio(low // PACKED_NUMERATOR_SHIFT, packed // PACKED_DENOMINATOR_SHIFT),
+    )
+
+
+class PriceRatio:
+    def __init__(self, numerator, denominator):
+        self.numerator = numerator
+        self.denominator = denominator
+
+    def to_starknet_args(self):
+        return (self.numerator, self.denominator)
+
+
+class Order:
+    def __init__(self, base_asset, quote_asset, side, base_quantity, price, expiration, epoch=0):
+        self.base_asset = base_asset
+        self.quote_asset = quote_asset
+        self.side = side
+        self.base_quantity = base_quantity
+        self.price = PriceRatio(*price)
+        self.expiration = expiration
+        # The order is cancelled once the sender's order_epoch is above it
+        self.epoch = epoch
+
+    def hash(self):
+        order_hash = pedersen_hash(self.base_asset, self.quote_asset)
+        order_hash = pedersen_hash(order_hash, self.side)
+        order_hash = pedersen_hash(order_hash, self.base_quantity)
+        order_hash = pedersen_hash(order_hash, self.price.numerator)
+        order_hash = pedersen_hash(order_hash, self.price.denominator)
+        order_hash = pedersen_hash(order_hash, self.expiration)
+        order_hash = pedersen_hash(order_hash, self.epoch)
+        return order_hash
+
+    def to_starknet_args(self):
+        return (
+            self.base_asset,
+            self.quote_asset,
+            self.side,
+            self.base_quantity,
+            self.price.to_starknet_args(),
+            self.expiration,
+            self.epoch,
+        )
+
+
+class StarkNetDomain:
+    def __init__(self, name, version, chain_id):
+        self.name = name
+        self.version = version
+        self.chain_id = chain_id
+
+    def hash(self):
+        order_hash = pedersen_hash(self.name, self.version)
+        order_hash = pedersen_hash(order_hash, self.chain_id)
+        return order_hash
+
+    def to_starknet_args(self):
+        return (self.name, self.version, self.chain_id)
+
+
+# The message prefix and domain of lib/config.cairo, which messages to the exchange are signed with
+MESSAGE_PREFIX = str_to_felt("StarkNet Message")
+DOMAIN_PREFIX = StarkNetDomain(str_to_felt("zigzag.exchange"), 1, str_to_felt("SN_GOERLI"))
+
+
+class ZZ_Message:
+    def __init__(self, message_prefix, domain_prefix, sender, order):
+        self.message_prefix = message_prefix
+        self.domain_prefix = domain_prefix
+        self.sender = sender
+        self.order = order
+
+    def hash(self):
+        order_hash = pedersen_hash(self.message_prefix, STARKNET_DOMAIN_TYPE_HASH)
+        order_hash = pedersen_hash(order_hash, self.domain_prefix.name)
+        order_hash = pedersen_hash(order_hash, self.domain_prefix.version)
+        order_hash = pedersen_hash(order_hash, self.domain_prefix.chain_id)
+        order_hash = pedersen_hash(order_hash, self.sender)
+        order_hash = pedersen_hash(order_hash, ORDER_TYPE_HASH)
+        order_hash = pedersen_hash(order_hash, self.order.base_asset)
+        order_hash = pedersen_hash(order_hash, self.order.quote_asset)
+        order_hash = pedersen_hash(order_hash, self.order.side)
+        order_hash = pedersen_hash(order_hash, self.order.base_quantity)
+        order_hash = pedersen_hash(order_hash, self.order.price.numerator)
+        order_hash = pedersen_hash(order_hash, self.order.price.denominator)
+        order_hash = pedersen_hash(order_hash, self.order.expiration)
+        order_hash = pedersen_hash(order_hash, self.order.epoch)
+        return order_hash
+
+    def sign(self, signer):
+        order_hash = self.hash()
+        r, s = signer.sign(order_hash)
+        return r, s
+
+    def to_starknet_args(self, signer):
+        r, s = self.sign(signer)
+        return self.to_signed_starknet_args(r, s)
+
+    def to_signed_starknet_args(self, r, s):
+        return (
+            self.message_prefix,
+            self.domain_prefix.to_starknet_args(),
+            self.sender,
+            self.order.to_starknet_args(),
+            r,
+            s,
+        )
+
+    def to_packed_starknet_args(self, signer):
+        r, s = self.sign(signer)
+        return self.to_signed_packed_starknet_args(r, s)
+
+    def to_signed_packed_starknet_args(self, r, s):
+        """Returns the v2 PackedMessage arguments. The prefix and domain are not encoded, so
+        they must be the lib/config.cairo constants for the signature to verify."""
+        return (
+            self.sender,
+            self.order.base_asset,
+            self.order.quote_asset,
+            self.order.base_quantity,
+            pack_order_fields(self.order.side, self.order.expiration, self.order.price),
+            self.order.epoch,
+            r,
+            s,
+        )
+
+    @classmethod
+    def from_packed_starknet_args(cls, args, message_prefix, domain_prefix):
+        """Decodes PackedMessage arguments. Returns the message and its (r, s) signature."""
+        sender, base_asset, quote_asset, base_quantity, packed, epoch, r, s = args
+        side, expiration, price = unpack_order_fields(packed)
+        order = Order(
+            base_asset,
+            quote_asset,
+            side,
+            base_quantity,
+            (price.numerator, price.denominator),
+            expiration,
+            epoch,
+        )
+        return cls(message_prefix, domain_prefix, sender, order), (r, s)
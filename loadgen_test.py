@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from starkware.starknet.testing.starknet import Starknet
+
+from lib.loadgen import (
+    LoadConfig,
+    LoadReport,
+    _submit,
+    deploy_load_session,
+    run_load_session,
+)
+from lib.matching import MatchingEngine
+from lib.zz_message import Order
+
+# A small session by default. Set LOADGEN_ACCOUNTS, LOADGEN_MARKETS, LOADGEN_ORDERS and
+# LOADGEN_WORKERS to run a larger one.
+CONFIG = LoadConfig(
+    n_accounts=int(os.environ.get("LOADGEN_ACCOUNTS", 3)),
+    n_markets=int(os.environ.get("LOADGEN_MARKETS", 2)),
+    n_orders=int(os.environ.get("LOADGEN_ORDERS", 30)),
+    workers=int(os.environ.get("LOADGEN_WORKERS", 4)),
+    orders_per_tick=5,
+    short_lived_rate=0.3,
+    cancel_rate=0.2,
+)
+
+
+@pytest.mark.asyncio
+async def test_load_session():
+    starknet = await Starknet.empty()
+    session = await deploy_load_session(starknet, CONFIG)
+    assert len(session.accounts) == CONFIG.n_accounts
+    assert len(session.markets) == CONFIG.n_markets
+
+    report = await run_load_session(session, CONFIG)
+    assert report.orders == CONFIG.n_orders
+    assert report.fills > 0 and report.cancels > 0
+    # Every queued transaction was applied or rejected, and timed
+    fill_failures = sum(n for (kind, _), n in report.failures.items() if kind == "fill")
+    assert len(report.latencies["fill"]) == report.fills + fill_failures
+    assert report.percentile("fill", 50) <= report.percentile("fill", 99)
+    assert "fills/s" in report.summary()
+
+
+@pytest.mark.asyncio
+async def test_expired_fill():
+    starknet = await Starknet.empty()
+    session = await deploy_load_session(starknet, LoadConfig(n_accounts=2, n_markets=1))
+    (buyer, seller), ((base, quote),) = session.order_signers.values(), session.markets
+    expiration = session.block_timestamp + 1
+    engine = MatchingEngine(now=session.block_timestamp)
+    fills = []
+    for quantity in (10, 20):
+        for order_signer, side in ((buyer, 0), (seller, 1)):
+            order = Order(
+                base.contract_address, quote.contract_address, side, quantity, (1, 1), expiration
+            )
+            fills += engine.add_order(order_signer.message(order), order_signer.sign(order))
+
+    # The orders can still be filled at their expiration, and not after it
+    report = LoadReport()
+    session.block_timestamp = expiration
+    await _submit(session, "fill", fills[0], False, report)
+    session.block_timestamp = expiration + 1
+    await _submit(session, "fill", fills[1], False, report)
+    assert report.fills == 1
+    assert report.failures == {("fill", "expired"): 1}
+
+
+def test_report():
+    report = LoadReport()
+    report.latencies["fill"] = [0.4, 0.1, 0.3, 0.2]
+    report.fills = 4
+    report.elapsed = 2.0
+    report.failures[("fill", "expired")] += 1
+    assert report.percentile("fill", 50) == 0.2
+    assert report.percentile("fill", 99) == 0.4
+    assert report.percentile("cancel", 50) is None
+    assert report.fills_per_second == 2.0
+    assert report.summary().splitlines()[-1] == "fill failed 1x: expired"
@@ -0,0 +1,166 @@
+import random
+import time
+
+import pytest
+
+from lib.matching import MatchingEngine, fill_orders_batch_args
+from lib.zz_message import DOMAIN_PREFIX, MESSAGE_PREFIX, Order, ZZ_Message
+
+BASE_ASSET = 0x111
+QUOTE_ASSET = 0x222
+SIGNATURE = (1, 2)
+
+
+def message(side, base_quantity, price, expiration=1000, sender=0x333):
+    order = Order(BASE_ASSET, QUOTE_ASSET, side, base_quantity, price, expiration)
+    return ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, sender, order)
+
+
+def summary(fills):
+    return [
+        (fill.buy.message_hash, fill.sell.message_hash, fill.fill_price, fill.base_fill_quantity)
+        for fill in fills
+    ]
+
+
+def test_price_time_priority():
+    engine = MatchingEngine()
+    assert engine.add_order(message(1, 10, (3, 1)), SIGNATURE, message_hash=1) == []
+    assert engine.add_order(message(1, 10, (2, 1)), SIGNATURE, message_hash=2) == []
+    assert engine.add_order(message(1, 10, (4, 2)), SIGNATURE, message_hash=3) == []
+    assert engine.best_ask(BASE_ASSET, QUOTE_ASSET) == (2, 1)
+
+    # Best price first, then time priority within the (2, 1) == (4, 2) level
+    fills = engine.add_order(message(0, 25, (3, 1)), SIGNATURE, message_hash=4)
+    assert summary(fills) == [(4, 2, (2, 1), 10), (4, 3, (4, 2), 10), (4, 1, (3, 1), 5)]
+    assert engine.filled == {1: 5, 2: 10, 3: 10, 4: 25}
+    assert list(engine.orders) == [1]
+    assert engine.orders[1].remaining == 5
+
+
+def test_exact_price_comparison():
+    engine = MatchingEngine()
+    engine.add_order(message(1, 10, (1, 3)), SIGNATURE, message_hash=1)
+    # 0.333333333 is below 1/3, which floating point rounding would not tell apart
+    assert engine.add_order(message(0, 10, (333333333, 1000000000)), SIGNATURE, message_hash=2) == []
+    assert engine.best_bid(BASE_ASSET, QUOTE_ASSET) == (333333333, 1000000000)
+    fills = engine.add_order(message(0, 10, (2, 6)), SIGNATURE, message_hash=3)
+    assert summary(fills) == [(3, 1, (1, 3), 10)]
+
+    # The fill price satisfies both limits exactly as check_order_valid checks them
+    fill = fills[0]
+    buy_price, sell_price = fill.buy.message.order.price, fill.sell.message.order.price
+    numerator, denominator = fill.fill_price
+    assert numerator * buy_price.denominator <= buy_price.numerator * denominator
+    assert sell_price.numerator * denominator <= numerator * sell_price.denominator
+
+
+def test_partial_fills_cancel_and_expiry():
+    engine = MatchingEngine(now=100)
+    # Expired on arrival
+    assert engine.add_order(message(1, 10, (1, 1), expiration=99), SIGNATURE, message_hash=1) == []
+    assert engine.orders == {}
+
+    # Already partly filled on chain
+    engine.add_order(message(1, 10, (1, 1), expiration=200), SIGNATURE, message_hash=2, filled=6)
+    engine.add_order(message(1, 10, (1, 1), expiration=300), SIGNATURE, message_hash=3)
+    engine.add_order(message(1, 10, (1, 1), expiration=400), SIGNATURE, message_hash=4)
+    assert engine.orders[2].remaining == 4
+
+    assert engine.cancel_order(3)
+    assert not engine.cancel_order(3)
+
+    # An order is still valid at its expiration and dropped after it
+    assert engine.expire(200) == []
+    assert engine.expire(201) == [2]
+    fills = engine.add_order(message(0, 20, (1, 1), expiration=500), SIGNATURE, message_hash=5)
+    assert summary(fills) == [(5, 4, (1, 1), 10)]
+    assert engine.orders[5].remaining == 10
+    assert engine.best_ask(BASE_ASSET, QUOTE_ASSET) is None
+
+    # A filled order that is submitted again does not rest
+    assert engine.add_order(message(1, 10, (1, 1), expiration=400), SIGNATURE, message_hash=4) == []
+    assert 4 not in engine.orders
+
+
+def test_fill_order_arguments():
+    engine = MatchingEngine()
+    sell = message(1, 10, (2, 1), sender=0x444)
+    buy = message(0, 4, (3, 1), sender=0x555)
+    engine.add_order(sell, (11, 12))
+    (fill,) = engine.add_order(buy, (13, 14))
+    assert fill.to_starknet_args() == dict(
+        buy_order=buy.to_signed_starknet_args(13, 14),
+        sell_order=sell.to_signed_starknet_args(11, 12),
+        fill_price=(2, 1),
+        base_fill_quantity=4,
+    )
+    assert fill.buy.message_hash == buy.hash()
+    batch = fill_orders_batch_args([fill, fill])
+    assert batch["buy_orders"] == [buy.to_signed_starknet_args(13, 14)] * 2
+    assert batch["fill_prices"] == [(2, 1)] * 2
+    assert batch["base_fill_quantities"] == [4, 4]
+
+
+def test_random_fills_are_valid():
+    rng = random.Random(1)
+    engine = MatchingEngine()
+    messages = {}
+    for i in range(2000):
+        msg = message(rng.randrange(2), rng.randrange(1, 100), (rng.randrange(90, 110), rng.randrange(1, 4)))
+        messages[i] = msg
+        for fill in engine.add_order(msg, SIGNATURE, message_hash=i):
+            buy, sell = fill.buy.message.order, fill.sell.message.order
+            numerator, denominator = fill.fill_price
+            assert buy.side == 0 and sell.side == 1
+            assert numerator * buy.price.denominator <= buy.price.numerator * denominator
+            assert sell.price.numerator * denominator <= numerator * sell.price.denominator
+            assert fill.base_fill_quantity > 0
+
+        # Whatever rests does not cross
+        bid = engine.best_bid(BASE_ASSET, QUOTE_ASSET)
+        ask = engine.best_ask(BASE_ASSET, QUOTE_ASSET)
+        if bid and ask:
+            assert bid[0] * ask[1] < ask[0] * bid[1]
+
+    for i, filled in engine.filled.items():
+        assert 0 < filled <= messages[i].order.base_quantity
+        if i in engine.orders:
+            assert engine.orders[i].remaining == messages[i].order.base_quantity - filled
+
+
+@pytest.mark.timing
+def test_insert_throughput():
+    # Resting orders on both sides of a spread, so every insert checks the opposite best
+    rng = random.Random(0)
+    n = 100000
+    resting = []
+    for i in range(n):
+        side = i % 2
+        ticks = rng.randrange(1, 1000)
+        price = (100000 - ticks, 1000) if side == 0 else (100000 + ticks, 1000)
+        resting.append(message(side, rng.randrange(1, 10 ** 18), price, expiration=10 ** 9 + i))
+    # Then takers priced through the whole book, each filling one or more of them
+    crossing = [
+        message(i % 2, rng.randrange(1, 10 ** 18), (200000, 1000) if i % 2 == 0 else (1, 1000))
+        for i in range(n // 2)
+    ]
+
+    best_resting = best_crossing = 0
+    for _ in range(3):
+        engine = MatchingEngine()
+        start = time.perf_counter()
+        for i, msg in enumerate(resting):
+            engine.add_order(msg, SIGNATURE, message_hash=i)
+        best_resting = max(best_resting, n / (time.perf_counter() - start))
+        assert len(engine.orders) == n
+
+        fills = 0
+        start = time.perf_counter()
+        for i, msg in enumerate(crossing, n):
+            fills += len(engine.add_order(msg, SIGNATURE, message_hash=i))
+        best_crossing = max(best_crossing, len(crossing) / (time.perf_counter() - start))
+        assert fills >= len(crossing)
+
+    assert best_resting >= 100000, f"{best_resting:.0f} resting inserts/s"
+    assert best_crossing >= 100000, f"{best_crossing:.0f} crossing inserts/s"
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from starkware.starkware_utils.error_handling import StarkException
+from lib.nonce_manager import NonceManager
+from zigzag_test import uint
+
+
+@pytest.mark.asyncio
+async def test_concurrent_approvals(exchange):
+    seller, base_asset = exchange.seller, exchange.base_asset
+    manager = NonceManager(exchange.seller_signer, seller)
+    (start,) = (await seller.get_nonce().call()).result
+
+    spenders = list(range(1000, 1020))
+    await asyncio.gather(
+        *(
+            manager.send_transaction(
+                base_asset.contract_address, "approve", [spender, *uint(spender * 10)]
+            )
+            for spender in spenders
+        )
+    )
+    assert manager.syncs == 1
+    assert (await seller.get_nonce().call()).result == (start + len(spenders),)
+    for spender in spenders:
+        allowance = await base_asset.allowance(seller.contract_address, spender).call()
+        assert allowance.result.res == uint(spender * 10)
+
+    # The rejected transfer raises, and the approvals queued behind it are replayed
+    calls = [("approve", [2000 + i, *uint(i + 1)]) for i in range(5)]
+    calls[2] = ("transfer", [exchange.buyer.contract_address, *uint(10 ** 30)])
+    results = await asyncio.gather(
+        *(
+            manager.send_transaction(base_asset.contract_address, name, calldata)
+            for name, calldata in calls
+        ),
+        return_exceptions=True,
+    )
+    assert [isinstance(result, StarkException) for result in results] == [
+        False,
+        False,
+        True,
+        False,
+        False,
+    ]
+    assert (await seller.get_nonce().call()).result == (start + len(spenders) + 4,)
+    for i in (0, 1, 3, 4):
+        allowance = await base_asset.allowance(seller.contract_address, 2000 + i).call()
+        assert allowance.result.res == uint(i + 1)
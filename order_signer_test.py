@@ -0,0 +1,117 @@
+import random
+import time
+
+import pytest
+
+from lib.order_signer import OrderSigner, signing_pool
+from lib.utils import Signer
+from lib.zz_message import DOMAIN_PREFIX, MESSAGE_PREFIX, Order, ZZ_Message
+
+SIGNER = Signer(1234322181823212312)
+SENDER = 0x123
+
+
+def random_orders(rng, n):
+    return [
+        Order(
+            rng.choice([0x111, 0x112]),
+            0x222,
+            rng.randrange(2),
+            rng.randrange(1, 10 ** 20),
+            (rng.randrange(1, 10 ** 6), rng.randrange(1, 10 ** 6)),
+            rng.randrange(2 ** 40),
+            rng.randrange(3),
+        )
+        for _ in range(n)
+    ]
+
+
+def test_order_signer_matches_zz_message():
+    rng = random.Random(18)
+    order_signer = OrderSigner(SIGNER, SENDER, MESSAGE_PREFIX, DOMAIN_PREFIX)
+    for order in random_orders(rng, 4):
+        message = ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, SENDER, order)
+        assert order_signer.hash(order) == message.hash()
+        assert order_signer.sign(order) == message.sign(SIGNER)
+        assert order_signer.to_starknet_args(order) == message.to_starknet_args(SIGNER)
+
+
+def test_signatures_are_memoized():
+    rng = random.Random(18)
+    orders = random_orders(rng, 3)
+    order_signer = OrderSigner(SIGNER, SENDER, MESSAGE_PREFIX, DOMAIN_PREFIX, max_cached=2)
+    first = order_signer.sign(orders[0])
+    assert order_signer.sign(orders[0]) is first
+    order_signer.sign(orders[1])
+    order_signer.sign(orders[0])
+    # orders[1] is the least recently used, so it makes room for orders[2]
+    order_signer.sign(orders[2])
+    assert list(order_signer.signatures) == [order_signer.hash(o) for o in (orders[0], orders[2])]
+
+
+def test_sign_orders_on_pool():
+    rng = random.Random(18)
+    orders = random_orders(rng, 6)
+    expected = [ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, SENDER, o).sign(SIGNER) for o in orders]
+    order_signer = OrderSigner(SIGNER, SENDER, MESSAGE_PREFIX, DOMAIN_PREFIX)
+    order_signer.sign(orders[0])
+    with signing_pool(SIGNER, processes=2) as pool:
+        # Duplicates are signed once
+        assert order_signer.sign_orders(orders + orders[:2], pool) == expected + expected[:2]
+    assert len(order_signer.signatures) == len(orders)
+    assert order_signer.sign_orders(orders) == expected
+
+
+def test_retries_are_not_signed_again():
+    rng = random.Random(18)
+    orders = random_orders(rng, 20)
+    current = [
+        ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, SENDER, order).to_starknet_args(SIGNER)
+        for order in orders
+    ]
+
+    # Every quote is sent twice, as a retry would
+    order_signer = OrderSigner(SIGNER, SENDER, MESSAGE_PREFIX, DOMAIN_PREFIX)
+    for _ in range(2):
+        assert [order_signer.to_starknet_args(order) for order in orders] == current
+    assert (order_signer.signature_misses, order_signer.signature_hits) == (20, 20)
+
+    # Duplicates within one call are signed once, and a later call signs nothing
+    assert order_signer.sign_orders(orders[:2] * 2) == [order[-2:] for order in current[:2] * 2]
+    assert (order_signer.signature_misses, order_signer.signature_hits) == (20, 24)
+
+
+@pytest.mark.timing
+def test_order_signer_throughput():
+    rng = random.Random(18)
+    orders = random_orders(rng, 20)
+    n = 2 * len(orders)
+
+    # Every quote is sent twice, as a retry would
+    start = time.perf_counter()
+    for _ in range(2):
+        current = [
+            ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, SENDER, order).to_starknet_args(SIGNER)
+            for order in orders
+        ]
+    current_rate = n / (time.perf_counter() - start)
+    order_signer = OrderSigner(SIGNER, SENDER, MESSAGE_PREFIX, DOMAIN_PREFIX)
+    start = time.perf_counter()
+    for _ in range(2):
+        cached = [order_signer.to_starknet_args(order) for order in orders]
+    cached_rate = n / (time.perf_counter() - start)
+    assert cached == current
+
+    # Hashing alone, where OrderSigner starts from the hash state of the sender and market
+    start = time.perf_counter()
+    hashes = [ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, SENDER, o).hash() for o in orders]
+    hash_rate = len(orders) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    cached_hashes = [order_signer.hash(order) for order in orders]
+    cached_hash_rate = len(orders) / (time.perf_counter() - start)
+    assert cached_hashes == hashes
+
+    rates = f"to_starknet_args: {current_rate:.0f} -> {cached_rate:.0f} orders/s"
+    assert cached_rate > current_rate, rates
+    rates = f"hash: {hash_rate:.0f} -> {cached_hash_rate:.0f} orders/s"
+    assert cached_hash_rate > hash_rate, rates
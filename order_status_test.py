@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from lib.matching import MatchingEngine
+from lib.order_status import OrderStatusClient
+
+
+class CountingContract:
+    """Records the hashes of every get_order_statuses call made through it."""
+
+    def __init__(self, contract):
+        self.contract = contract
+        self.status_calls = []
+
+    def __getattr__(self, name):
+        return getattr(self.contract, name)
+
+    def get_order_statuses(self, hashes):
+        self.status_calls.append(list(hashes))
+        return self.contract.get_order_statuses(hashes)
+
+
+class PausedContract:
+    """Reads the statuses when get_order_statuses is called, and returns them from call() once
+    released."""
+
+    def __init__(self):
+        self.statuses = {}
+        self.released = asyncio.Event()
+
+    def get_order_statuses(self, hashes):
+        filled = [self.statuses.get(h, 0) for h in hashes]
+
+        async def call():
+            await self.released.wait()
+            return SimpleNamespace(result=SimpleNamespace(filled=filled))
+
+        return SimpleNamespace(call=call)
+
+
+@pytest.mark.asyncio
+async def test_pending_read_is_not_cached():
+    contract = PausedContract()
+    client = OrderStatusClient(contract)
+    contract.statuses[1] = 5
+    read = asyncio.ensure_future(client.get_order_statuses([1, 2]))
+    await asyncio.sleep(0)
+
+    # A fill lands while the read is pending, with both of its invalidations
+    client.invalidate([1])
+    contract.statuses[1] = 10
+    client.invalidate([1])
+    contract.released.set()
+    assert await read == [5, 0]
+    assert client.cache == {}
+    assert await client.get_order_statuses([1, 2]) == [10, 0]
+    assert client.cache == {1: 10, 2: 0}
+
+
+@pytest.mark.asyncio
+async def test_order_status_client(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+
+    engine = MatchingEngine()
+    sells = [make_message(seller, 1, 10, (1, 1), 2 ** 40 + i) for i in range(3)]
+    for sell in sells:
+        engine.add_order(sell, sell.sign(seller_signer))
+    buy = make_message(buyer, 0, 25, (2, 1), 2 ** 40)
+    fills = engine.add_order(buy, buy.sign(buyer_signer))
+    assert [fill.base_fill_quantity for fill in fills] == [10, 10, 5]
+    hashes = [buy.hash()] + [sell.hash() for sell in sells] + [12345]
+
+    counting = CountingContract(contract)
+    client = OrderStatusClient(counting, chunk_size=2)
+    assert await client.get_order_statuses(hashes) == [0] * 5
+    assert counting.status_calls == [hashes[0:2], hashes[2:4], hashes[4:5]]
+
+    # Served from the cache, including repeated hashes
+    assert await client.get_order_statuses(hashes + hashes[:2]) == [0] * 7
+    assert await client.get_order_status(hashes[1]) == 0
+    assert len(counting.status_calls) == 3
+
+    # A fill drops the buy and sell hashes it touches, and nothing else
+    await client.fill_order(fills[0])
+    assert await client.get_order_statuses(hashes) == [10, 10, 0, 0, 0]
+    assert counting.status_calls[3:] == [hashes[0:2]]
+
+    await client.fill_orders_batch(fills[1:], netted=True)
+    assert await client.get_order_statuses(hashes) == [25, 10, 10, 5, 0]
+    assert counting.status_calls[4:] == [[hashes[0], hashes[2]], [hashes[3]]]
+
+    # cancel_order sets the status past the order size
+    await client.cancel_order(
+        sells[2], sells[2].sign(seller_signer), caller_address=seller.contract_address
+    )
+    assert await client.get_order_status(hashes[3]) == 11
+    assert counting.status_calls[6:] == [[hashes[3]]]
+
+    # A failed transaction still invalidates
+    with pytest.raises(Exception):
+        await client.fill_order(fills[2])
+    assert hashes[0] not in client.cache and hashes[3] not in client.cache
+
+    # The bulk view agrees with get_order_status
+    execution_info = await contract.get_order_statuses(hashes).call()
+    assert execution_info.result.filled == [
+        (await contract.get_order_status(h).call()).result.filled for h in hashes
+    ]
+    assert (await contract.get_order_statuses([]).call()).result.filled == []
+
+    with pytest.raises(ValueError):
+        OrderStatusClient(contract, chunk_size=0)
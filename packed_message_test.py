@@ -0,0 +1,91 @@
+import pytest
+
+from starkware.starkware_utils.error_handling import StarkException
+from lib.zz_message import (
+    DOMAIN_PREFIX,
+    MESSAGE_PREFIX,
+    Order,
+    PriceRatio,
+    ZZ_Message,
+    pack_order_fields,
+    unpack_order_fields,
+)
+from zigzag_test import flatten
+
+
+def test_pack_order_fields():
+    for side, expiration, price in [
+        (0, 0, (0, 0)),
+        (1, 2 ** 40, (405736, 100000)),
+        (0, 2 ** 63 - 1, (2 ** 64 - 1, 2 ** 123 - 1)),
+    ]:
+        packed = pack_order_fields(side, expiration, PriceRatio(*price))
+        unpacked_side, unpacked_expiration, unpacked_price = unpack_order_fields(packed)
+        assert (unpacked_side, unpacked_expiration) == (side, expiration)
+        assert (unpacked_price.numerator, unpacked_price.denominator) == price
+
+    for side, expiration, price in [
+        (2, 0, (1, 1)),
+        (0, 2 ** 63, (1, 1)),
+        (0, 0, (2 ** 64, 1)),
+        (0, 0, (1, 2 ** 123)),
+    ]:
+        with pytest.raises(ValueError):
+            pack_order_fields(side, expiration, PriceRatio(*price))
+
+    order = Order(123, 456, 1, 10 ** 18, (1, 249999999), 2 ** 40, 3)
+    message = ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, 789, order)
+    args = message.to_signed_packed_starknet_args(11, 22)
+    decoded, signature = ZZ_Message.from_packed_starknet_args(args, MESSAGE_PREFIX, DOMAIN_PREFIX)
+    assert decoded.hash() == message.hash()
+    assert signature == (11, 22)
+    # 8 felts against 15
+    assert len(args) == 8 and len(flatten(message.to_signed_starknet_args(11, 22))) == 15
+
+
+@pytest.mark.asyncio
+async def test_fill_order_packed(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+
+    buy = make_message(buyer, 0, 30, (2, 1), 2 ** 40)
+    sell = make_message(seller, 1, 30, (1, 1), 2 ** 40)
+    execution_info = await contract.fill_order_packed(
+        buy_order=buy.to_packed_starknet_args(buyer_signer),
+        sell_order=sell.to_packed_starknet_args(seller_signer),
+        fill_price=(3, 2),
+        base_fill_quantity=10,
+    ).invoke()
+    assert len(execution_info.call_info.calldata) == 19
+
+    # Both encodings fill the same orders
+    await contract.fill_order(
+        buy_order=buy.to_starknet_args(buyer_signer),
+        sell_order=sell.to_starknet_args(seller_signer),
+        fill_price=(3, 2),
+        base_fill_quantity=5,
+    ).invoke()
+    other_sell = make_message(seller, 1, 10, (1, 1), 2 ** 40 + 1)
+    await contract.fill_orders_batch_packed(
+        buy_orders=[buy.to_packed_starknet_args(buyer_signer)] * 2,
+        sell_orders=[
+            sell.to_packed_starknet_args(seller_signer),
+            other_sell.to_packed_starknet_args(seller_signer),
+        ],
+        fill_prices=[(3, 2), (1, 1)],
+        base_fill_quantities=[5, 10],
+    ).invoke()
+    hashes = [buy.hash(), sell.hash(), other_sell.hash()]
+    assert (await contract.get_order_statuses(hashes).call()).result.filled == [30, 20, 10]
+
+    # The signature covers the unpacked fields
+    other_buy = make_message(buyer, 0, 5, (2, 1), 2 ** 40 + 2)
+    tampered = list(sell.to_packed_starknet_args(seller_signer))
+    tampered[4] += 2
+    with pytest.raises(StarkException):
+        await contract.fill_order_packed(
+            buy_order=other_buy.to_packed_starknet_args(buyer_signer),
+            sell_order=tuple(tampered),
+            fill_price=(3, 2),
+            base_fill_quantity=1,
+        ).invoke()
@@ -0,0 +1,96 @@
+from collections import Counter
+
+import pytest
+
+from starkware.cairo.common.cairo_function_runner import CairoFunctionRunner
+from starkware.starknet.business_logic.internal_transaction import InternalInvokeFunction
+
+import lib.profiler
+from lib.benchmark import execution_resources
+from lib.profiler import STEPS, StepProfile, StepProfiler, diff_summary, differential_folded
+
+
+@pytest.mark.asyncio
+async def test_profile_fill_order(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    base_asset, quote_asset = exchange.base_asset, exchange.quote_asset
+    buy = make_message(buyer, 0, 5, (1, 1), 2 ** 40)
+    sell = make_message(seller, 1, 5, (1, 1), 2 ** 40)
+    names = {
+        contract.contract_address: "zigzag",
+        buyer.contract_address: "buyer",
+        seller.contract_address: "seller",
+        base_asset.contract_address: "base",
+        quote_asset.contract_address: "quote",
+    }
+
+    with StepProfiler(names) as profiler:
+        execution_info = await contract.fill_order(
+            buy_order=buy.to_starknet_args(buyer_signer),
+            sell_order=sell.to_starknet_args(seller_signer),
+            fill_price=(1, 1),
+            base_fill_quantity=5,
+        ).invoke()
+    profile = profiler.last
+
+    # Every step and builtin instance of the invocation and its calls is attributed
+    resources = execution_resources(execution_info)
+    for metric in ("n_steps", "pedersen_builtin", "range_check_builtin"):
+        assert profile.total(metric) == resources[metric], metric
+
+    self_steps, total_steps = profile.functions()
+    assert total_steps["zigzag:__wrappers__.fill_order"] == resources["n_steps"]
+    for frame in (
+        "zigzag:fill_order",
+        "zigzag:lib.ZZ_Message_base.validate_message_prefix",
+        "zigzag:lib.ZZ_Message_base.compute_message_hash",
+        "zigzag:lib.Order_base.check_order_valid",
+        "buyer:is_valid_signature",
+        "base:transfer_from",
+        "quote:transfer_from",
+    ):
+        assert total_steps[frame] > 0, frame
+    # Callee contracts continue the stack of the call that made them
+    assert any(
+        stack[0] == "zigzag:__wrappers__.fill_order" and stack[-1] == "base:transfer_from"
+        for stack in profile.counts[STEPS]
+    )
+    _, pedersen = profile.functions("pedersen_builtin")
+    assert pedersen["zigzag:lib.ZZ_Message_base.compute_message_hash"] > 0
+
+    summary = profile.summary()
+    assert summary.startswith(f"n_steps {resources['n_steps']}")
+    assert "zigzag:fill_order" in summary
+
+
+def test_folded_diff(tmp_path):
+    old = StepProfile({STEPS: Counter({("a:f",): 10, ("a:f", "a:g"): 5})})
+    new = StepProfile({STEPS: Counter({("a:f",): 10, ("a:f", "a:g"): 2, ("a:f", "b:h"): 7})})
+    new.write(str(tmp_path / "new"))
+    assert (tmp_path / "new.folded").read_text() == "a:f 10\na:f;a:g 2\na:f;b:h 7\n"
+    assert (tmp_path / "new.txt").read_text().startswith("n_steps 19\n")
+
+    loaded = StepProfile.from_folded(str(tmp_path / "new.folded"))
+    assert loaded.counts == new.counts
+    assert differential_folded(old, loaded) == ["a:f 10 10", "a:f;a:g 5 2", "a:f;b:h 0 7"]
+    lines = diff_summary(old, loaded).splitlines()
+    assert lines[0] == "n_steps 15 -> 19"
+    assert [line.split() for line in lines[2:]] == [
+        ["b:h", "0", "7", "+7"],
+        ["a:g", "5", "2", "-3"],
+    ]
+
+
+def test_profiler_restores_the_framework(monkeypatch):
+    originals = (InternalInvokeFunction._run, CairoFunctionRunner.run_from_entrypoint)
+    with pytest.raises(ValueError):
+        with StepProfiler():
+            assert InternalInvokeFunction._run is not originals[0]
+            raise ValueError
+    assert (InternalInvokeFunction._run, CairoFunctionRunner.run_from_entrypoint) == originals
+
+    monkeypatch.setattr(lib.profiler, "CAIRO_LANG_VERSION", "0.8.0")
+    with pytest.raises(RuntimeError, match="supports cairo-lang 0.7.1, not 0.8.0"):
+        StepProfiler().__enter__()
+    assert (InternalInvokeFunction._run, CairoFunctionRunner.run_from_entrypoint) == originals
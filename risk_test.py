@@ -0,0 +1,158 @@
+import time
+
+import pytest
+
+from starkware.crypto.signature.signature import FIELD_PRIME
+from starkware.starkware_utils.error_handling import StarkException
+
+from lib.matching import BookOrder, Fill, MatchingEngine
+from lib.model import ExchangeModel, ModelError
+from lib.risk import INSUFFICIENT_ALLOWANCE, INSUFFICIENT_BALANCE, INVALID_AMOUNTS, RiskCache
+from lib.validation import MAX_DIV
+from lib.zz_message import DOMAIN_PREFIX, MESSAGE_PREFIX, Order, ZZ_Message
+
+# Minted by the ERC20 constructor and approved by deploy_exchange
+MINTED = 100 * 10 ** 18
+APPROVED = int(1e25)
+
+
+def make_fill(buyer, seller, price, quantity, base_asset=1, quote_asset=2):
+    book_orders = [
+        BookOrder(
+            ZZ_Message(
+                MESSAGE_PREFIX,
+                DOMAIN_PREFIX,
+                sender,
+                Order(base_asset, quote_asset, side, quantity, price, 2 ** 40),
+            ),
+            0,
+            None,
+            quantity,
+            2 ** 40,
+            0,
+        )
+        for sender, side in ((buyer, 0), (seller, 1))
+    ]
+    return Fill(*book_orders, price, quantity)
+
+
+@pytest.mark.asyncio
+async def test_racing_fills(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    base_asset, quote_asset = exchange.base_asset, exchange.quote_asset
+    base = base_asset.contract_address
+    quote = quote_asset.contract_address
+
+    # Two matches that each sell 60 of the seller's 100 base tokens
+    engine = MatchingEngine()
+    fills = []
+    for i, quantity in enumerate((60, 60, 30)):
+        for account, signer, side in ((seller, seller_signer, 1), (buyer, buyer_signer, 0)):
+            m = make_message(account, side, quantity * 10 ** 18, (1, 1), 2 ** 40 + i)
+            fills += engine.add_order(m, m.sign(signer))
+    first, second, third = fills
+
+    cache = RiskCache(contract.contract_address, {base: base_asset, quote: quote_asset})
+    cache.track([buyer.contract_address, seller.contract_address])
+    await cache.sync()
+    assert cache.available(base, seller.contract_address) == (MINTED, APPROVED)
+    assert cache.available(quote, buyer.contract_address) == (MINTED, APPROVED)
+    assert cache.available(base, buyer.contract_address) == (0, 0)
+
+    assert cache.check_fills([first, second]) == [None, INSUFFICIENT_BALANCE]
+    submission, results = cache.reserve([first])
+    assert results == [None]
+    seller_base = cache.available(base, seller.contract_address)
+    assert seller_base == (40 * 10 ** 18, APPROVED - 60 * 10 ** 18)
+    # The second fill reuses the liquidity that the pending first one spends
+    assert cache.check_fills([second]) == [INSUFFICIENT_BALANCE]
+    assert cache.check_fills([third]) == [None]
+
+    # Both submitted anyway, only the first goes through
+    await contract.fill_order(**first.to_starknet_args()).invoke()
+    with pytest.raises(StarkException):
+        await contract.fill_order(**second.to_starknet_args()).invoke()
+
+    await cache.resync([submission])
+    assert cache.pending == {}
+    assert cache.available(base, seller.contract_address) == seller_base
+    assert cache.available(base, buyer.contract_address) == (60 * 10 ** 18, 0)
+    assert cache.check_fills([second, third]) == [INSUFFICIENT_BALANCE, None]
+
+
+def test_batches():
+    a, b, exchange = 0xA, 0xB, 0xE
+    cache = RiskCache(exchange, {}, protocol_fee_bips=30)
+    cache.balances.update({(1, b): 1000, (2, a): 3000})
+    cache.allowances.update({(1, a): 0, (1, b): 1000, (2, a): 3000, (2, b): 0})
+
+    # a buys 1000 base from b and sells it back: the second fill needs the base of the first
+    # in a's balance and in its allowance, which a netted batch does without
+    round_trip = [make_fill(a, b, (2, 1), 1000), make_fill(b, a, (2, 1), 997)]
+    assert cache.check_fills(round_trip) == [None, INSUFFICIENT_ALLOWANCE]
+    assert cache.check_fills(round_trip, netted=True) == [None, None]
+    cache.allowances[(1, a)] = 1000
+    assert cache.check_fills(round_trip) == [None, INSUFFICIENT_ALLOWANCE]
+    cache.allowances[(2, b)] = 1994
+    assert cache.check_fills(round_trip) == [None, None]
+
+    submission, results = cache.reserve(round_trip)
+    assert results == [None, None]
+    # Balances reserve the net debit of the batch, which for b are the fees of the two fills,
+    # while allowances reserve every transfer_from
+    assert cache.pending[submission] == {
+        (1, b): (5, 1000),
+        (2, a): (6, 2000),
+        (1, a): (0, 997),
+        (2, b): (0, 1994),
+    }
+    assert cache.available(1, b) == (995, 0)
+    assert cache.available(2, b) == (0, 0)
+    cache.release(submission)
+    assert cache.pending == {}
+    assert cache.available(2, b) == (0, 1994)
+
+
+def test_trade_amounts():
+    a, b, exchange, owner = 0xA, 0xB, 0xE, 0xF
+    model = ExchangeModel(exchange, owner)
+    # unsigned_div_rem rounds down, and fails above 2 ** 128 or past MAX_DIV. The products are
+    # felts, so a large numerator wraps around the field prime
+    quantities = [1, 333, 9999, 10000, 10001, 2 ** 128 - 1]
+    prices = [(1, 1), (2, 3), (1, MAX_DIV), (1, MAX_DIV + 1), (2 ** 128, 1), (2 ** 125, 2 ** 122)]
+    prices.append((FIELD_PRIME - 1, 1))
+    for bips in (0, 1, 30, 10000):
+        model.set_protocol_fee_bips(bips, owner)
+        cache = RiskCache(exchange, {}, protocol_fee_bips=bips)
+        for quantity in quantities:
+            for price in prices:
+                fill = make_fill(a, b, price, quantity)
+                try:
+                    base_amount, quote_amount, fee = model._trade_amounts(quantity, price)
+                except ModelError:
+                    assert cache._transfers(fill) is None, (bips, quantity, price)
+                    assert cache.check_fills([fill]) == [INVALID_AMOUNTS]
+                    continue
+                expected = [(1, b, a, base_amount), (2, a, b, quote_amount)]
+                if fee:
+                    expected.append((1, b, exchange, fee))
+                assert cache._transfers(fill) == expected, (bips, quantity, price)
+
+
+@pytest.mark.timing
+def test_check_fills_throughput():
+    a, b, exchange = 0xA, 0xB, 0xE
+    cache = RiskCache(exchange, {}, protocol_fee_bips=30)
+    cache.balances[(1, b)] = 10 ** 30
+    cache.allowances[(1, b)] = 10 ** 30
+    cache.balances[(2, a)] = 10 ** 30
+    cache.allowances[(2, a)] = 10 ** 30
+    n = 10000
+    batch = [make_fill(a, b, (3, 2), 10 ** 6 + i) for i in range(n)]
+    start = time.perf_counter()
+    results = cache.check_fills(batch)
+    elapsed = time.perf_counter() - start
+    assert results == [None] * n
+    # A microsecond or so per fill
+    assert elapsed < 1, f"{elapsed / n * 1e6:.1f} us per fill"
@@ -0,0 +1,54 @@
+import pytest
+
+from lib.utils import Signer
+
+
+@pytest.mark.asyncio
+async def test_register_signing_key(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    expirations = iter(range(2 ** 40, 2 ** 41))
+
+    def fill(sell_signer):
+        expiration = next(expirations)
+        return contract.fill_order(
+            buy_order=make_message(buyer, 0, 1, (1, 1), expiration).to_starknet_args(buyer_signer),
+            sell_order=make_message(seller, 1, 1, (1, 1), expiration).to_starknet_args(
+                sell_signer
+            ),
+            fill_price=(1, 1),
+            base_fill_quantity=1,
+        )
+
+    async def register(public_key):
+        await seller_signer.send_transaction(
+            seller, contract.contract_address, "register_signing_key", [public_key]
+        )
+        (key,) = (await contract.get_signing_key(seller.contract_address).call()).result
+        assert key == public_key
+
+    # Without a key, the account contract checks the signature
+    fallback = await fill(seller_signer).invoke()
+    await register(seller_signer.public_key)
+    registered = await fill(seller_signer).invoke()
+    assert registered.call_info.cairo_usage.n_steps < fallback.call_info.cairo_usage.n_steps
+
+    # Rotating to a key that only the exchange knows about
+    rotated_signer = Signer(1234567890)
+    await register(rotated_signer.public_key)
+    await fill(rotated_signer).invoke()
+    with pytest.raises(Exception):
+        await fill(seller_signer).invoke()
+
+    # Registering 0 goes back to the account contract, which does not know the rotated key
+    await register(0)
+    await fill(seller_signer).invoke()
+    with pytest.raises(Exception):
+        await fill(rotated_signer).invoke()
+
+    # Only the caller's own key is registered
+    await contract.register_signing_key(rotated_signer.public_key).invoke(
+        caller_address=buyer.contract_address
+    )
+    (key,) = (await contract.get_signing_key(seller.contract_address).call()).result
+    assert key == 0
@@ -0,0 +1,281 @@
+import random
+import time
+
+import pytest
+
+from starkware.crypto.signature.signature import FIELD_PRIME
+from lib.validation import FillValidator, load_config
+from lib.zz_message import DOMAIN_PREFIX, MESSAGE_PREFIX, Order, StarkNetDomain, ZZ_Message
+
+BASE_ASSET = 0x111
+QUOTE_ASSET = 0x222
+
+
+def message(side, base_quantity, price, expiration=1000, sender=0x333, base_asset=BASE_ASSET):
+    order = Order(base_asset, QUOTE_ASSET, side, base_quantity, price, expiration)
+    return ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, sender, order)
+
+
+def test_load_config():
+    config = load_config()
+    assert config["STARKNET_MESSAGE_PREFIX"] == MESSAGE_PREFIX
+    assert config["DOMAIN_NAME"] == DOMAIN_PREFIX.name
+    assert config["APP_VERSION"] == 1
+    assert config["CHAIN_ID"] == DOMAIN_PREFIX.chain_id
+    assert (config["BUY_SIDE"], config["SELL_SIDE"]) == (0, 1)
+
+
+def test_first_failing_assertion():
+    validator = FillValidator()
+    buy = message(0, 10, (3, 1))
+    sell = message(1, 10, (1, 1))
+    wrong_domain = ZZ_Message(
+        MESSAGE_PREFIX, StarkNetDomain(DOMAIN_PREFIX.name, 2, DOMAIN_PREFIX.chain_id), 0x333, sell.order
+    )
+    cases = [
+        (buy, sell, (2, 1), 10, 0, 0, None),
+        (buy, wrong_domain, (2, 1), 10, 0, 0, "assert sell_order.domain_prefix.version = APP_VERSION"),
+        (
+            buy,
+            message(1, 10, (1, 1), base_asset=0x999),
+            (2, 1),
+            10,
+            0,
+            0,
+            "assert buy_order.base_asset = sell_order.base_asset",
+        ),
+        (sell, sell, (2, 1), 10, 0, 0, "assert buy_order.side = BUY_SIDE"),
+        (buy, sell, (2, 1), -1, 0, 0, "assert_nn_le(0, base_fill_quantity)"),
+        (
+            buy,
+            sell,
+            (2, 1),
+            5,
+            6,
+            0,
+            "assert_nn_le(filledbuy + base_fill_quantity, buy_order.base_quantity)",
+        ),
+        # 7/2 is above the buy limit of 3/1, and 1/2 is below the sell limit of 1/1
+        (
+            buy,
+            sell,
+            (7, 2),
+            10,
+            0,
+            0,
+            "assert_nn_le(fill_price.numerator * buy_order.price.denominator, "
+            "buy_order.price.numerator * fill_price.denominator)",
+        ),
+        (
+            buy,
+            sell,
+            (1, 2),
+            10,
+            0,
+            0,
+            "assert_nn_le(sell_order.price.numerator * fill_price.denominator, "
+            "fill_price.numerator * sell_order.price.denominator)",
+        ),
+        (
+            buy,
+            message(1, 10, (1, 1), expiration=-1),
+            (2, 1),
+            10,
+            0,
+            0,
+            "assert_nn_le(contract_time, sell_order.expiration)",
+        ),
+        # Both price checks pass on 0 * x <= 0, then the quote division fails
+        (
+            buy,
+            sell,
+            (0, 0),
+            10,
+            0,
+            0,
+            "unsigned_div_rem(base_fill_quantity * fill_price.numerator, fill_price.denominator)",
+        ),
+    ]
+    errors = validator.validate(
+        [case[0] for case in cases],
+        [case[1] for case in cases],
+        [case[2] for case in cases],
+        [case[3] for case in cases],
+        filled_buys=[case[4] for case in cases],
+        filled_sells=[case[5] for case in cases],
+    )
+    assert errors == [case[6] for case in cases]
+
+    assert validator.validate([buy], [sell], [(2, 1)], [10], block_timestamp=1000) == [None]
+    assert validator.validate([buy], [sell], [(2, 1)], [10], block_timestamp=1001) == [
+        "assert_nn_le(contract_time, buy_order.expiration)"
+    ]
+    assert validator.validate([buy], [sell], [(2, 1)], [10], sell_epochs=[1]) == [
+        "assert_nn_le(sell_epoch, sell_order.epoch)"
+    ]
+    with pytest.raises(ValueError):
+        validator.validate([buy], [sell], [], [10])
+
+
+@pytest.mark.timing
+def test_validate_throughput():
+    rng = random.Random(0)
+    n = 20000
+    buys, sells, prices, quantities = [], [], [], []
+    for _ in range(n):
+        quantity = rng.randrange(1, 10 ** 18)
+        buys.append(message(0, quantity, (rng.randrange(100, 200), 100)))
+        sells.append(message(1, quantity, (rng.randrange(1, 150), 100)))
+        prices.append((rng.randrange(100, 150), 100))
+        quantities.append(quantity)
+
+    validator = FillValidator()
+    start = time.perf_counter()
+    errors = validator.validate(buys, sells, prices, quantities)
+    rate = n / (time.perf_counter() - start)
+    assert errors.count(None) not in (0, n)
+    assert rate >= 20000, f"{rate:.0f} fills/s"
+
+
+@pytest.mark.asyncio
+async def test_matches_contract(exchange, make_message):
+    # Randomly corrupted matches must be accepted or rejected by the validator exactly when
+    # fill_order accepts or rejects them. .call() leaves orderstatus untouched between cases.
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    base_asset, quote_asset = exchange.base_asset, exchange.quote_asset
+    validator = FillValidator()
+    rng = random.Random(6)
+    p = FIELD_PRIME
+
+    def case():
+        quantity = rng.randrange(0, 1000)
+        fill_price = [rng.randrange(1, 1000), rng.randrange(1, 1000)]
+        # Limits on either side of the fill price
+        buy_price = [fill_price[0] * rng.randrange(1, 3), fill_price[1]]
+        sell_price = [fill_price[0], fill_price[1] * rng.randrange(1, 3)]
+        buy = dict(
+            message_prefix=MESSAGE_PREFIX,
+            domain=[DOMAIN_PREFIX.name, DOMAIN_PREFIX.version, DOMAIN_PREFIX.chain_id],
+            base_asset=base_asset.contract_address,
+            quote_asset=quote_asset.contract_address,
+            side=0,
+            base_quantity=quantity + rng.randrange(0, 100),
+            price=buy_price,
+            expiration=rng.randrange(0, 2 ** 40),
+            epoch=rng.randrange(0, 3),
+        )
+        sell = dict(buy, domain=list(buy["domain"]), side=1, price=sell_price)
+        sell["base_quantity"] = quantity + rng.randrange(0, 100)
+        fill = dict(price=fill_price, quantity=quantity)
+
+        for _ in range(rng.choice([0, 1, 1, 2])):
+            target = rng.choice([buy, sell])
+            kind = rng.randrange(13)
+            if kind == 0:
+                target["message_prefix"] += 1
+            elif kind == 1:
+                target["domain"][rng.randrange(3)] += 1
+            elif kind == 2:
+                # Different on each side, so that the assets never match an undeployed token
+                asset = quote_asset.contract_address + (7 if target is buy else 8)
+                target[rng.choice(["base_asset", "quote_asset"])] = asset
+            elif kind == 3:
+                target["side"] = rng.choice([1 - target["side"], 2])
+            elif kind == 4:
+                target["base_quantity"] = rng.choice([fill["quantity"] - 1, p - 1])
+            elif kind == 5:
+                fill["quantity"] = rng.choice([p - 1, fill["quantity"] + 100])
+            elif kind == 6:
+                fill["price"][rng.randrange(2)] += rng.choice([-1, 1])
+            elif kind == 7:
+                target["price"][rng.randrange(2)] += rng.choice([-1, 1])
+            elif kind == 8:
+                target["expiration"] = rng.choice([0, p - 1, 2 ** 128])
+            elif kind == 9:
+                fill["price"] = [0, 0]
+            elif kind == 10:
+                # The quote amount no longer fits in 128 bits
+                buy["price"] = [2 ** 100, 1]
+                sell["price"] = [1, 1]
+                fill["price"] = [2 ** 100, 1]
+                buy["base_quantity"] = sell["base_quantity"] = fill["quantity"] = 2 ** 60
+            elif kind == 11:
+                target["price"] = [p - target["price"][0], target["price"][1]]
+            else:
+                # Below an order_epoch of 0
+                target["epoch"] = rng.choice([p - 1, 2 ** 128])
+
+        def to_message(fields, account):
+            order = Order(
+                fields["base_asset"],
+                fields["quote_asset"],
+                fields["side"] % p,
+                fields["base_quantity"] % p,
+                [value % p for value in fields["price"]],
+                fields["expiration"] % p,
+                fields["epoch"] % p,
+            )
+            return ZZ_Message(
+                fields["message_prefix"] % p,
+                StarkNetDomain(*fields["domain"]),
+                account.contract_address,
+                order,
+            )
+
+        fill_price = tuple(value % p for value in fill["price"])
+        return to_message(buy, buyer), to_message(sell, seller), fill_price, fill["quantity"] % p
+
+    cases = [case() for _ in range(60)]
+    errors = validator.validate(
+        [c[0] for c in cases], [c[1] for c in cases], [c[2] for c in cases], [c[3] for c in cases]
+    )
+    assert 10 < errors.count(None) < 50
+
+    for (buy, sell, fill_price, quantity), error in zip(cases, errors):
+        call = contract.fill_order(
+            buy_order=buy.to_starknet_args(buyer_signer),
+            sell_order=sell.to_starknet_args(seller_signer),
+            fill_price=fill_price,
+            base_fill_quantity=quantity,
+        )
+        if error is None:
+            await call.call()
+        else:
+            with pytest.raises(Exception) as e_info:
+                await call.call()
+            if "prefix" in error:
+                assert "Invalid Message" in str(e_info.value)
+            elif not error.startswith("unsigned_div_rem"):
+                assert "Invalid order" in str(e_info.value)
+
+    # Partly filled and cancelled orders are checked against their orderstatus
+    buy = make_message(buyer, 0, 10, (2, 1), 2 ** 40)
+    sell = make_message(seller, 1, 10, (1, 1), 2 ** 40)
+    args = dict(
+        buy_order=buy.to_starknet_args(buyer_signer),
+        sell_order=sell.to_starknet_args(seller_signer),
+        fill_price=(3, 2),
+    )
+
+    async def check_filled(quantity, accepted):
+        filled_buy = (await contract.get_order_status(buy.hash()).call()).result.filled
+        filled_sell = (await contract.get_order_status(sell.hash()).call()).result.filled
+        (error,) = validator.validate(
+            [buy], [sell], [(3, 2)], [quantity], [filled_buy], [filled_sell]
+        )
+        assert (error is None) == accepted
+        call = contract.fill_order(**args, base_fill_quantity=quantity)
+        if accepted:
+            await call.call()
+        else:
+            with pytest.raises(Exception):
+                await call.call()
+
+    await contract.fill_order(**args, base_fill_quantity=4).invoke()
+    await check_filled(6, True)
+    await check_filled(7, False)
+    await contract.cancel_order(sell.to_starknet_args(seller_signer)).invoke(
+        caller_address=seller.contract_address
+    )
+    await check_filled(1, False)
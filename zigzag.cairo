@@ -2,22 +2,35 @@
 %lang starknet
 %builtins pedersen range_check ecdsa
 
+from starkware.cairo.common.alloc import alloc
 from starkware.cairo.common.cairo_builtins import HashBuiltin, SignatureBuiltin
+from starkware.cairo.common.default_dict import default_dict_new, default_dict_finalize
+from starkware.cairo.common.dict_access import DictAccess
+from starkware.cairo.common.math import assert_nn_le, assert_not_zero
+from starkware.cairo.common.math_cmp import is_le
 from starkware.cairo.common.registers import get_fp_and_pc
+from starkware.cairo.common.uint256 import Uint256
 from starkware.starknet.common.syscalls import get_caller_address, get_block_timestamp
 
-from lib.Exchange_base import Exchange_execute_trade
+from lib.Exchange_base import (
+    IERC20, NetLeg, Exchange_protocol_fee_bips, Exchange_accrued_fees, Exchange_execute_trade,
+    Exchange_record_trade, Exchange_settle_net_deltas)
 from lib.ZZ_Message_base import (
-    ZZ_Message, validate_message_prefix, verify_message_signature, compute_message_hash)
-from lib.Order_base import PriceRatio, check_order_valid
-from lib.config import TRUE, PROTOCOL_FEE_BIPS
+    ZZ_Message, PackedMessage, validate_message_prefix, verify_message_signature,
+    compute_message_hash, unpack_message, unpack_messages)
+from lib.Order_base import PriceRatio, check_order_valid, check_auction_order
+from lib.config import TRUE, PROTOCOL_FEE_BIPS, BUY_SIDE, SELL_SIDE
 
 ##############
 # CONSTRUCTOR
 ##############
 
+# owner may change the protocol fee and sweep the accrued fees
 @constructor
-func constructor{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}():
+func constructor{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        owner : felt):
+    exchange_owner.write(owner)
+    Exchange_protocol_fee_bips.write(PROTOCOL_FEE_BIPS)
     return ()
 end
 
@@ -25,11 +38,45 @@ end
 # STORAGE
 ##############
 
+@storage_var
+func exchange_owner() -> (owner : felt):
+end
+
 # Storage variable for order tracking
 @storage_var
 func orderstatus(messagehash : felt) -> (filled : felt):
 end
 
+# Orders of a sender with a lower epoch are cancelled
+@storage_var
+func order_epoch(sender : felt) -> (epoch : felt):
+end
+
+# Stark public key that signs the orders of an account, or 0 to ask the account contract
+@storage_var
+func signing_key(account : felt) -> (public_key : felt):
+end
+
+##############
+# EVENTS
+##############
+
+# Emitted for every match filled by fill_order or a batch
+@event
+func order_filled(
+        buy_order_hash : felt, sell_order_hash : felt, base_fill_quantity : felt,
+        fill_price : PriceRatio, buyer : felt, seller : felt):
+end
+
+@event
+func order_cancelled(order_hash : felt, sender : felt):
+end
+
+# Emitted by cancel_all_orders with the new epoch of sender
+@event
+func all_orders_cancelled(sender : felt, epoch : felt):
+end
+
 ##############
 # FILL ORDER, CANCEL, VIEW
 ##############
@@ -47,47 +94,353 @@ func fill_order{
     let fp_and_pc = get_fp_and_pc()
     local __fp__ = fp_and_pc.fp_val
 
+    _fill_order(&buy_order, &sell_order, fill_price, base_fill_quantity)
+    return ()
+end
+
+# Fills a list of matched order pairs in order. Entry i of each array describes one fill_order call
+@external
+func fill_orders_batch{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr}(
+        buy_orders_len : felt, buy_orders : ZZ_Message*, sell_orders_len : felt,
+        sell_orders : ZZ_Message*, fill_prices_len : felt, fill_prices : PriceRatio*,
+        base_fill_quantities_len : felt, base_fill_quantities : felt*):
+    with_attr error_message("Invalid batch"):
+        assert sell_orders_len = buy_orders_len
+        assert fill_prices_len = buy_orders_len
+        assert base_fill_quantities_len = buy_orders_len
+    end
+
+    _fill_orders_batch(buy_orders_len, buy_orders, sell_orders, fill_prices, base_fill_quantities)
+    return ()
+end
+
+# Fills the remaining n matches of a batch
+func _fill_orders_batch{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr}(
+        n : felt, buy_orders : ZZ_Message*, sell_orders : ZZ_Message*, fill_prices : PriceRatio*,
+        base_fill_quantities : felt*):
+    if n == 0:
+        return ()
+    end
+
+    _fill_order(buy_orders, sell_orders, [fill_prices], [base_fill_quantities])
+
+    return _fill_orders_batch(
+        n - 1,
+        buy_orders + ZZ_Message.SIZE,
+        sell_orders + ZZ_Message.SIZE,
+        fill_prices + PriceRatio.SIZE,
+        base_fill_quantities + 1)
+end
+
+# fill_order for v2 packed messages. They are unpacked to the ZZ_Message they encode, so an order
+# has the same hash and orderstatus whichever encoding it is filled with
+@external
+func fill_order_packed{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr}(
+        buy_order : PackedMessage, sell_order : PackedMessage, fill_price : PriceRatio,
+        base_fill_quantity : felt):
+    alloc_locals
+
+    # Needed for dereferencing buy_order and sell_order
+    let fp_and_pc = get_fp_and_pc()
+    local __fp__ = fp_and_pc.fp_val
+
+    let (local buy_message : ZZ_Message*) = alloc()
+    let (local sell_message : ZZ_Message*) = alloc()
+    unpack_message(&buy_order, buy_message)
+    unpack_message(&sell_order, sell_message)
+
+    _fill_order(buy_message, sell_message, fill_price, base_fill_quantity)
+    return ()
+end
+
+# fill_orders_batch for v2 packed messages
+@external
+func fill_orders_batch_packed{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr}(
+        buy_orders_len : felt, buy_orders : PackedMessage*, sell_orders_len : felt,
+        sell_orders : PackedMessage*, fill_prices_len : felt, fill_prices : PriceRatio*,
+        base_fill_quantities_len : felt, base_fill_quantities : felt*):
+    alloc_locals
+
+    with_attr error_message("Invalid batch"):
+        assert sell_orders_len = buy_orders_len
+        assert fill_prices_len = buy_orders_len
+        assert base_fill_quantities_len = buy_orders_len
+    end
+
+    let (local buy_messages : ZZ_Message*) = alloc()
+    let (local sell_messages : ZZ_Message*) = alloc()
+    unpack_messages(buy_orders_len, buy_orders, buy_messages)
+    unpack_messages(buy_orders_len, sell_orders, sell_messages)
+
+    _fill_orders_batch(
+        buy_orders_len, buy_messages, sell_messages, fill_prices, base_fill_quantities)
+    return ()
+end
+
+# Fills a list of matched order pairs like fill_orders_batch, but only transfers the net change of
+# each (asset, account) once every match has been validated
+@external
+func fill_orders_batch_netted{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr}(
+        buy_orders_len : felt, buy_orders : ZZ_Message*, sell_orders_len : felt,
+        sell_orders : ZZ_Message*, fill_prices_len : felt, fill_prices : PriceRatio*,
+        base_fill_quantities_len : felt, base_fill_quantities : felt*):
+    alloc_locals
+
+    with_attr error_message("Invalid batch"):
+        assert sell_orders_len = buy_orders_len
+        assert fill_prices_len = buy_orders_len
+        assert base_fill_quantities_len = buy_orders_len
+    end
+
+    let (local legs : NetLeg*) = alloc()
+    let (local net_deltas_start : DictAccess*) = default_dict_new(default_value=0)
+    let net_deltas = net_deltas_start
+
+    with net_deltas:
+        _fill_orders_batch_netted(
+            buy_orders_len, buy_orders, sell_orders, fill_prices, base_fill_quantities, legs)
+        Exchange_settle_net_deltas(legs, buy_orders_len * 4)
+    end
+
+    default_dict_finalize(net_deltas_start, net_deltas, 0)
+    return ()
+end
+
+# Matches the remaining n entries of a netted batch, recording 4 legs per match
+func _fill_orders_batch_netted{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr, net_deltas : DictAccess*}(
+        n : felt, buy_orders : ZZ_Message*, sell_orders : ZZ_Message*, fill_prices : PriceRatio*,
+        base_fill_quantities : felt*, legs : NetLeg*):
+    alloc_locals
+
+    if n == 0:
+        return ()
+    end
+
+    _match_orders(buy_orders, sell_orders, [fill_prices], [base_fill_quantities])
+    local syscall_ptr : felt* = syscall_ptr
+    local ecdsa_ptr : SignatureBuiltin* = ecdsa_ptr
+    Exchange_record_trade(
+        [base_fill_quantities],
+        [fill_prices],
+        buy_orders.order.base_asset,
+        buy_orders.order.quote_asset,
+        buy_orders.sender,
+        sell_orders.sender,
+        legs)
+
+    return _fill_orders_batch_netted(
+        n - 1,
+        buy_orders + ZZ_Message.SIZE,
+        sell_orders + ZZ_Message.SIZE,
+        fill_prices + PriceRatio.SIZE,
+        base_fill_quantities + 1,
+        legs + 4 * NetLeg.SIZE)
+end
+
+# Validates and settles a single match
+func _fill_order{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr}(
+        buy_order : ZZ_Message*, sell_order : ZZ_Message*, fill_price : PriceRatio,
+        base_fill_quantity : felt):
+    alloc_locals
+
+    _match_orders(buy_order, sell_order, fill_price, base_fill_quantity)
+
+    # execute trade
+    let (local fulfilled : felt) = Exchange_execute_trade(
+        base_fill_quantity,
+        fill_price,
+        buy_order.order.base_asset,
+        buy_order.order.quote_asset,
+        buy_order.sender,
+        sell_order.sender)
+
+    assert fulfilled = TRUE
+    return ()
+end
+
+# Validates a single match and records its fill in orderstatus. orderstatus is read per call, so an
+# order matched several times in one transaction is checked against its cumulative fill
+func _match_orders{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr}(
+        buy_order : ZZ_Message*, sell_order : ZZ_Message*, fill_price : PriceRatio,
+        base_fill_quantity : felt):
+    alloc_locals
+
     # validate message prefixes
-    let (local check_buy : felt) = validate_message_prefix(&buy_order)
-    let (local check_sell : felt) = validate_message_prefix(&sell_order)
+    let (local check_buy : felt) = validate_message_prefix(buy_order)
+    let (local check_sell : felt) = validate_message_prefix(sell_order)
 
     assert check_buy = TRUE
     assert check_sell = TRUE
 
     # validate order
-    let (local buymessagehash : felt) = compute_message_hash(&buy_order)
-    let (local sellmessagehash : felt) = compute_message_hash(&sell_order)
+    let (local buymessagehash : felt) = compute_message_hash(buy_order)
+    let (local sellmessagehash : felt) = compute_message_hash(sell_order)
     let (local filledbuy : felt) = orderstatus.read(buymessagehash)
     let (local filledsell : felt) = orderstatus.read(sellmessagehash)
+    let (local buy_epoch : felt) = order_epoch.read(buy_order.sender)
+    let (local sell_epoch : felt) = order_epoch.read(sell_order.sender)
 
     let (local check_order : felt) = check_order_valid(
-        &buy_order.order, &sell_order.order, filledbuy, filledsell, base_fill_quantity, fill_price)
+        &buy_order.order, &sell_order.order, filledbuy, filledsell, buy_epoch, sell_epoch,
+        base_fill_quantity, fill_price)
 
     assert check_order = TRUE
 
     # Check sigs
-    let (local check_buy_sig : felt) = verify_message_signature(&buy_order)
-    let (local check_sell_sig : felt) = verify_message_signature(&sell_order)
+    let (local buy_key : felt) = signing_key.read(buy_order.sender)
+    let (local check_buy_sig : felt) = verify_message_signature(
+        buy_order, buymessagehash, buy_key)
+    let (local sell_key : felt) = signing_key.read(sell_order.sender)
+    let (local check_sell_sig : felt) = verify_message_signature(
+        sell_order, sellmessagehash, sell_key)
 
     assert check_buy_sig = TRUE
     assert check_sell_sig = TRUE
 
-    # execute trade
-    let (local fulfilled : felt) = Exchange_execute_trade(
-        base_fill_quantity,
-        fill_price,
-        buy_order.order.base_asset,
-        buy_order.order.quote_asset,
-        buy_order.sender,
+    orderstatus.write(buymessagehash, filledbuy + base_fill_quantity)
+    orderstatus.write(sellmessagehash, filledsell + base_fill_quantity)
+    order_filled.emit(
+        buymessagehash, sellmessagehash, base_fill_quantity, fill_price, buy_order.sender,
         sell_order.sender)
+    return ()
+end
 
-    assert fulfilled = TRUE
+# Clears a batch auction: every buy and sell order is filled by the matching entry of buy_fills
+# and sell_fills, all at clearing_price. The fills of both sides must add up to the same base
+# quantity, and every order must trade the base and quote asset of the first buy order
+@external
+func settle_batch_auction{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr}(
+        buy_orders_len : felt, buy_orders : ZZ_Message*, buy_fills_len : felt,
+        buy_fills : felt*, sell_orders_len : felt, sell_orders : ZZ_Message*,
+        sell_fills_len : felt, sell_fills : felt*, clearing_price : PriceRatio):
+    alloc_locals
 
-    orderstatus.write(buymessagehash, filledbuy + base_fill_quantity)
-    orderstatus.write(sellmessagehash, filledsell + base_fill_quantity)
+    with_attr error_message("Invalid batch"):
+        assert_not_zero(buy_orders_len)
+        assert_not_zero(sell_orders_len)
+        assert buy_fills_len = buy_orders_len
+        assert sell_fills_len = sell_orders_len
+    end
+
+    local base_asset = buy_orders.order.base_asset
+    local quote_asset = buy_orders.order.quote_asset
+    let (local buy_hashes : felt*) = alloc()
+    let (local sell_hashes : felt*) = alloc()
+    let (local buy_total) = _fill_auction_orders(
+        buy_orders_len, buy_orders, buy_fills, buy_hashes, BUY_SIDE, base_asset, quote_asset,
+        clearing_price)
+    let (local sell_total) = _fill_auction_orders(
+        sell_orders_len, sell_orders, sell_fills, sell_hashes, SELL_SIDE, base_asset,
+        quote_asset, clearing_price)
+
+    with_attr error_message("Unbalanced auction"):
+        assert buy_total = sell_total
+    end
+
+    _settle_batch_auction(
+        buy_orders_len, buy_orders, buy_hashes, buy_fills, [buy_fills], sell_orders_len,
+        sell_orders, sell_hashes, sell_fills, [sell_fills], clearing_price)
     return ()
 end
 
+# Validates the remaining n orders of one side of an auction and records their fills in
+# orderstatus. Writes their hashes to hashes and returns the sum of their fills
+func _fill_auction_orders{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, ecdsa_ptr : SignatureBuiltin*,
+        range_check_ptr}(
+        n : felt, orders : ZZ_Message*, fills : felt*, hashes : felt*, side : felt,
+        base_asset : felt, quote_asset : felt, clearing_price : PriceRatio) -> (total : felt):
+    alloc_locals
+
+    if n == 0:
+        return (0)
+    end
+
+    let (local check_prefix : felt) = validate_message_prefix(orders)
+    assert check_prefix = TRUE
+
+    let (local messagehash : felt) = compute_message_hash(orders)
+    let (local filled : felt) = orderstatus.read(messagehash)
+    let (local epoch : felt) = order_epoch.read(orders.sender)
+    let (local check_order : felt) = check_auction_order(
+        &orders.order, side, base_asset, quote_asset, filled, epoch, [fills], clearing_price)
+    assert check_order = TRUE
+
+    let (local key : felt) = signing_key.read(orders.sender)
+    let (local check_sig : felt) = verify_message_signature(orders, messagehash, key)
+    assert check_sig = TRUE
+
+    orderstatus.write(messagehash, filled + [fills])
+    assert [hashes] = messagehash
+
+    let (total) = _fill_auction_orders(
+        n - 1, orders + ZZ_Message.SIZE, fills + 1, hashes + 1, side, base_asset, quote_asset,
+        clearing_price)
+    return (total + [fills])
+end
+
+# Pays out a validated auction by walking both sides in order and trading the smaller of the
+# remaining fills of the current buy and sell, so there are at most n_buys + n_sells - 1 trades.
+# buy_remaining and sell_remaining are what is left of the fills of the current orders
+func _settle_batch_auction{
+        syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        n_buys : felt, buy_orders : ZZ_Message*, buy_hashes : felt*, buy_fills : felt*,
+        buy_remaining : felt, n_sells : felt, sell_orders : ZZ_Message*, sell_hashes : felt*,
+        sell_fills : felt*, sell_remaining : felt, clearing_price : PriceRatio):
+    alloc_locals
+
+    if buy_remaining == 0:
+        if n_buys == 1:
+            # Both sides add up to the same total, so every sell is paid out as well
+            return ()
+        end
+        return _settle_batch_auction(
+            n_buys - 1, buy_orders + ZZ_Message.SIZE, buy_hashes + 1, buy_fills + 1,
+            [buy_fills + 1], n_sells, sell_orders, sell_hashes, sell_fills, sell_remaining,
+            clearing_price)
+    end
+    if sell_remaining == 0:
+        return _settle_batch_auction(
+            n_buys, buy_orders, buy_hashes, buy_fills, buy_remaining, n_sells - 1,
+            sell_orders + ZZ_Message.SIZE, sell_hashes + 1, sell_fills + 1, [sell_fills + 1],
+            clearing_price)
+    end
+
+    # The smaller of the two remaining fills
+    let (buy_is_smaller) = is_le(buy_remaining, sell_remaining)
+    local quantity = sell_remaining + buy_is_smaller * (buy_remaining - sell_remaining)
+
+    let (local fulfilled : felt) = Exchange_execute_trade(
+        quantity, clearing_price, buy_orders.order.base_asset, buy_orders.order.quote_asset,
+        buy_orders.sender, sell_orders.sender)
+    assert fulfilled = TRUE
+    order_filled.emit(
+        [buy_hashes], [sell_hashes], quantity, clearing_price, buy_orders.sender,
+        sell_orders.sender)
+
+    return _settle_batch_auction(
+        n_buys, buy_orders, buy_hashes, buy_fills, buy_remaining - quantity, n_sells,
+        sell_orders, sell_hashes, sell_fills, sell_remaining - quantity, clearing_price)
+end
+
 # Cancels an order by setting the fill quantity to greater than the order size
 @external
 func cancel_order{
@@ -101,11 +454,105 @@ func cancel_order{
 
     let (caller) = get_caller_address()
     assert caller = order.sender
+    let (check_order : felt) = validate_message_prefix(&order)
+    assert check_order = TRUE
     let (orderhash) = compute_message_hash(&order)
     orderstatus.write(orderhash, order.order.base_quantity + 1)
+    order_cancelled.emit(orderhash, order.sender)
+    return ()
+end
+
+# Cancels every order of the caller signed so far, by moving its epoch past their epoch
+@external
+func cancel_all_orders{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        ) -> (epoch : felt):
+    let (caller) = get_caller_address()
+    let (epoch) = order_epoch.read(caller)
+    order_epoch.write(caller, epoch + 1)
+    all_orders_cancelled.emit(caller, epoch + 1)
+    return (epoch + 1)
+end
+
+# Returns the lowest epoch that orders of sender can be filled with
+@view
+func get_order_epoch{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        sender : felt) -> (epoch : felt):
+    let (epoch) = order_epoch.read(sender)
+    return (epoch)
+end
+
+# Registers the Stark public key that signs the orders of the caller, so that their signatures
+# are checked with the ECDSA builtin instead of a call to the caller's is_valid_signature.
+# Registering again rotates the key, and registering 0 goes back to is_valid_signature
+@external
+func register_signing_key{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        public_key : felt):
+    let (caller) = get_caller_address()
+    signing_key.write(caller, public_key)
+    return ()
+end
+
+# Returns the public key registered by account, or 0
+@view
+func get_signing_key{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        account : felt) -> (public_key : felt):
+    let (public_key) = signing_key.read(account)
+    return (public_key)
+end
+
+##############
+# FEES
+##############
+
+func assert_only_owner{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}():
+    let (caller) = get_caller_address()
+    let (owner) = exchange_owner.read()
+    with_attr error_message("Caller is not the owner"):
+        assert caller = owner
+    end
+    return ()
+end
+
+# Sets the protocol fee paid by sellers, in basis points of the base quantity
+@external
+func set_protocol_fee_bips{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        bips : felt):
+    assert_only_owner()
+    with_attr error_message("Invalid fee"):
+        assert_nn_le(bips, 10000)
+    end
+    Exchange_protocol_fee_bips.write(bips)
     return ()
 end
 
+# Pays every accrued fee of asset to the owner in one transfer. Returns the amount paid
+@external
+func sweep_fees{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        asset : felt) -> (amount : felt):
+    alloc_locals
+    assert_only_owner()
+    let (local owner) = exchange_owner.read()
+    let (local amount) = Exchange_accrued_fees.read(asset)
+    Exchange_accrued_fees.write(asset, 0)
+    IERC20.transfer(contract_address=asset, recipient=owner, amount=Uint256(amount, 0))
+    return (amount)
+end
+
+@view
+func get_protocol_fee_bips{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        ) -> (bips : felt):
+    let (bips) = Exchange_protocol_fee_bips.read()
+    return (bips)
+end
+
+# Returns the fees of asset that sweep_fees would pay out
+@view
+func get_accrued_fees{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        asset : felt) -> (amount : felt):
+    let (amount) = Exchange_accrued_fees.read(asset)
+    return (amount)
+end
+
 # Returns an order status
 @view
 func get_order_status{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
@@ -113,3 +560,26 @@ func get_order_status{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_ch
     let (filled) = orderstatus.read(orderhash)
     return (filled)
 end
+
+# Returns the status of every order in hashes, in the same order
+@view
+func get_order_statuses{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        hashes_len : felt, hashes : felt*) -> (filled_len : felt, filled : felt*):
+    alloc_locals
+
+    let (local filled : felt*) = alloc()
+    _get_order_statuses(hashes_len, hashes, filled)
+    return (hashes_len, filled)
+end
+
+# Writes the status of the remaining n hashes to filled
+func _get_order_statuses{syscall_ptr : felt*, pedersen_ptr : HashBuiltin*, range_check_ptr}(
+        n : felt, hashes : felt*, filled : felt*):
+    if n == 0:
+        return ()
+    end
+
+    let (status) = orderstatus.read([hashes])
+    assert [filled] = status
+    return _get_order_statuses(n - 1, hashes + 1, filled + 1)
+end
@@ -0,0 +1,261 @@
+import os
+import pytest
+
+from lib.benchmark import (
+    DEFAULT_THRESHOLD,
+    execution_resources,
+    find_regressions,
+    load_baseline,
+    save_baseline,
+)
+from lib.profiler import StepProfiler
+from lib.utils import MAX_UINT256
+from zigzag_test import FEE_OWNER, fill_orders_batch_args
+
+# Run with BENCHMARK_UPDATE=1 to rewrite the baseline, and set BENCHMARK_THRESHOLD to
+# change the allowed relative regression per metric. The baseline is generated with
+# PYTHONHASHSEED=0; use the same seed to compare against it exactly.
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "zigzag_benchmark.json")
+
+# Set BENCHMARK_PROFILE_DIR to write a per-function profile of every scenario there: the folded
+# stacks of <scenario>.folded and <scenario>.<builtin>.folded for flamegraph tools, and a
+# summary in <scenario>.txt. See lib/profiler.py to diff the profiles of two runs.
+PROFILE_DIR = os.environ.get("BENCHMARK_PROFILE_DIR")
+
+# Fixed so that hashes, signatures and therefore resources are the same on every run.
+EXPIRATION = 2 ** 40
+
+
+@pytest.fixture
+def step_profiler():
+    """A StepProfiler entered for the test if BENCHMARK_PROFILE_DIR is set, otherwise None."""
+    if not PROFILE_DIR:
+        yield None
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with StepProfiler() as profiler:
+        yield profiler
+
+
+@pytest.mark.asyncio
+async def test_benchmark_entry_points(exchange, make_message, step_profiler):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    base_asset, quote_asset = exchange.base_asset, exchange.quote_asset
+
+    results = {}
+    if step_profiler is not None:
+        step_profiler.names.update(
+            {
+                contract.contract_address: "zigzag",
+                buyer.contract_address: "buyer",
+                seller.contract_address: "seller",
+                base_asset.contract_address: "base_asset",
+                quote_asset.contract_address: "quote_asset",
+            }
+        )
+
+    def record(scenario, execution_info):
+        results[scenario] = execution_resources(execution_info)
+        if step_profiler is not None:
+            # The invocation just made is the last one profiled
+            step_profiler.last.write(os.path.join(PROFILE_DIR, scenario))
+
+    async def fill(
+        scenario, buy_quantity, buy_price, sell_quantity, sell_price, fill_price, fill_quantity
+    ):
+        buy_message = make_message(buyer, 0, buy_quantity, buy_price, EXPIRATION)
+        sell_message = make_message(seller, 1, sell_quantity, sell_price, EXPIRATION)
+        execution_info = await contract.fill_order(
+            buy_order=buy_message.to_starknet_args(buyer_signer),
+            sell_order=sell_message.to_starknet_args(seller_signer),
+            fill_price=fill_price,
+            base_fill_quantity=fill_quantity,
+        ).invoke()
+        record(scenario, execution_info)
+        return buy_message, sell_message
+
+    await fill("full_fill", 1, (1, 1), 1, (1, 1), (1, 1), 1)
+    buy_message, _ = await fill("partial_fill", 25, (3, 1), 50, (1, 1), (2, 1), 25)
+    big = 2000000000000000000
+    await fill("big_quantities", big, (405736, 100000), big, (405736, 100000), (405736, 100000), big)
+    await fill("eth_usdt", big, (1, 249999999), big, (1, 249999999), (1, 249999999), big)
+
+    # A full fill with both signing keys registered, so that signatures are checked with the
+    # ECDSA builtin instead of the accounts' is_valid_signature. The keys are dropped again
+    # for the scenarios below
+    accounts = ((seller_signer, seller), (buyer_signer, buyer))
+    for signer, account in accounts:
+        await signer.send_transaction(
+            account, contract.contract_address, "register_signing_key", [signer.public_key]
+        )
+    await fill("full_fill_registered_keys", 2, (1, 1), 2, (1, 1), (1, 1), 2)
+    for signer, account in accounts:
+        await signer.send_transaction(
+            account, contract.contract_address, "register_signing_key", [0]
+        )
+
+    batch = [
+        (
+            make_message(buyer, 0, 10, (2, 1), EXPIRATION + i),
+            buyer_signer,
+            make_message(seller, 1, 10, (1, 1), EXPIRATION + i),
+            seller_signer,
+            (3, 2),
+            10,
+        )
+        for i in range(4)
+    ]
+    execution_info = await contract.fill_orders_batch(**fill_orders_batch_args(batch)).invoke()
+    record("fill_orders_batch_4", execution_info)
+
+    # The same fills with v2 packed messages, to compare calldata_len with the v1 scenarios
+    packed_buy = make_message(buyer, 0, 1, (1, 1), EXPIRATION + 200)
+    packed_sell = make_message(seller, 1, 1, (1, 1), EXPIRATION + 200)
+    execution_info = await contract.fill_order_packed(
+        buy_order=packed_buy.to_packed_starknet_args(buyer_signer),
+        sell_order=packed_sell.to_packed_starknet_args(seller_signer),
+        fill_price=(1, 1),
+        base_fill_quantity=1,
+    ).invoke()
+    record("full_fill_packed", execution_info)
+
+    packed_batch = [
+        (
+            make_message(buyer, 0, 10, (2, 1), EXPIRATION + 300 + i),
+            make_message(seller, 1, 10, (1, 1), EXPIRATION + 300 + i),
+        )
+        for i in range(4)
+    ]
+    execution_info = await contract.fill_orders_batch_packed(
+        buy_orders=[buy.to_packed_starknet_args(buyer_signer) for buy, _ in packed_batch],
+        sell_orders=[sell.to_packed_starknet_args(seller_signer) for _, sell in packed_batch],
+        fill_prices=[(3, 2)] * 4,
+        base_fill_quantities=[10] * 4,
+    ).invoke()
+    record("fill_orders_batch_packed_4", execution_info)
+
+    netted_batch = [
+        (
+            make_message(buyer, 0, 10, (2, 1), EXPIRATION + 100 + i),
+            buyer_signer,
+            make_message(seller, 1, 10, (1, 1), EXPIRATION + 100 + i),
+            seller_signer,
+            (3, 2),
+            10,
+        )
+        for i in range(4)
+    ]
+    execution_info = await contract.fill_orders_batch_netted(
+        **fill_orders_batch_args(netted_batch)
+    ).invoke()
+    record("fill_orders_batch_netted_4", execution_info)
+
+    # Two buys against two sells at one clearing price, settled in three trades
+    auction_buys = [make_message(buyer, 0, 10, (2, 1), EXPIRATION + 400 + i) for i in range(2)]
+    auction_sells = [make_message(seller, 1, q, (1, 1), EXPIRATION + 400) for q in (12, 8)]
+    execution_info = await contract.settle_batch_auction(
+        buy_orders=[buy.to_starknet_args(buyer_signer) for buy in auction_buys],
+        buy_fills=[10, 10],
+        sell_orders=[sell.to_starknet_args(seller_signer) for sell in auction_sells],
+        sell_fills=[12, 8],
+        clearing_price=(3, 2),
+    ).invoke()
+    record("settle_batch_auction_2x2", execution_info)
+
+    # Fills that pay a protocol fee. fill_order and fill_orders_batch collect it with one more
+    # transfer per trade, the netted batch accrues it in storage and sweep_fees pays it out
+    await contract.set_protocol_fee_bips(30).invoke(caller_address=FEE_OWNER)
+    fee_buy = make_message(buyer, 0, 1000, (1, 1), EXPIRATION + 500)
+    fee_sell = make_message(seller, 1, 1000, (1, 1), EXPIRATION + 500)
+    execution_info = await contract.fill_order(
+        buy_order=fee_buy.to_starknet_args(buyer_signer),
+        sell_order=fee_sell.to_starknet_args(seller_signer),
+        fill_price=(1, 1),
+        base_fill_quantity=1000,
+    ).invoke()
+    record("full_fill_fee", execution_info)
+
+    def fee_batch(offset):
+        return [
+            (
+                make_message(buyer, 0, 1000, (2, 1), EXPIRATION + offset + i),
+                buyer_signer,
+                make_message(seller, 1, 1000, (1, 1), EXPIRATION + offset + i),
+                seller_signer,
+                (3, 2),
+                1000,
+            )
+            for i in range(4)
+        ]
+
+    execution_info = await contract.fill_orders_batch(
+        **fill_orders_batch_args(fee_batch(600))
+    ).invoke()
+    record("fill_orders_batch_fee_4", execution_info)
+
+    execution_info = await contract.fill_orders_batch_netted(
+        **fill_orders_batch_args(fee_batch(700))
+    ).invoke()
+    record("fill_orders_batch_netted_fee_4", execution_info)
+
+    execution_info = await contract.sweep_fees(base_asset.contract_address).invoke(
+        caller_address=FEE_OWNER
+    )
+    record("sweep_fees", execution_info)
+    await contract.set_protocol_fee_bips(0).invoke(caller_address=FEE_OWNER)
+
+    cancel_message = make_message(seller, 1, 5, (1, 1), EXPIRATION)
+    execution_info = await contract.cancel_order(
+        cancel_message.to_starknet_args(seller_signer)
+    ).invoke(caller_address=seller.contract_address)
+    record("cancel_order", execution_info)
+
+    # Cancels every order of the seller, so no scenario below may fill one
+    execution_info = await contract.cancel_all_orders().invoke(
+        caller_address=seller.contract_address
+    )
+    record("cancel_all_orders", execution_info)
+
+    execution_info = await contract.get_order_status(buy_message.hash()).call()
+    record("get_order_status", execution_info)
+
+    execution_info = await contract.get_order_statuses(
+        [buy_message.hash() + i for i in range(100)]
+    ).call()
+    record("get_order_statuses_100", execution_info)
+
+    # The same approve sent alone and as one of four calls of a multicall; divide the
+    # multicall metrics by 4 to compare per logical operation.
+    approve_calldata = [contract.contract_address, *MAX_UINT256]
+    execution_info = await seller_signer.send_transaction(
+        seller, base_asset.contract_address, "approve", approve_calldata
+    )
+    record("account_execute_approve", execution_info)
+    execution_info = await seller_signer.send_transactions(
+        seller, [(base_asset.contract_address, "approve", approve_calldata)] * 4
+    )
+    record("account_multicall_approve_4", execution_info)
+
+    if os.environ.get("BENCHMARK_UPDATE"):
+        save_baseline(BASELINE_FILE, results)
+        return
+
+    threshold = float(os.environ.get("BENCHMARK_THRESHOLD", DEFAULT_THRESHOLD))
+    regressions = find_regressions(results, load_baseline(BASELINE_FILE), threshold)
+    assert not regressions, "\n".join(regressions)
+
+
+def test_find_regressions():
+    baseline = {"fill": {"n_steps": 1000, "pedersen_builtin": 10}}
+    results = {
+        "fill": dict.fromkeys(
+            ("range_check_builtin", "ecdsa_builtin", "n_memory_holes", "calldata_len"), 0
+        ),
+        "cancel": {},
+    }
+    results["fill"].update(n_steps=1010, pedersen_builtin=11)
+    assert find_regressions(results, baseline, threshold=0.05) == [
+        "cancel: no baseline",
+        "fill.pedersen_builtin: 10 -> 11",
+    ]
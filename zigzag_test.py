@@ -9,120 +9,168 @@ from starkware.crypto.signature.signature import (
     private_to_stark_key,
 )
 from starkware.starknet.public.abi import get_selector_from_name
-from lib.utils import Signer, str_to_felt
+from lib.contract_cache import deploy_contract
+from lib.utils import Signer
+from lib.zz_message import (
+    DOMAIN_PREFIX,
+    MESSAGE_PREFIX,
+    STARKNET_DOMAIN_TYPE_HASH,
+    ORDER_TYPE_HASH,
+    PriceRatio,
+    Order,
+    ZZ_Message,
+)
 
 # The path to the contract source code.
 CONTRACT_FILE = os.path.join(os.path.dirname(__file__), "zigzag.cairo")
 ERC20_FILE = os.path.join(os.path.dirname(__file__), "lib/ERC20.cairo")
 ACCOUNT_FILE = os.path.join(os.path.dirname(__file__), "lib/Account.cairo")
-
-STARKNET_DOMAIN_TYPE_HASH = get_selector_from_name(
-    "StarkNetDomain(name:felt,version:felt,chainId:felt)"
-)
-ORDER_TYPE_HASH = get_selector_from_name(
-    "Order(base_asset:felt,quote_asset:felt,side:felt,base_quantity:felt,price:PriceRatio,expiration:felt)PriceRatio(numerator:felt,denominator:felt)"
-)
+# Address that may set the protocol fee and is paid the swept fees
+FEE_OWNER = 0xFEE
 
 
 def uint(a):
     return (int(a), 0)
 
 
+def flatten(args):
+    """Flattens nested struct arguments into the felts of their calldata."""
+    if isinstance(args, (tuple, list)):
+        return [felt for arg in args for felt in flatten(arg)]
+    return [args]
+
+
 def unixms():
     return int(time.time() * 100)
 
 
-class PriceRatio:
-    def __init__(self, numerator, denominator):
-        self.numerator = numerator
-        self.denominator = denominator
-
-    def to_starknet_args(self):
-        return (self.numerator, self.denominator)
-
-
-class Order:
-    def __init__(self, base_asset, quote_asset, side, base_quantity, price, expiration):
-        self.base_asset = base_asset
-        self.quote_asset = quote_asset
-        self.side = side
-        self.base_quantity = base_quantity
-        self.price = PriceRatio(*price)
-        self.expiration = expiration
-
-    def hash(self):
-        order_hash = pedersen_hash(self.base_asset, self.quote_asset)
-        order_hash = pedersen_hash(order_hash, self.side)
-        order_hash = pedersen_hash(order_hash, self.base_quantity)
-        order_hash = pedersen_hash(order_hash, self.price.numerator)
-        order_hash = pedersen_hash(order_hash, self.price.denominator)
-        order_hash = pedersen_hash(order_hash, self.expiration)
-        return order_hash
-
-    def to_starknet_args(self):
-        return (
-            self.base_asset,
-            self.quote_asset,
-            self.side,
-            self.base_quantity,
-            self.price.to_starknet_args(),
-            self.expiration,
-        )
+def fill_orders_batch_args(fills):
+    """Builds fill_orders_batch arguments from a list of
+    (buy_message, buy_signer, sell_message, sell_signer, fill_price, base_fill_quantity) tuples.
+    """
+    return dict(
+        buy_orders=[buy.to_starknet_args(buy_signer) for buy, buy_signer, *_ in fills],
+        sell_orders=[sell.to_starknet_args(sell_signer) for _, _, sell, sell_signer, *_ in fills],
+        fill_prices=[tuple(fill[4]) for fill in fills],
+        base_fill_quantities=[fill[5] for fill in fills],
+    )
 
 
-class StarkNetDomain:
-    def __init__(self, name, version, chain_id):
-        self.name = name
-        self.version = version
-        self.chain_id = chain_id
-
-    def hash(self):
-        order_hash = pedersen_hash(self.name, self.version)
-        order_hash = pedersen_hash(order_hash, self.chain_id)
-        return order_hash
-
-    def to_starknet_args(self):
-        return (self.name, self.version, self.chain_id)
-
-
-class ZZ_Message:
-    def __init__(self, message_prefix, domain_prefix, sender, order):
-        self.message_prefix = message_prefix
-        self.domain_prefix = domain_prefix
-        self.sender = sender
-        self.order = order
-
-    def hash(self):
-        order_hash = pedersen_hash(self.message_prefix, STARKNET_DOMAIN_TYPE_HASH)
-        order_hash = pedersen_hash(order_hash, self.domain_prefix.name)
-        order_hash = pedersen_hash(order_hash, self.domain_prefix.version)
-        order_hash = pedersen_hash(order_hash, self.domain_prefix.chain_id)
-        order_hash = pedersen_hash(order_hash, self.sender)
-        order_hash = pedersen_hash(order_hash, ORDER_TYPE_HASH)
-        order_hash = pedersen_hash(order_hash, self.order.base_asset)
-        order_hash = pedersen_hash(order_hash, self.order.quote_asset)
-        order_hash = pedersen_hash(order_hash, self.order.side)
-        order_hash = pedersen_hash(order_hash, self.order.base_quantity)
-        order_hash = pedersen_hash(order_hash, self.order.price.numerator)
-        order_hash = pedersen_hash(order_hash, self.order.price.denominator)
-        order_hash = pedersen_hash(order_hash, self.order.expiration)
-        return order_hash
-
-    def sign(self, signer):
-        order_hash = self.hash()
-        r, s = signer.sign(order_hash)
-        return r, s
-
-    def to_starknet_args(self, signer):
-        r, s = self.sign(signer)
-        return (
-            self.message_prefix,
-            self.domain_prefix.to_starknet_args(),
-            self.sender,
-            self.order.to_starknet_args(),
-            r,
-            s,
-        )
+def random_message(rng, side):
+    """A ZZ_Message of a random sender, quantity, price, expiration and epoch."""
+    order = Order(
+        0x111,
+        0x222,
+        side,
+        rng.randrange(1, 10 ** 20),
+        (rng.randrange(1, 10 ** 6), rng.randrange(1, 10 ** 6)),
+        rng.randrange(2 ** 40),
+        rng.randrange(3),
+    )
+    return ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, rng.randrange(2 ** 251), order)
+
+
+def assert_same_message(decoded, expected):
+    """Asserts that two (ZZ_Message, (sig_r, sig_s)) pairs have the same signed calldata."""
+    (message, signature), (expected_message, expected_signature) = decoded, expected
+    assert signature == expected_signature
+    args = message.to_signed_starknet_args(*signature)
+    assert args == expected_message.to_signed_starknet_args(*signature)
+
+
+async def deploy_exchange(starknet, seller_signer, buyer_signer):
+    """Deploys the seller and buyer accounts, a base and a quote token minted to them
+    and the exchange, with both allowances set. Fixed salts keep the addresses, and so
+    the message hashes, the same on every run.
+    """
+    seller = await deploy_contract(
+        starknet,
+        ACCOUNT_FILE,
+        contract_address_salt=1,
+        constructor_calldata=[seller_signer.public_key],
+    )
+    buyer = await deploy_contract(
+        starknet,
+        ACCOUNT_FILE,
+        contract_address_salt=2,
+        constructor_calldata=[buyer_signer.public_key],
+    )
+    base_asset = await deploy_contract(
+        starknet,
+        ERC20_FILE,
+        contract_address_salt=3,
+        constructor_calldata=[seller.contract_address],
+    )
+    quote_asset = await deploy_contract(
+        starknet,
+        ERC20_FILE,
+        contract_address_salt=4,
+        constructor_calldata=[buyer.contract_address],
+    )
+    contract = await deploy_contract(
+        starknet, CONTRACT_FILE, contract_address_salt=5, constructor_calldata=[FEE_OWNER]
+    )
+    await seller.initialize(seller.contract_address).invoke()
+    await buyer.initialize(buyer.contract_address).invoke()
+
+    approve_amount = uint(1e25)
+    await seller_signer.send_transaction(
+        seller,
+        base_asset.contract_address,
+        "approve",
+        [contract.contract_address, *approve_amount],
+    )
+    await buyer_signer.send_transaction(
+        buyer,
+        quote_asset.contract_address,
+        "approve",
+        [contract.contract_address, *approve_amount],
+    )
+    return seller, buyer, base_asset, quote_asset, contract
+
+
+async def get_balances(tokens, accounts):
+    return [
+        (await token.balance_of(account.contract_address).call()).result.res
+        for token in tokens
+        for account in accounts
+    ]
+
+
+def read_cairo_const(path, name):
+    with open(path) as f:
+        for line in f:
+            if line.startswith(f"const {name} = "):
+                return int(line.split("=")[1].strip(), 0)
+    raise KeyError(name)
+
+
+def test_domain_hash_midstate():
+    # compute_message_hash resumes the ZZ_Message.hash chain from DOMAIN_HASH_MIDSTATE
+    midstate = pedersen_hash(MESSAGE_PREFIX, STARKNET_DOMAIN_TYPE_HASH)
+    midstate = pedersen_hash(midstate, DOMAIN_PREFIX.name)
+    midstate = pedersen_hash(midstate, DOMAIN_PREFIX.version)
+    midstate = pedersen_hash(midstate, DOMAIN_PREFIX.chain_id)
+    config_file = os.path.join(os.path.dirname(__file__), "lib/config.cairo")
+    assert read_cairo_const(config_file, "DOMAIN_HASH_MIDSTATE") == midstate
+    assert read_cairo_const(config_file, "ORDER_TYPE_HASH") == ORDER_TYPE_HASH
+
+    order = Order(123, 456, 1, 2000000000000000000, (1, 249999999), 1650000000, 7)
+    message = ZZ_Message(MESSAGE_PREFIX, DOMAIN_PREFIX, 789, order)
+    order_hash = pedersen_hash(midstate, message.sender)
+    for item in (
+        ORDER_TYPE_HASH,
+        order.base_asset,
+        order.quote_asset,
+        order.side,
+        order.base_quantity,
+        order.price.numerator,
+        order.price.denominator,
+        order.expiration,
+        order.epoch,
+    ):
+        order_hash = pedersen_hash(order_hash, item)
+    assert message.hash() == order_hash
 
 
 # The testing library uses python's asyncio. So the following
@@ -139,19 +187,19 @@ async def test_send_order():
     signer3 = Signer(8439329023933332923)
 
     # Deploy the contract.
-    base_asset_owner = await starknet.deploy(
-        source=ACCOUNT_FILE, constructor_calldata=[signer1.public_key]
+    base_asset_owner = await deploy_contract(
+        starknet, ACCOUNT_FILE, constructor_calldata=[signer1.public_key]
     )
-    quote_asset_owner = await starknet.deploy(
-        source=ACCOUNT_FILE, constructor_calldata=[signer2.public_key]
+    quote_asset_owner = await deploy_contract(
+        starknet, ACCOUNT_FILE, constructor_calldata=[signer2.public_key]
     )
-    base_asset = await starknet.deploy(
-        source=ERC20_FILE, constructor_calldata=[base_asset_owner.contract_address]
+    base_asset = await deploy_contract(
+        starknet, ERC20_FILE, constructor_calldata=[base_asset_owner.contract_address]
     )
-    quote_asset = await starknet.deploy(
-        source=ERC20_FILE, constructor_calldata=[quote_asset_owner.contract_address]
+    quote_asset = await deploy_contract(
+        starknet, ERC20_FILE, constructor_calldata=[quote_asset_owner.contract_address]
     )
-    contract = await starknet.deploy(source=CONTRACT_FILE, constructor_calldata=[])
+    contract = await deploy_contract(starknet, CONTRACT_FILE, constructor_calldata=[FEE_OWNER])
     await base_asset_owner.initialize(base_asset_owner.contract_address).invoke()
     await quote_asset_owner.initialize(quote_asset_owner.contract_address).invoke()
 
@@ -202,10 +250,6 @@ async def test_send_order():
     exec_price = (1, 1)
     sell_price = (1, 1)
     expiration = unixms() + 1
-    message_prefix = str_to_felt("StarkNet Message")
-    domain_prefix = StarkNetDomain(
-        str_to_felt("zigzag.exchange"), 1, str_to_felt("SN_GOERLI")
-    )
     sell_order = Order(
         base_asset.contract_address,
         quote_asset.contract_address,
@@ -223,10 +267,10 @@ async def test_send_order():
         expiration,
     )
     sell_message = ZZ_Message(
-        message_prefix, domain_prefix, base_asset_owner.contract_address, sell_order
+        MESSAGE_PREFIX, DOMAIN_PREFIX, base_asset_owner.contract_address, sell_order
     )
     buy_message = ZZ_Message(
-        message_prefix, domain_prefix, quote_asset_owner.contract_address, buy_order
+        MESSAGE_PREFIX, DOMAIN_PREFIX, quote_asset_owner.contract_address, buy_order
     )
 
     await contract.fill_order(
@@ -294,10 +338,10 @@ async def test_send_order():
     )
 
     sell_message = ZZ_Message(
-        message_prefix, domain_prefix, base_asset_owner.contract_address, sell_order
+        MESSAGE_PREFIX, DOMAIN_PREFIX, base_asset_owner.contract_address, sell_order
     )
     buy_message = ZZ_Message(
-        message_prefix, domain_prefix, quote_asset_owner.contract_address, buy_order
+        MESSAGE_PREFIX, DOMAIN_PREFIX, quote_asset_owner.contract_address, buy_order
     )
 
     await contract.fill_order(
@@ -343,7 +387,7 @@ async def test_send_order():
         )
 
         buy_message = ZZ_Message(
-            message_prefix, domain_prefix, quote_asset_owner.contract_address, buy_order
+            MESSAGE_PREFIX, DOMAIN_PREFIX, quote_asset_owner.contract_address, buy_order
         )
 
         await contract.fill_order(
@@ -367,7 +411,7 @@ async def test_send_order():
     )
 
     buy_message = ZZ_Message(
-        message_prefix, domain_prefix, quote_asset_owner.contract_address, buy_order
+        MESSAGE_PREFIX, DOMAIN_PREFIX, quote_asset_owner.contract_address, buy_order
     )
     await contract.fill_order(
         sell_order=sell_message.to_starknet_args(signer1),
@@ -419,10 +463,10 @@ async def test_send_order():
         )
 
         sell_message = ZZ_Message(
-            message_prefix, domain_prefix, base_asset_owner.contract_address, sell_order
+            MESSAGE_PREFIX, DOMAIN_PREFIX, base_asset_owner.contract_address, sell_order
         )
         buy_message = ZZ_Message(
-            message_prefix, domain_prefix, quote_asset_owner.contract_address, buy_order
+            MESSAGE_PREFIX, DOMAIN_PREFIX, quote_asset_owner.contract_address, buy_order
         )
         await contract.fill_order(
             sell_order=sell_message.to_starknet_args(signer1),
@@ -457,10 +501,10 @@ async def test_send_order():
     )
 
     sell_message = ZZ_Message(
-        message_prefix, domain_prefix, base_asset_owner.contract_address, sell_order
+        MESSAGE_PREFIX, DOMAIN_PREFIX, base_asset_owner.contract_address, sell_order
     )
     buy_message = ZZ_Message(
-        message_prefix, domain_prefix, quote_asset_owner.contract_address, buy_order
+        MESSAGE_PREFIX, DOMAIN_PREFIX, quote_asset_owner.contract_address, buy_order
     )
 
     await contract.fill_order(
@@ -510,10 +554,10 @@ async def test_send_order():
     )
 
     sell_message = ZZ_Message(
-        message_prefix, domain_prefix, base_asset_owner.contract_address, sell_order
+        MESSAGE_PREFIX, DOMAIN_PREFIX, base_asset_owner.contract_address, sell_order
     )
     buy_message = ZZ_Message(
-        message_prefix, domain_prefix, quote_asset_owner.contract_address, buy_order
+        MESSAGE_PREFIX, DOMAIN_PREFIX, quote_asset_owner.contract_address, buy_order
     )
     await contract.fill_order(
         sell_order=sell_message.to_starknet_args(signer1),
@@ -535,3 +579,97 @@ async def test_send_order():
     ).call()
     buy_order_filled = await contract.get_order_status(buy_message.hash()).call()
     sell_order_filled = await contract.get_order_status(sell_message.hash()).call()
+
+
+@pytest.mark.asyncio
+async def test_fill_orders_batch(exchange, make_message):
+    seller_signer, buyer_signer = exchange.seller_signer, exchange.buyer_signer
+    seller, buyer, contract = exchange.seller, exchange.buyer, exchange.contract
+    tokens = [exchange.base_asset, exchange.quote_asset]
+    accounts = [seller, buyer]
+
+    def build_fills(expiration):
+        def message(account, side, base_quantity, price):
+            return make_message(account, side, base_quantity, price, expiration)
+
+        # The same sell order is matched three times and filled completely
+        sell_message = message(seller, 1, 50, (1, 1))
+        return [
+            (message(buyer, 0, 20, (2, 1)), buyer_signer, sell_message, seller_signer, (3, 2), 20),
+            (message(buyer, 0, 10, (1, 1)), buyer_signer, sell_message, seller_signer, (1, 1), 10),
+            (message(buyer, 0, 30, (5, 4)), buyer_signer, sell_message, seller_signer, (6, 5), 20),
+            (
+                message(buyer, 0, 7, (4, 1)),
+                buyer_signer,
+                message(seller, 1, 9, (3, 1)),
+                seller_signer,
+                (4, 1),
+                7,
+            ),
+        ]
+
+    async def order_statuses(fills):
+        hashes = [msg.hash() for fill in fills for msg in (fill[0], fill[2])]
+        return [(await contract.get_order_status(h).call()).result.filled for h in hashes]
+
+    def token_calls(execution_info):
+        token_addresses = [token.contract_address for token in tokens]
+        return sum(call.to_address in token_addresses for call in execution_info.internal_calls)
+
+    # Settle one fill at a time
+    sequential_fills = build_fills(unixms() + 1000)
+    before = await get_balances(tokens, accounts)
+    sequential_token_calls = 0
+    for buy, buy_signer, sell, sell_signer, fill_price, fill_quantity in sequential_fills:
+        execution_info = await contract.fill_order(
+            buy_order=buy.to_starknet_args(buy_signer),
+            sell_order=sell.to_starknet_args(sell_signer),
+            fill_price=fill_price,
+            base_fill_quantity=fill_quantity,
+        ).invoke()
+        sequential_token_calls += token_calls(execution_info)
+    after = await get_balances(tokens, accounts)
+    sequential_deltas = [a[0] - b[0] for a, b in zip(after, before)]
+
+    # Settle the same fills on fresh orders in one batch
+    batch_fills = build_fills(unixms() + 2000)
+    before = after
+    await contract.fill_orders_batch(**fill_orders_batch_args(batch_fills)).invoke()
+    after = await get_balances(tokens, accounts)
+    batch_deltas = [a[0] - b[0] for a, b in zip(after, before)]
+
+    assert batch_deltas == sequential_deltas
+    assert batch_deltas == [-57, 57, 92, -92]
+    assert await order_statuses(batch_fills) == await order_statuses(sequential_fills)
+    assert await order_statuses(batch_fills) == [20, 50, 10, 50, 20, 50, 7, 7]
+
+    # Netted settlement transfers once per (asset, account) instead of twice per fill
+    netted_fills = build_fills(unixms() + 2500)
+    before = after
+    execution_info = await contract.fill_orders_batch_netted(
+        **fill_orders_batch_args(netted_fills)
+    ).invoke()
+    after = await get_balances(tokens, accounts)
+    netted_deltas = [a[0] - b[0] for a, b in zip(after, before)]
+
+    assert netted_deltas == sequential_deltas
+    assert await order_statuses(netted_fills) == await order_statuses(sequential_fills)
+    assert sequential_token_calls == 8
+    assert token_calls(execution_info) == 4
+    exchange_balances = await get_balances(tokens, [contract])
+    assert exchange_balances == [uint(0), uint(0)]
+
+    # Overfilling an order across matches reverts the whole batch
+    overfill = build_fills(unixms() + 3000)
+    overfill[2] = overfill[2][:5] + (21,)
+    with pytest.raises(Exception):
+        await contract.fill_orders_batch(**fill_orders_batch_args(overfill)).invoke()
+    with pytest.raises(Exception):
+        await contract.fill_orders_batch_netted(**fill_orders_batch_args(overfill)).invoke()
+    assert await order_statuses(overfill) == [0] * 8
+
+    # Mismatched array lengths are rejected
+    args = fill_orders_batch_args(batch_fills)
+    args["base_fill_quantities"] = args["base_fill_quantities"][:-1]
+    with pytest.raises(Exception):
+        await contract.fill_orders_batch(**args).invoke()